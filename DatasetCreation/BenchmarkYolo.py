@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from ModelExport import BACKENDS, load_detector
+from VideoPipeline import StageTimer, open_source
+
+STAGES = ("decode", "preprocess", "inference", "postprocess", "render")
+
+
+def peak_rss_bytes():
+    """
+    Picco di memoria residente del processo, in byte (resource su Linux/macOS, psutil altrove; None se assenti).
+
+    Copia di FoundedDatasets/DatasetIO.peak_rss_bytes: gli script di questa cartella si lanciano da qui e
+    importano solo moduli vicini, quindi DatasetIO non è importabile senza toccare sys.path. Se cambia una, va
+    cambiata anche l'altra.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # Linux riporta KB, macOS byte
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def read_frame(cap):
+    """Legge un frame; a fine video riparte dall'inizio, così ogni run elabora lo stesso numero di frame."""
+    ret, frame = cap.read()
+    if not ret:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        ret, frame = cap.read()
+    return frame if ret else None
+
+
+def benchmark(model, video, imgsz, frames=300, warmup=20, save_path=None):
+    """
+    Misura un modello su un video a una risoluzione, senza finestra.
+
+    Dopo warmup frame non misurati (inizializzazione del framework, cache, allocazioni) ogni frame viene
+    cronometrato per stadio: decodifica, preprocess/inference/postprocess (tempi interni di ultralytics),
+    render (disegno dei box e, se richiesto, scrittura del video annotato).
+
+    Returns:
+        dict: throughput, latenza end-to-end e percentili per stadio (in ms), picco RSS
+    """
+    cap, _ = open_source(video)
+    writer = None
+    if save_path:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        writer = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+    with torch.no_grad():
+        for _ in range(warmup):
+            frame = read_frame(cap)
+            if frame is None:
+                raise RuntimeError(f"Impossibile leggere il video: {video}")
+            model(frame, imgsz=imgsz, verbose=False)
+
+        timer = StageTimer()
+        start_time = time.perf_counter()
+        for _ in range(frames):
+            start = time.perf_counter()
+            frame = read_frame(cap)
+            if frame is None:
+                raise RuntimeError(f"Lettura del frame fallita durante la misura: {video}")
+            timer.add("decode", time.perf_counter() - start)
+
+            result = model(frame, imgsz=imgsz, verbose=False)[0]
+            for stage in ("preprocess", "inference", "postprocess"):
+                timer.add(stage, result.speed[stage] / 1000)
+
+            start = time.perf_counter()
+            annotated = result.plot()
+            if writer is not None:
+                writer.write(annotated)
+            timer.add("render", time.perf_counter() - start)
+        seconds = time.perf_counter() - start_time
+
+    cap.release()
+    if writer is not None:
+        writer.release()
+
+    # Latenza end-to-end di ogni frame: somma dei suoi stadi
+    latency = np.sum([timer.samples[stage] for stage in STAGES], axis=0) * 1000
+    return {
+        "imgsz": imgsz,
+        "frames": frames,
+        "warmup": warmup,
+        "seconds": seconds,
+        "throughput_fps": frames / seconds,
+        "latency_ms": {"mean": float(latency.mean()),
+                       **{f"p{p}": float(v) for p, v in zip((50, 90, 99), np.percentile(latency, (50, 90, 99)))}},
+        "stages_ms": {stage: {"mean": timer.mean_ms(stage, last=frames), **timer.percentiles_ms(stage)} for stage in STAGES},
+        "peak_rss_bytes": peak_rss_bytes(),  # del processo: include le risoluzioni già misurate
+    }
+
+
+def environment():
+    """Informazioni sulla macchina, per rendere confrontabili i report."""
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "torch": torch.__version__, "torch_threads": torch.get_num_threads(),
+            "opencv": cv2.__version__}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark headless di un modello YOLO su video: latenze per stadio e percentili.")
+    parser.add_argument("--model", default="../yolo11n.pt", help="Modello YOLO (default: ../yolo11n.pt)")
+    parser.add_argument("--video", default="../Video/video1.mp4", help="Video di test (default: ../Video/video1.mp4)")
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[320], help="Risoluzioni da confrontare (default: 320)")
+    parser.add_argument("--frames", type=int, default=300, help="Frame misurati per risoluzione (default: 300)")
+    parser.add_argument("--warmup", type=int, default=20, help="Frame di warmup non misurati (default: 20)")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS, help="Backend di inferenza (default: torch)")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di calcolo del backend (default: quelli del backend)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il report in questo file JSON")
+    parser.add_argument("--save-video", default=None, help="Cartella dove scrivere i video annotati (uno per risoluzione)")
+    args = parser.parse_args()
+
+    report = {"model": args.model, "backend": args.backend, "video": args.video, "runs": []}
+    for imgsz in args.imgsz:
+        # I modelli ONNX hanno la dimensione di input fissa: un export (in cache) per risoluzione
+        model = load_detector(args.model, args.backend, imgsz, args.threads)
+        report["environment"] = environment()
+        save_path = None
+        if args.save_video:
+            os.makedirs(args.save_video, exist_ok=True)
+            save_path = os.path.join(args.save_video, f"{os.path.splitext(os.path.basename(args.video))[0]}_{imgsz}.mp4")
+        run = benchmark(model, args.video, imgsz, args.frames, args.warmup, save_path)
+        report["runs"].append(run)
+
+        stages = "  ".join(f"{stage} {run['stages_ms'][stage]['mean']:.1f}" for stage in STAGES)
+        print(f"imgsz {imgsz}: {run['throughput_fps']:.1f} FPS, latenza p50 {run['latency_ms']['p50']:.1f} / "
+              f"p90 {run['latency_ms']['p90']:.1f} / p99 {run['latency_ms']['p99']:.1f} ms  [{stages} ms]")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from ModelExport import _file_digest
+from VideoPipeline import WINDOW_NAME, FpsMeter, draw_overlay, handle_keys
+
+CACHE_DIR = "../detections"
+RECORD_CONF = 0.05  # le detection vengono salvate da questa confidenza: ogni soglia più alta si ottiene in replay
+COLUMNS = ("frame", "x1", "y1", "x2", "y2", "conf", "cls")
+
+
+def video_digest(path, chunk=1 << 20):
+    """
+    Impronta di un video senza leggerlo tutto: dimensione più tre blocchi da 1 MB (inizio, metà, fine).
+    Basta a distinguere video diversi o ricodificati, e costa pochi millisecondi anche su file di GB.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - chunk // 2), max(0, size - chunk)):
+            f.seek(offset)
+            h.update(f.read(chunk))
+    return h.hexdigest()[:16]
+
+
+def cache_path_for(video, model_path, backend="torch", imgsz=320, record_conf=RECORD_CONF, cache_dir=CACHE_DIR):
+    """File di cache per (video, modello, parametri di inferenza): cambia se cambia uno qualsiasi dei tre."""
+    params = json.dumps({"backend": backend, "imgsz": imgsz, "record_conf": record_conf}, sort_keys=True)
+    key = hashlib.sha256(f"{video_digest(video)}:{_file_digest(model_path)}:{params}".encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(video))[0]
+    return os.path.join(cache_dir, f"{stem}_{key}.npz")
+
+
+def save_cache(path, columns, frames, meta):
+    """Scrive la cache (colonne NumPy compresse + metadati JSON) in modo atomico."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, frames=np.int64(frames), meta=np.array(json.dumps(meta)),
+                        **{name: columns[name] for name in COLUMNS})
+    os.replace(tmp, path)
+
+
+class DetectionCache:
+    """Detection di un video lette dalla cache: per frame, filtrabili per confidenza senza rifare l'inferenza."""
+
+    def __init__(self, path):
+        data = np.load(path)
+        self.columns = {name: data[name] for name in COLUMNS}
+        self.frames = int(data["frames"])
+        self.meta = json.loads(str(data["meta"]))
+        self.names = {int(k): v for k, v in self.meta.get("names", {}).items()}
+        # Le righe sono ordinate per frame: offsets[i]:offsets[i + 1] sono le detection del frame i
+        self.offsets = np.searchsorted(self.columns["frame"], np.arange(self.frames + 1))
+
+    def detections(self, frame_index, conf=0.25):
+        """Detection (n, 6) x1, y1, x2, y2, conf, cls del frame, con confidenza >= conf."""
+        start, end = self.offsets[frame_index], self.offsets[frame_index + 1]
+        rows = np.stack([self.columns[name][start:end] for name in COLUMNS[1:]], axis=1).astype(np.float32)
+        return rows[rows[:, 4] >= conf]
+
+
+class CachingDetector:
+    """
+    Avvolge un detector (ultralytics.YOLO o OnnxDetector) e registra tutte le detection mentre il video viene elaborato.
+
+    I frame arrivano al modello in ordine in tutte le modalità di Yolo11Test (sequenziale, pipeline, batch),
+    quindi l'indice del frame è semplicemente un contatore. L'inferenza viene fatta a RECORD_CONF, ma i risultati
+    restituiti sono filtrati alla confidenza richiesta: quello che si vede è identico a un'esecuzione normale.
+    """
+
+    def __init__(self, model, conf=0.25, record_conf=RECORD_CONF):
+        self.model = model
+        self.names = getattr(model, "names", {})
+        self.conf = conf
+        self.record_conf = record_conf
+        self.rows = []
+        self.frames = 0
+
+    def __call__(self, source, imgsz=None, verbose=False, **kwargs):
+        results = self.model(source, imgsz=imgsz, verbose=verbose, conf=self.record_conf, **kwargs)
+        filtered = []
+        for result in results:
+            boxes = result.boxes
+            if len(boxes):
+                xyxy = boxes.xyxy.cpu().numpy()
+                conf = boxes.conf.cpu().numpy()
+                cls = boxes.cls.cpu().numpy()
+                self.rows.append(np.column_stack([np.full(len(conf), self.frames), xyxy, conf, cls]))
+            self.frames += 1
+            filtered.append(result[boxes.conf >= self.conf] if len(boxes) else result)
+        return filtered
+
+    def save(self, path, meta):
+        rows = np.concatenate(self.rows) if self.rows else np.zeros((0, 7))
+        columns = {"frame": rows[:, 0].astype(np.int32), "cls": rows[:, 6].astype(np.int16)}
+        for i, name in enumerate(("x1", "y1", "x2", "y2", "conf"), start=1):
+            columns[name] = rows[:, i].astype(np.float32)
+        save_cache(path, columns, self.frames, dict(meta, names={int(k): v for k, v in dict(self.names).items()}))
+
+
+def draw_detections(frame, detections, names):
+    """Disegna le detection con OpenCV (senza ultralytics/torch: il replay resta alla velocità di decodifica)."""
+    for x1, y1, x2, y2, conf, cls in detections.tolist():
+        color = tuple(int(c) for c in np.random.default_rng(int(cls)).integers(64, 256, 3))
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+        cv2.putText(frame, f"{names.get(int(cls), int(cls))} {conf:.2f}", (int(x1), max(int(y1) - 5, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return frame
+
+
+def load_table(cache_dir=CACHE_DIR):
+    """
+    Tutte le cache di una cartella come un'unica tabella colonnare (più la colonna "video", indice in videos),
+    per interrogare le detection di molti video insieme.
+
+    Returns:
+        tuple: (colonne, lista dei metadati dei video)
+    """
+    tables, videos = [], []
+    for name in sorted(os.listdir(cache_dir)):
+        if not name.endswith(".npz") or name.endswith(".tmp.npz"):
+            continue
+        cache = DetectionCache(os.path.join(cache_dir, name))
+        cache.columns["video"] = np.full(len(cache.columns["frame"]), len(videos), dtype=np.int32)
+        videos.append(dict(cache.meta, file=name, frames=cache.frames))
+        tables.append(cache.columns)
+    if not tables:
+        return {name: np.zeros(0) for name in COLUMNS + ("video",)}, []
+    return {name: np.concatenate([t[name] for t in tables]) for name in tables[0]}, videos
+
+
+def summary(cache_dir=CACHE_DIR, conf=0.25):
+    """Per ogni video in cache: frame e detection per classe con confidenza >= conf."""
+    table, videos = load_table(cache_dir)
+    keep = table["conf"] >= conf
+    num_classes = int(table["cls"].max()) + 1 if len(table["cls"]) else 0
+    counts = np.bincount(table["video"][keep].astype(np.int64) * max(num_classes, 1) + table["cls"][keep].astype(np.int64),
+                         minlength=len(videos) * max(num_classes, 1)).reshape(len(videos), max(num_classes, 1))
+    return [{"video": video.get("video"), "model": video.get("model"), "frames": video["frames"],
+             "detections": {video["names"].get(str(c), str(c)): int(counts[i, c]) for c in np.flatnonzero(counts[i])}}
+            for i, video in enumerate(videos)]
+
+
+def replay(cap, cache, conf=0.25, show=True, on_frame=None):
+    """
+    Riproduce un video con le detection dalla cache (nessuna inferenza), alla soglia di confidenza scelta.
+
+    Returns:
+        dict: {"frames", "seconds", "fps", "detections"}
+    """
+    fps_meter = FpsMeter()
+    frames = detections = 0
+    start_time = time.perf_counter()
+    while frames < cache.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        found = cache.detections(frames, conf)
+        detections += len(found)
+        frames += 1
+        fps_meter.tick()
+        if on_frame is not None:
+            on_frame(frames - 1, frame, found)
+        if show:
+            cv2.imshow(WINDOW_NAME, draw_overlay(draw_detections(frame, found, cache.names), fps_meter.fps))
+            if handle_keys(cv2.waitKey(1)):
+                break
+    seconds = time.perf_counter() - start_time
+    return {"frames": frames, "seconds": seconds, "fps": frames / seconds if seconds else 0.0, "detections": detections}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interroga la cache delle detection (tutti i video in cache).")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help=f"Cartella della cache (default: {CACHE_DIR})")
+    parser.add_argument("--conf", type=float, default=0.25, help="Soglia di confidenza (default: 0.25)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il riepilogo in questo file JSON")
+    args = parser.parse_args()
+
+    rows = summary(args.cache_dir, args.conf)
+    for row in rows:
+        classes = ", ".join(f"{name}: {count}" for name, count in sorted(row["detections"].items(), key=lambda item: -item[1]))
+        print(f"{row['video']} ({row['model']}, {row['frames']} frame): {classes or 'nessuna detection'}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(rows, f, indent=2)
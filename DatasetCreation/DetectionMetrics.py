@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def box_iou(a, b):
+    """
+    IoU tra tutti i box di a e di b (vettoriale).
+
+    Args:
+        a (np.ndarray): (n, 4) in formato x1, y1, x2, y2.
+        b (np.ndarray): (m, 4) in formato x1, y1, x2, y2.
+
+    Returns:
+        np.ndarray: (n, m)
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match(pred, ref, iou_threshold=0.5):
+    """
+    Abbina greedy (per confidenza decrescente) le detection pred a quelle di riferimento della stessa classe.
+
+    Args:
+        pred (np.ndarray): (n, 6) x1, y1, x2, y2, conf, cls.
+        ref (np.ndarray): (m, 6) o (m, 5+) con la classe in colonna 5.
+        iou_threshold (float): IoU minima per considerare due box la stessa detection.
+
+    Returns:
+        np.ndarray: bool (n,), True per le detection abbinate (veri positivi)
+    """
+    pred = np.asarray(pred).reshape(-1, 6)
+    ref = np.asarray(ref).reshape(-1, 6)
+    matched = np.zeros(len(pred), dtype=bool)
+    if not len(pred) or not len(ref):
+        return matched
+    iou = box_iou(pred[:, :4], ref[:, :4])
+    iou[pred[:, 5][:, None] != ref[:, 5][None, :]] = 0
+    used = np.zeros(len(ref), dtype=bool)
+    for i in np.argsort(-pred[:, 4], kind="stable"):
+        candidates = np.where(used, 0, iou[i])
+        j = int(candidates.argmax())
+        if candidates[j] >= iou_threshold:
+            matched[i] = True
+            used[j] = True
+    return matched
+
+
+def agreement(preds, refs, iou_threshold=0.5):
+    """
+    Accordo tra le detection di due backend sugli stessi frame, prendendo il secondo come riferimento:
+    precision (detection di pred confermate da ref), recall (detection di ref ritrovate da pred) e F1.
+
+    Args:
+        preds (list): Per ogni frame un array (n, 6).
+        refs (list): Per ogni frame un array (m, 6).
+
+    Returns:
+        dict: {"precision", "recall", "f1", "pred", "ref"}
+    """
+    tp = n_pred = n_ref = 0
+    for pred, ref in zip(preds, refs):
+        tp += int(match(pred, ref, iou_threshold).sum())
+        n_pred += len(pred)
+        n_ref += len(ref)
+    precision = tp / n_pred if n_pred else 1.0
+    recall = tp / n_ref if n_ref else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "pred": n_pred, "ref": n_ref}
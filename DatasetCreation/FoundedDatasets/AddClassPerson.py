@@ -1,52 +1,97 @@
-import xml.etree.ElementTree as ET
+import argparse
 import os
+from collections import Counter
 from PathDatasets import PATHS
+from BuildEngine import build, label_texts
+from DatasetIO import atomic_write_text
+from SourceAdapters import SampleRecord, VocAdapter, read_voc
 
-def convert_xml_to_yolo(xml_path, txt_path, class_names):
+def build_class_index(class_names):
+    """
+    Precompila la ricerca dell'indice di classe: da lista di nomi a dizionario nome -> indice (O(1) per oggetto).
+    Se riceve già un dizionario lo restituisce così com'è.
+    """
+    if isinstance(class_names, dict):
+        return class_names
+    class_index = {}
+    for idx, name in enumerate(class_names):
+        class_index.setdefault(name, idx)  # come list.index: vince la prima occorrenza
+    return class_index
+
+def convert_xml_to_yolo(xml_path, txt_path, class_names, verbose=True):
     """
     Converte un file di annotazione XML (PASCAL VOC) nel formato YOLO .txt.
 
     Args:
         xml_path (str): Il percorso del file XML di input.
         txt_path (str): Il percorso del file .txt di output da creare.
-        class_names (list): Una lista di stringhe contenente i nomi delle classi.
+        class_names (list | dict): Una lista di stringhe contenente i nomi delle classi.
                              L'ordine della lista determina l'indice della classe (a partire da 0).
+                             Può essere anche il dizionario già compilato da build_class_index.
+        verbose (bool): Stampa l'esito della conversione.
+
+    Returns:
+        dict: {"ok": bool, "objects": oggetti scritti, "unknown": Counter delle classi ignorate, "error": messaggio o None}.
     """
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        size = root.find('size')
-        width = int(size.find('width').text)
-        height = int(size.find('height').text)
+    class_index = build_class_index(class_names)
+    result = {"ok": False, "objects": 0, "unknown": Counter(), "error": None}
+    parsed, result["error"] = read_voc(xml_path)
+    if parsed:
+        _, width, height, names, boxes = parsed
+        record = SampleRecord(None, width, height, names, boxes)
+        try:
+            text = label_texts([record], class_index, VocAdapter.box_format, trailing_newline=True, keep_empty=True,
+                               unknown=result["unknown"])[0]
+            atomic_write_text(txt_path, text)
+            result["ok"], result["objects"] = True, text.count("\n")
+        except Exception as e:
+            result["error"] = f"Si è verificato un errore durante la conversione di '{xml_path}': {e}"
+    if verbose:
+        for name, count in result["unknown"].items():
+            print(f"Warning: Classe '{name}' non trovata in class_names. {count} oggetti ignorati in '{xml_path}'.")
+        print(result["error"] or f"File XML '{xml_path}' convertito con successo in '{txt_path}'.")
+    return result
 
-        with open(txt_path, 'w') as f:
-            for obj in root.findall('object'):
-                name = obj.find('name').text
-                if name not in class_names:
-                    print(f"Warning: Classe '{name}' non trovata in class_names. Oggetto ignorato in '{xml_path}'.")
-                    continue
-                class_id = class_names.index(name)
-                bndbox = obj.find('bndbox')
-                xmin = int(bndbox.find('xmin').text)
-                ymin = int(bndbox.find('ymin').text)
-                xmax = int(bndbox.find('xmax').text)
-                ymax = int(bndbox.find('ymax').text)
+def convert_folders_xml_to_yolo(xml_folders, output_folder, class_names, workers=None):
+    """
+    Conversione batch: converte tutti i file XML di una o più cartelle nel formato YOLO .txt
+    (SourceAdapters.VocAdapter + BuildEngine, solo label).
 
-                x_center = (xmin + xmax) / 2 / width
-                y_center = (ymin + ymax) / 2 / height
-                bbox_width = (xmax - xmin) / width
-                bbox_height = (ymax - ymin) / height
+    La ricerca delle classi viene compilata una sola volta, il parsing è distribuito su un pool di processi
+    e al posto di una riga per file viene stampato un riepilogo finale con il throughput.
 
-                f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n")
+    Args:
+        xml_folders (str | list): Cartella (o lista di cartelle, es. gli split Train/Test/Val) con i file XML.
+        output_folder (str): Il percorso della cartella dove salvare i file .txt convertiti.
+        class_names (list): Una lista di stringhe contenente i nomi delle classi.
+        workers (int): Numero di processi (None = numero di CPU, 1 = seriale).
 
-        print(f"File XML '{xml_path}' convertito con successo in '{txt_path}'.")
+    Returns:
+        dict: Riepilogo (file convertiti, errori, oggetti scritti, classi ignorate, file rinominati perché lo stesso
+              nome compare in più cartelle, secondi).
+    """
+    if isinstance(xml_folders, str):
+        xml_folders = [xml_folders]
+    adapter = VocAdapter.from_folders(xml_folders, parse_workers=workers or os.cpu_count(), trailing_newline=True)
+    stats = build(adapter, None, output_folder, build_class_index(class_names), keep_empty=True)
+    summary = {"converted": stats["samples"], "objects": stats["boxes"], "unknown": stats["unknown"],
+               "renamed": adapter.renamed, "errors": stats["errors"], "seconds": stats["seconds"]}
 
-    except FileNotFoundError:
-        print(f"Errore: Il file XML '{xml_path}' non è stato trovato.")
-    except Exception as e:
-        print(f"Si è verificato un errore durante la conversione di '{xml_path}': {e}")
+    print(f"Convertiti {summary['converted']}/{len(adapter.xml_files)} file XML ({summary['objects']} oggetti) "
+          f"in {summary['seconds']:.2f}s: {summary['converted'] / max(summary['seconds'], 1e-9):.0f} file/s")
+    if summary["unknown"]:
+        ignored = ", ".join(f"'{name}' x{count}" for name, count in summary["unknown"].most_common())
+        print(f"Warning: oggetti ignorati perché la classe non è in class_names: {ignored}")
+    if adapter.renamed:
+        print(f"Warning: {adapter.renamed} file XML con lo stesso nome in più cartelle: "
+              f"salvati con il nome della cartella come prefisso")
+    for error in summary["errors"][:10]:
+        print(error)
+    if len(summary["errors"]) > 10:
+        print(f"... e altri {len(summary['errors']) - 10} errori")
+    return summary
 
-def convert_folder_xml_to_yolo(xml_folder, output_folder, class_names):
+def convert_folder_xml_to_yolo(xml_folder, output_folder, class_names, workers=None):
     """
     Itera su tutti i file XML in una cartella e li converte nel formato YOLO .txt.
 
@@ -54,21 +99,20 @@ def convert_folder_xml_to_yolo(xml_folder, output_folder, class_names):
         xml_folder (str): Il percorso della cartella contenente i file XML.
         output_folder (str): Il percorso della cartella dove salvare i file .txt convertiti.
         class_names (list): Una lista di stringhe contenente i nomi delle classi.
+        workers (int): Numero di processi (vedi convert_folders_xml_to_yolo).
     """
-    os.makedirs(output_folder, exist_ok=True)
-    for filename in os.listdir(xml_folder):
-        if filename.endswith(".xml"):
-            xml_filepath = os.path.join(xml_folder, filename)
-            txt_filename = filename.replace(".xml", ".txt")
-            txt_filepath = os.path.join(output_folder, txt_filename)
-            convert_xml_to_yolo(xml_filepath, txt_filepath, class_names)
+    return convert_folders_xml_to_yolo(xml_folder, output_folder, class_names, workers=workers)
 
 if __name__ == '__main__':
-    # Esempio di utilizzo per una cartella:
+    parser = argparse.ArgumentParser(description="Converte le annotazioni XML del dataset pedoni nel formato YOLO.")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi (default: numero di CPU)")
+    args = parser.parse_args()
+
+    # Esempio di utilizzo per una cartella (si può passare anche una lista, es. gli split Train/Test/Val):
     xml_annotations_folder = PATHS['PEDESTRIAN_PATH'] + r"\Test\Test\Annotations"
     yolo_annotations_folder = PATHS['DATASET_PATH'] + r"\labels\val"
     class_list = ['person']
 
-    convert_folder_xml_to_yolo(xml_annotations_folder, yolo_annotations_folder, class_list)
+    convert_folders_xml_to_yolo([xml_annotations_folder], yolo_annotations_folder, class_list, workers=args.workers)
 
     print("Conversione di tutti i file XML nella cartella completata.")
\ No newline at end of file
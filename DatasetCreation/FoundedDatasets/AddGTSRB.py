@@ -1,11 +1,18 @@
-import csv
+import argparse
 import os
-from PIL import Image
 from PathDatasets import PATHS
+from BuildEngine import build, print_report
+from BuildManifest import BuildManifest, manifest_path_for
+from SourceAdapters import GtsrbCsvAdapter
 
-def convert_gtsrb_to_yolo(annotations_file, images_base_path, output_images_path, output_labels_path, class_names):
+def convert_gtsrb_to_yolo(annotations_file, images_base_path, output_images_path, output_labels_path, class_names,
+                          output_format=None, quality=95, workers=None, manifest=None):
     """
-    Converte le annotazioni GTSRB nel formato YOLO e copia le immagini.
+    Converte le annotazioni GTSRB nel formato YOLO e copia le immagini (SourceAdapters.GtsrbCsvAdapter + BuildEngine).
+
+    Se il formato di output coincide con quello di ingresso i byte dell'immagine vengono copiati così come sono,
+    senza decodifica e ricodifica. Se invece si chiede un cambio di formato (es. .ppm -> .png/.jpg) la
+    transcodifica viene distribuita su un pool di processi.
 
     Args:
         annotations_file (str): Percorso del file CSV delle annotazioni (Train.csv).
@@ -13,62 +20,34 @@ def convert_gtsrb_to_yolo(annotations_file, images_base_path, output_images_path
         output_images_path (str): Percorso dove salvare le immagini per YOLO.
         output_labels_path (str): Percorso dove salvare i file di testo delle etichette YOLO.
         class_names (dict): Dizionario che mappa ClassId numerico ai nomi delle classi YOLO.
+        output_format (str): Estensione delle immagini di output (es. ".jpg"). None = mantiene il formato originale.
+        quality (int): Qualità di codifica usata dalla transcodifica (JPEG/WebP).
+        workers (int): Numero di processi per la transcodifica (None = numero di CPU).
+        manifest (BuildManifest): Se indicato, la conversione è incrementale: si riscrivono solo le immagini e le
+                                  label i cui input sono cambiati e si eliminano gli output delle righe sparite dal CSV.
+
+    Returns:
+        dict: Statistiche della conversione (vedi BuildEngine.build).
     """
-    os.makedirs(output_images_path, exist_ok=True)
-    os.makedirs(output_labels_path, exist_ok=True)
-
-    with open(annotations_file, 'r', newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            width = int(row['Width'])
-            height = int(row['Height'])
-            x_min = int(row['Roi.X1'])
-            y_min = int(row['Roi.Y1'])
-            x_max = int(row['Roi.X2'])
-            y_max = int(row['Roi.Y2'])
-            class_id = int(row['ClassId'])
-            image_path_relative = row['Path']
-            image_filename = os.path.basename(image_path_relative)
-
-            # Costruzione del percorso completo dell'immagine originale
-            input_image_path = os.path.join(images_base_path, image_path_relative)
-
-            # Costruzione del percorso di output per l'immagine
-            output_image_filepath = os.path.join(output_images_path, image_filename)
-
-            # Costruisci il percorso di output per il file di testo delle etichette
-            label_filename = os.path.splitext(image_filename)[0] + '.txt'
-            output_label_filepath = os.path.join(output_labels_path, label_filename)
-
-            # Calcola le coordinate YOLO normalizzate
-            x_center = (x_min + x_max) / 2 / width
-            y_center = (y_min + y_max) / 2 / height
-            bbox_width = (x_max - x_min) / width
-            bbox_height = (y_max - y_min) / height
-
-            # Ottieni l'ID della classe YOLO dal dizionario class_names
-            if class_id in class_names:
-                yolo_class_id = class_names[class_id]
-
-                # Crea il contenuto del file di testo delle etichette YOLO
-                label_content = f"{yolo_class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n"
-
-                # Salva il file di testo delle etichette
-                with open(output_label_filepath, 'w') as label_file:
-                    label_file.write(label_content)
-
-                # Copia l'immagine nel percorso di output
-                try:
-                    Image.open(input_image_path).save(output_image_filepath)
-                except FileNotFoundError:
-                    print(f"Errore: Immagine non trovata al percorso: {input_image_path}")
-                except Exception as e:
-                    print(f"Errore durante la copia dell'immagine: {e}")
-            else:
-                print(f"Avviso: ClassId {class_id} non trovato nel dizionario class_names. Immagine: {image_filename} non processata per le etichette.")
+    if output_format:
+        print(f"Transcodifica delle immagini in {output_format} (qualità {quality})...")
+    stats = build(GtsrbCsvAdapter(annotations_file, images_base_path), output_images_path, output_labels_path, class_names,
+                  manifest=manifest, owner="gtsrb:" + os.path.abspath(annotations_file),
+                  output_format=output_format, quality=quality, transcode_workers=workers)
+    print_report(stats, "immagini")
+    return stats
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Converte GTSRB nel formato YOLO.")
+    parser.add_argument("--format", dest="output_format", default=None,
+                        help="Estensione delle immagini di output (es. .png, .jpg). Default: formato originale, copia diretta.")
+    parser.add_argument("--quality", type=int, default=95, help="Qualità di codifica in caso di transcodifica (default: 95)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi per la transcodifica (default: numero di CPU)")
+    parser.add_argument("--full-rebuild", action="store_true", help="Riscrive tutto ignorando il manifest di build")
+    parser.add_argument("--hash", action="store_true", help="Confronta le sorgenti per hash del contenuto invece che per dimensione/mtime")
+    args = parser.parse_args()
+
     # --- CONFIGURAZIONE ---
     annotations_file = PATHS["GTSRB_PATH"] + r"\Test.csv"    #oppure \
     images_base_path = PATHS["GTSRB_PATH"]
@@ -124,7 +103,12 @@ if __name__ == '__main__':
         42: 49,
     }
 
-    convert_gtsrb_to_yolo(annotations_file, images_base_path, miopercorso_immagini, miopercorso_labels, class_names_mapping)
+    manifest = BuildManifest(manifest_path_for(PATHS["DATASET_PATH"]), use_hash=args.hash, force=args.full_rebuild)
+    try:
+        convert_gtsrb_to_yolo(annotations_file, images_base_path, miopercorso_immagini, miopercorso_labels, class_names_mapping,
+                              output_format=args.output_format, quality=args.quality, workers=args.workers, manifest=manifest)
+    finally:
+        manifest.save()
 
     print(f"\nConversione completata.")
     print(f"Immagini salvate in: {miopercorso_immagini}")
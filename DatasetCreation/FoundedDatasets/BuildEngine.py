@@ -0,0 +1,415 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, compress, islice
+
+import numpy as np
+
+from BuildManifest import mapping_version, text_digest
+from DatasetIO import atomic_copy, atomic_write_text, materialize, probe_image_size, transcode_image
+from SourceAdapters import SampleRecord
+
+# Una riga di label YOLO: classe + box normalizzato
+LABEL_LINE = "%d %.6f %.6f %.6f %.6f"
+
+
+def write_sample(src_img, image_path, label_path, label_text=None, label_src=None, materialize_strategy="copy",
+                 transcode_quality=None, write_image=True, write_label=True):
+    """
+    Scrive un campione: immagine (se image_path non è None) + file di label YOLO.
+    Entrambe le scritture sono atomiche, quindi worker paralleli non lasciano mai file a metà.
+
+    Args:
+        src_img (str): Percorso dell'immagine sorgente.
+        image_path (str): Immagine di output (None = solo label).
+        label_path (str): Label di output.
+        label_text (str): Contenuto del file di label (alternativo a label_src).
+        label_src (str): File di label YOLO da copiare così com'è.
+        materialize_strategy (str): Come portare l'immagine nell'output (vedi DatasetIO.materialize).
+            Le label vengono sempre copiate.
+        transcode_quality (int): Se indicato l'immagine viene ricodificata nel formato di image_path con questa qualità.
+        write_image (bool): False se l'immagine in output è già aggiornata (rebuild incrementale).
+        write_label (bool): False se la label in output è già aggiornata (rebuild incrementale).
+
+    Returns:
+        int: Byte risparmiati non copiando l'immagine.
+    """
+    bytes_saved = 0
+    if image_path is not None and write_image:
+        if transcode_quality is not None:
+            transcode_image(src_img, image_path, transcode_quality)
+        else:
+            bytes_saved = materialize(src_img, image_path, materialize_strategy)
+    if write_label:
+        if label_src is not None:
+            atomic_copy(label_src, label_path)
+        else:
+            atomic_write_text(label_path, label_text)
+    return bytes_saved
+
+
+def _write_task(task):
+    """write_sample che non interrompe la build: restituisce (byte risparmiati, messaggio di errore o None)."""
+    try:
+        return write_sample(**task), None
+    except FileNotFoundError as e:
+        return 0, f"Errore: file non trovato: {e.filename or task['src_img']}"
+    except Exception as e:
+        return 0, f"Errore durante la scrittura di '{task['label_path']}': {e}"
+
+
+def _label_digest(task):
+    if task.get("label_src") is not None:
+        st = os.stat(task["label_src"])
+        return f"file:{st.st_size}:{st.st_mtime_ns}"
+    return text_digest(task["label_text"])
+
+
+def run_tasks(tasks, executor=None, manifest=None, owner=None, mapping=None, split=()):
+    """
+    Esegue una lista di task (dizionari di argomenti per write_sample), in serie o sul pool indicato.
+
+    Se due task producono lo stesso file vince l'ultimo, come nell'esecuzione seriale:
+    così l'output è identico byte per byte qualunque sia l'ordine dei worker.
+    Con un BuildManifest vengono riscritti solo i file i cui input sono cambiati; le label in split (scritte
+    in più parti) vengono segnate nel manifest, così la build successiva le scrive una volta sola a fine build.
+
+    Returns:
+        dict: {"samples": campioni distinti, "written": campioni (ri)scritti,
+               "bytes_saved": byte non copiati grazie ai link, "errors": messaggi di errore}.
+    """
+    by_dst = {}
+    for task in tasks:
+        by_dst[task["label_path"]] = task
+    pending = []
+    for task in by_dst.values():
+        digest = None
+        if manifest is not None and task["image_path"] is not None:
+            digest = _label_digest(task)
+            image_fresh, label_fresh = manifest.check(task["image_path"], task["label_path"], task["src_img"], digest, mapping)
+            if image_fresh and label_fresh:
+                continue
+            task = dict(task, write_image=not image_fresh, write_label=not label_fresh)
+        pending.append((task, digest))
+
+    if executor is None:
+        results = map(_write_task, (task for task, _ in pending))
+    else:
+        results = [executor.submit(_write_task, task) for task, _ in pending]
+        results = (future.result() for future in results)
+
+    stats = {"samples": len(by_dst), "written": 0, "bytes_saved": 0, "errors": []}
+    for (task, digest), (bytes_saved, error) in zip(pending, results):
+        if error:
+            stats["errors"].append(error)
+            continue
+        stats["written"] += 1
+        stats["bytes_saved"] += bytes_saved
+        if digest is not None:
+            manifest.record(task["image_path"], task["label_path"], owner, task["src_img"], digest, mapping,
+                            split=task["label_path"] in split)
+    return stats
+
+
+def _normalize(boxes, widths, heights, box_format):
+    """Box in pixel -> (x_center, y_center, w, h) normalizzati, con le stesse operazioni dei vecchi loop per-box."""
+    out = np.empty((len(boxes), 4), dtype=np.float64)
+    if box_format == "xywh":
+        out[:, 0] = (boxes[:, 0] + boxes[:, 2] / 2) / widths
+        out[:, 1] = (boxes[:, 1] + boxes[:, 3] / 2) / heights
+        out[:, 2] = boxes[:, 2] / widths
+        out[:, 3] = boxes[:, 3] / heights
+    elif box_format == "xyxy":
+        out[:, 0] = (boxes[:, 0] + boxes[:, 2]) / 2 / widths
+        out[:, 1] = (boxes[:, 1] + boxes[:, 3]) / 2 / heights
+        out[:, 2] = (boxes[:, 2] - boxes[:, 0]) / widths
+        out[:, 3] = (boxes[:, 3] - boxes[:, 1]) / heights
+    else:
+        raise ValueError(f"Formato dei box sconosciuto: {box_format}")
+    return out
+
+
+def _format_labels(ids, boxes, box_owner, widths, heights, num_samples, box_format, trailing_newline=False):
+    """
+    Testo delle label di num_samples campioni a partire dai box già filtrati (in ordine di campione).
+
+    La normalizzazione è vettoriale e il testo viene formattato in blocco con una sola operazione: righe della
+    stessa label unite, "|" tra una label e l'altra, poi un solo split.
+
+    Returns:
+        tuple: (lista dei testi, None per i campioni senza box; numero di box tenuti per ogni campione)
+    """
+    texts = [None] * num_samples
+    kept = np.bincount(box_owner, minlength=num_samples)
+    if len(ids):
+        rows = np.empty((len(ids), 5), dtype=np.float64)
+        rows[:, 0] = ids
+        rows[:, 1:] = _normalize(boxes, widths[box_owner], heights[box_owner], box_format)
+        line = LABEL_LINE + "\n" if trailing_newline else LABEL_LINE
+        separators = np.full(len(rows), "" if trailing_newline else "\n", dtype="<U1")
+        separators[np.cumsum(kept[kept > 0]) - 1] = "|"
+        fmt = line.join([""] + separators[:-1].tolist() + [""])
+        for j, text in zip(np.flatnonzero(kept).tolist(), (fmt % tuple(rows.ravel().tolist())).split("|")):
+            texts[j] = text
+    return texts, kept
+
+
+def label_texts(records, class_map, box_format, trailing_newline=False, keep_empty=False, unknown=None, executor=None, errors=None):
+    """
+    Testo delle label YOLO di un blocco di record, calcolato in modo vettoriale.
+
+    Le classi vengono rimappate con class_map (chiave della sorgente -> id YOLO; i box di classi assenti
+    vengono scartati e contati in unknown), i box normalizzati tutti insieme e il testo formattato in blocco
+    con una sola operazione. Le dimensioni mancanti (width None) vengono lette dall'header delle immagini,
+    solo per i record con almeno un box da scrivere, sul pool indicato.
+
+    Returns:
+        list: Per ogni record il testo della label, oppure None se non c'è nulla da scrivere
+              (record con label_src, senza box validi o con immagine illeggibile).
+    """
+    texts = [None] * len(records)
+    todo = [i for i, r in enumerate(records) if r.label_src is None]
+    counts = [len(records[i].classes) for i in todo]
+    keys = list(chain.from_iterable(records[i].classes for i in todo))
+
+    # Rimappatura delle classi: una ricerca nel dizionario per chiave distinta, poi un array
+    lookup = {key: class_map.get(key, -1) for key in set(keys)}
+    ids = np.fromiter(map(lookup.__getitem__, keys), dtype=np.int64, count=len(keys))
+    keep = ids >= 0
+    if unknown is not None and not keep.all():
+        unknown.update(compress(keys, ~keep))
+    owner = np.repeat(np.arange(len(todo)), counts)
+    kept = np.bincount(owner[keep], minlength=len(todo))
+
+    # Dimensioni mancanti: solo header, solo per i record che producono una label
+    sizes = {}
+    probe = [records[todo[j]].image for j in np.flatnonzero(kept).tolist() if records[todo[j]].width is None]
+    if probe:
+        for path, size in zip(probe, (executor.map(_probe, probe) if executor is not None else map(_probe, probe))):
+            if isinstance(size, str):
+                if errors is not None:
+                    errors.append(size)
+            else:
+                sizes[path] = size
+
+    unknown_size = (np.nan, np.nan)
+    wh = np.array([(r.width, r.height) if r.width is not None else sizes.get(r.image, unknown_size)
+                   for r in map(records.__getitem__, todo)], dtype=np.float64).reshape(-1, 2)
+    widths, heights = wh[:, 0], wh[:, 1]
+    usable = ~np.isnan(widths)
+    keep &= usable[owner]
+
+    boxes = np.zeros((0, 4))
+    if keep.any():
+        boxes = np.concatenate([np.asarray(records[i].boxes, dtype=np.float64).reshape(-1, 4) for i in todo])[keep]
+    formatted, kept = _format_labels(ids[keep], boxes, owner[keep], widths, heights, len(todo), box_format,
+                                     trailing_newline)
+    for j, text in enumerate(formatted):
+        if text is not None:
+            texts[todo[j]] = text
+    if keep_empty:
+        for j in np.flatnonzero((kept == 0) & usable).tolist():
+            texts[todo[j]] = ""
+    return texts
+
+
+def block_label_texts(block, class_map, box_format, trailing_newline=False, keep_empty=False, unknown=None):
+    """
+    Come label_texts, per un SampleBlock (adapter colonnari, es. COCO): i box arrivano già raggruppati per
+    campione in array, quindi rimappatura, normalizzazione e formattazione sono un solo passaggio sull'intero
+    blocco, senza record per immagine.
+
+    Returns:
+        list: Per ogni campione del blocco il testo della label, oppure None se non ha box validi.
+    """
+    num_samples = len(block.images)
+    lookup = np.array([class_map.get(key, -1) for key in block.keys] or [-1], dtype=np.int64)
+    ids = lookup[block.classes]
+    keep = ids >= 0
+    if unknown is not None and not keep.all():
+        dropped = np.bincount(block.classes[~keep], minlength=len(block.keys))
+        unknown.update({block.keys[k]: int(dropped[k]) for k in np.flatnonzero(dropped).tolist()})
+    owner = np.repeat(np.arange(num_samples), block.counts)
+    texts, _ = _format_labels(ids[keep], block.boxes[keep], owner[keep], block.widths, block.heights, num_samples,
+                              box_format, trailing_newline)
+    if keep_empty:
+        texts = ["" if text is None else text for text in texts]
+    return texts
+
+
+def _probe(path):
+    try:
+        return probe_image_size(path)
+    except FileNotFoundError:
+        return f"Errore: Immagine non trovata al percorso: {path}"
+    except Exception as e:
+        return f"Errore durante la lettura dell'immagine '{path}': {e}"
+
+
+def output_name(name, prefix=None, output_format=None):
+    """Nome del file di output: prefisso della sorgente + nome originale, con l'eventuale nuova estensione."""
+    if output_format:
+        name = os.path.splitext(name)[0] + output_format
+    return prefix + "_" + name if prefix else name
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _labelled_batches(adapter, batch_size, class_map, keep_empty, stats, executor):
+    """
+    Blocchi di (record, testo delle label): dai SampleBlock per gli adapter colonnari (un record minimo per
+    campione, solo per i percorsi di output), altrimenti dai record dell'adapter con label_texts.
+    """
+    if adapter.columnar:
+        for block in adapter.blocks(batch_size):
+            texts = block_label_texts(block, class_map, adapter.box_format, adapter.trailing_newline, keep_empty,
+                                      stats["unknown"])
+            yield [SampleRecord(image) for image in block.images], texts
+        return
+    for batch in _batches(adapter.records(), batch_size):
+        yield batch, label_texts(batch, class_map, adapter.box_format, adapter.trailing_newline, keep_empty,
+                                 stats["unknown"], executor, stats["errors"])
+
+
+def build(adapter, img_out, lbl_out, class_map, prefix=None, executor=None, materialize_strategy="copy", manifest=None,
+          owner=None, batch_size=4096, output_format=None, quality=95, transcode_workers=None, keep_empty=False):
+    """
+    Motore comune di conversione: porta nell'output (immagini + label YOLO) i record di un SourceAdapter.
+
+    I record vengono elaborati a blocchi di batch_size: rimappatura delle classi, normalizzazione e formattazione
+    delle label sono vettoriali (label_texts, o block_label_texts per gli adapter colonnari), le scritture vanno sul pool indicato (run_tasks) e, con un
+    BuildManifest, si riscrivono solo i campioni cambiati e si eliminano quelli che la sorgente non produce più.
+
+    Args:
+        adapter (SourceAdapter): Sorgente dei record.
+        img_out (str): Cartella delle immagini di output (None = solo label).
+        lbl_out (str): Cartella delle label di output.
+        class_map (dict): Chiave di classe della sorgente -> id YOLO.
+        prefix (str): Prefisso dei file di output (es. "gtsrb_train"); None = nome originale.
+        executor: Pool per le scritture (None = seriale).
+        materialize_strategy (str): Vedi DatasetIO.materialize.
+        manifest (BuildManifest): Manifest per la build incrementale.
+        owner (str): Proprietario dei campioni nel manifest (default: prefix, oppure il nome dell'adapter).
+        batch_size (int): Record elaborati per blocco (limita la memoria usata).
+        output_format (str): Estensione delle immagini di output (es. ".jpg"): se diversa da quella della sorgente
+                             l'immagine viene ricodificata su un pool di processi. None = formato originale.
+        quality (int): Qualità di codifica in caso di ricodifica.
+        transcode_workers (int): Processi per la ricodifica (None = numero di CPU).
+        keep_empty (bool): Scrive una label vuota anche per i record senza box validi.
+
+    Returns:
+        dict: {"records", "samples", "written", "boxes", "bytes_saved", "pruned", "excluded" (campioni esclusi
+               nel manifest, non ricreati), "unknown" (Counter delle classi scartate), "errors", "seconds"}.
+    """
+    start_time = time.perf_counter()
+    if output_format and not output_format.startswith("."):
+        output_format = "." + output_format
+    owner = owner or prefix or adapter.name
+    mapping = mapping_version({"classes": sorted(class_map.items(), key=repr), "format": output_format, "quality": quality}
+                              if output_format else sorted(class_map.items(), key=repr))
+    os.makedirs(lbl_out, exist_ok=True)
+    if img_out is not None:
+        os.makedirs(img_out, exist_ok=True)
+
+    stats = {"records": 0, "samples": 0, "written": 0, "boxes": 0, "bytes_saved": 0, "pruned": 0, "excluded": 0,
+             "unknown": Counter(), "errors": []}
+    produced_labels, produced_images = set(), []
+    # Label che la build precedente ha scritto in più parti (append): nel manifest c'è solo il digest finale,
+    # quindi vengono accumulate in memoria e controllate/scritte una volta sola a fine build
+    deferred, appended = {}, set()
+    excluded = set()
+    transcode_pool = ProcessPoolExecutor(max_workers=transcode_workers) if output_format and img_out is not None else None
+    try:
+        for batch, texts in _labelled_batches(adapter, batch_size, class_map, keep_empty, stats, executor):
+            stats["records"] += len(batch)
+            tasks = {}
+            for record, text in zip(batch, texts):
+                if text is None and record.label_src is None:
+                    continue
+                name = output_name(record.out_name or os.path.basename(record.image), prefix,
+                                   output_format if record.image is not None else None)
+                label_path = os.path.join(lbl_out, os.path.splitext(name)[0] + ".txt")
+                image_path = os.path.join(img_out, name) if img_out is not None and record.image is not None else None
+                if image_path is not None and manifest is not None and manifest.is_excluded(image_path):
+                    # Eliminato da Undersampling/Deduplicate: resta tra i prodotti (il manifest lo conserva) ma non
+                    # viene ricreato
+                    if image_path not in excluded:
+                        excluded.add(image_path)
+                        produced_images.append(image_path)
+                    continue
+                if text:
+                    stats["boxes"] += text.count("\n") + (not adapter.trailing_newline)
+                if record.append and label_path in produced_labels:
+                    # Righe arrivate dopo la prima scrittura del campione: si estende la label
+                    appended.add(label_path)
+                    if label_path in deferred or label_path in tasks:
+                        previous = (deferred.get(label_path) or tasks[label_path])["label_text"]
+                    else:
+                        try:
+                            with open(label_path, "r") as f:
+                                previous = f.read()
+                        except OSError as e:
+                            # La scrittura del blocco precedente è fallita (già tra gli errori): si continua
+                            # con le sole righe nuove invece di interrompere la build
+                            stats["errors"].append(f"Errore durante la lettura della label '{label_path}': {e}")
+                            previous = ""
+                    if previous and text:
+                        text = previous + text if adapter.trailing_newline else previous + "\n" + text
+                    else:
+                        text = previous or text
+                transcode = (image_path is not None and output_format is not None
+                             and os.path.splitext(record.image)[1].lower() != output_format.lower())
+                task = {"src_img": record.image, "image_path": image_path, "label_path": label_path,
+                        "label_text": text, "label_src": record.label_src, "materialize_strategy": materialize_strategy,
+                        "transcode_quality": quality if transcode else None}
+                if label_path in deferred or (label_path not in produced_labels and manifest is not None
+                                              and image_path is not None and manifest.was_split(image_path)):
+                    deferred[label_path] = task
+                else:
+                    tasks.pop(label_path, None)  # a parità di output vince l'ultimo record, come in serie
+                    tasks[label_path] = task
+                if label_path not in produced_labels:
+                    produced_labels.add(label_path)
+                    if image_path is not None:
+                        produced_images.append(image_path)
+            result = run_tasks(list(tasks.values()), transcode_pool or executor, manifest, owner, mapping, appended)
+            stats["written"] += result["written"]
+            stats["bytes_saved"] += result["bytes_saved"]
+            stats["errors"] += result["errors"]
+        if deferred:
+            result = run_tasks(list(deferred.values()), transcode_pool or executor, manifest, owner, mapping, appended)
+            stats["written"] += result["written"]
+            stats["bytes_saved"] += result["bytes_saved"]
+            stats["errors"] += result["errors"]
+    finally:
+        if transcode_pool is not None:
+            transcode_pool.shutdown()
+
+    stats["samples"] = len(produced_labels)
+    stats["excluded"] = len(excluded)
+    stats["errors"] = adapter.errors + stats["errors"]
+    if manifest is not None and img_out is not None:
+        stats["pruned"] = manifest.prune(owner, produced_images)
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def print_report(stats, label="campioni"):
+    """Stampa il riepilogo di una build: throughput, classi scartate ed errori (al massimo 10)."""
+    elapsed = max(stats["seconds"], 1e-9)
+    print(f"   {stats['samples']} {label} ({stats['written']} aggiornati, {stats['pruned']} orfani eliminati), "
+          f"{stats['boxes']} box in {stats['seconds']:.2f}s ({stats['records'] / elapsed:.0f} record/s)")
+    if stats["excluded"]:
+        print(f"   {stats['excluded']} campioni esclusi nel manifest (eliminati da Undersampling/Deduplicate), non ricreati")
+    if stats["unknown"]:
+        ignored = ", ".join(f"'{name}' x{count}" for name, count in stats["unknown"].most_common())
+        print(f"   Avviso: box ignorati perché la classe non è mappata: {ignored}")
+    for error in stats["errors"][:10]:
+        print("  ", error)
+    if len(stats["errors"]) > 10:
+        print(f"   ... e altri {len(stats['errors']) - 10} errori")
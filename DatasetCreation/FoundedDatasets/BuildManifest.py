@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import threading
+
+from DatasetIO import atomic_write_text
+
+MANIFEST_VERSION = 1
+
+
+def mapping_version(mapping):
+    """Versione (hash breve) di una mappatura di classi: cambia solo se cambia la mappatura."""
+    return hashlib.sha1(json.dumps(mapping, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def text_digest(text):
+    """Hash breve del contenuto di un file di label."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Hash sha1 del contenuto di un file."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def manifest_path_for(dataset_dir):
+    """Percorso del manifest accanto alla cartella del dataset (es. combined_dataset.manifest.json)."""
+    return os.path.normpath(dataset_dir) + ".manifest.json"
+
+
+class BuildManifest:
+    """
+    Manifest di build del dataset combinato.
+
+    Per ogni campione di output (chiave = percorso dell'immagine relativo al manifest) registra
+    la sorgente, la sua firma (dimensione/mtime o hash del contenuto), l'hash della label scritta
+    e la versione della mappatura delle classi. Una rebuild può così riscrivere solo i campioni
+    nuovi o cambiati ed eliminare quelli orfani.
+
+    I campioni eliminati dagli strumenti di pulizia (Undersampling, Deduplicate) restano nel manifest
+    come esclusi: le rebuild, anche complete, non li ricreano finché non vengono ripristinati.
+    """
+
+    def __init__(self, path, use_hash=False, force=False):
+        """
+        Args:
+            path (str): File JSON del manifest.
+            use_hash (bool): Confronta le sorgenti per hash del contenuto invece che per dimensione/mtime.
+            force (bool): Considera tutto da rifare (rebuild completa), aggiornando comunque il manifest.
+        """
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.use_hash = use_hash
+        self.force = force
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self.samples = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.samples = data.get("samples", {})
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def _abs(self, key):
+        return os.path.join(self.root, key)
+
+    def source_signature(self, source):
+        """Firma della sorgente; None se il file non esiste più. Calcolata una sola volta per run."""
+        with self._lock:
+            if source in self._signatures:
+                return self._signatures[source]
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        if self.use_hash:
+            signature = {"size": st.st_size, "sha1": file_digest(source)}
+        else:
+            signature = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        with self._lock:
+            self._signatures[source] = signature
+        return signature
+
+    def check(self, image_path, label_path, source, label_digest, mapping):
+        """
+        Confronta un campione con quanto registrato.
+
+        Returns:
+            tuple: (image_fresh, label_fresh). Un output è "fresh" se esiste ed è stato prodotto
+            dagli stessi input: quel file può essere saltato.
+        """
+        with self._lock:
+            entry = self.samples.get(self._key(image_path))
+        if self.force or entry is None:
+            return False, False
+        image_fresh = (entry["source"] == os.path.abspath(source)
+                       and entry["signature"] == self.source_signature(source)
+                       and os.path.lexists(image_path))
+        label_fresh = (entry["label"] == self._key(label_path)
+                       and entry["label_digest"] == label_digest
+                       and entry["mapping"] == mapping
+                       and os.path.exists(label_path))
+        return image_fresh, label_fresh
+
+    def record(self, image_path, label_path, owner, source, label_digest, mapping, split=False):
+        """
+        Registra un campione appena scritto (o verificato).
+
+        split: la label è stata scritta in più parti (righe aggiunte da blocchi successivi, es. COCO in streaming).
+        """
+        entry = {
+            "owner": owner,
+            "source": os.path.abspath(source),
+            "signature": self.source_signature(source),
+            "label": self._key(label_path),
+            "label_digest": label_digest,
+            "mapping": mapping,
+        }
+        if split:
+            entry["split"] = True
+        with self._lock:
+            self.samples[self._key(image_path)] = entry
+
+    def was_split(self, image_path):
+        """True se nella build precedente la label del campione è stata scritta in più parti."""
+        with self._lock:
+            entry = self.samples.get(self._key(image_path))
+        return bool(entry and entry.get("split"))
+
+    def exclude(self, image_paths, reason):
+        """
+        Segna come esclusi i campioni indicati (eliminati a mano o da uno strumento di pulizia).
+
+        Args:
+            image_paths (iterable): Immagini di output eliminate.
+            reason (str): Chi le ha escluse (es. "undersampling"), registrato nel manifest.
+
+        Returns:
+            int: Campioni segnati; quelli che il manifest non conosce (es. varianti di augmentation) vengono ignorati.
+        """
+        count = 0
+        with self._lock:
+            for image_path in image_paths:
+                entry = self.samples.get(self._key(image_path))
+                if entry is not None:
+                    entry["excluded"] = reason
+                    count += 1
+        return count
+
+    def is_excluded(self, image_path):
+        """True se il campione è stato escluso: la build non deve ricrearlo."""
+        with self._lock:
+            entry = self.samples.get(self._key(image_path))
+        return bool(entry and entry.get("excluded"))
+
+    def restore_excluded(self):
+        """
+        Annulla tutte le esclusioni: alla build successiva i campioni mancanti vengono ricreati.
+
+        Returns:
+            int: Campioni ripristinati.
+        """
+        with self._lock:
+            excluded = [entry for entry in self.samples.values() if entry.get("excluded")]
+            for entry in excluded:
+                del entry["excluded"]
+        return len(excluded)
+
+    def prune(self, owner, produced_image_paths):
+        """
+        Elimina gli output di owner che questa run non ha prodotto (input cancellati o esclusi).
+        Un campione escluso sparisce dal manifest solo quando sparisce anche la sua sorgente.
+
+        Returns:
+            int: Numero di campioni eliminati.
+        """
+        produced = {self._key(p) for p in produced_image_paths}
+        with self._lock:
+            orphans = [key for key, entry in self.samples.items() if entry["owner"] == owner and key not in produced]
+            for key in orphans:
+                entry = self.samples.pop(key)
+                for path in (self._abs(key), self._abs(entry["label"])):
+                    if os.path.lexists(path):
+                        os.remove(path)
+        return len(orphans)
+
+    def save(self):
+        with self._lock:
+            text = json.dumps({"version": MANIFEST_VERSION, "samples": self.samples}, separators=(",", ":"), sort_keys=True)
+        atomic_write_text(self.path, text)
+
+
+def exclude_samples(dataset_dir, image_paths, reason):
+    """
+    Segna come esclusi, nel manifest di build di dataset_dir, i campioni appena eliminati da uno strumento di pulizia.
+
+    Returns:
+        int: Campioni segnati (0 se il dataset non ha un manifest, cioè non è stato costruito dalla build incrementale).
+    """
+    path = manifest_path_for(dataset_dir)
+    if not os.path.exists(path):
+        return 0
+    manifest = BuildManifest(path)
+    count = manifest.exclude(image_paths, reason)
+    if count:
+        manifest.save()
+    return count
@@ -0,0 +1,104 @@
+import json
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+class _JsonStream:
+    """Lettore incrementale di un file JSON: tiene in memoria solo il blocco in corso di parsing."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Primo carattere non di spaziatura ("" a fine file), senza consumarlo."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos] if self.pos < len(self.buf) else ""
+            self._fill()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON non valido: atteso '{char}', trovato '{found}'")
+        self.pos += 1
+
+    def decode(self):
+        """Decodifica il prossimo valore JSON completo, leggendo altri blocchi finché serve."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # Un numero troncato dalla fine del buffer potrebbe continuare nel blocco successivo
+            if not self.eof and (end == len(self.buf) or self.buf[end] not in _DELIMITERS):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_sections(path, sections, chunk_size=1 << 20):
+    """
+    Legge in streaming gli array di primo livello di un file JSON (es. un'annotazione COCO).
+
+    Gli elementi delle chiavi in sections vengono restituiti uno alla volta, nell'ordine del file;
+    gli altri valori di primo livello vengono letti e scartati. La memoria usata dipende dalla
+    dimensione del singolo elemento e da chunk_size, non da quella del file.
+
+    Args:
+        path (str): File JSON con un oggetto al primo livello.
+        sections (iterable): Chiavi da leggere (es. {"images", "categories", "annotations"}).
+        chunk_size (int): Caratteri letti dal file a ogni blocco.
+
+    Yields:
+        tuple: (chiave, elemento).
+    """
+    sections = set(sections)
+    with open(path, "r") as f:
+        stream = _JsonStream(f, chunk_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(":")
+            if key in sections and stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield key, stream.decode()
+                        separator = stream.peek()
+                        stream.pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise ValueError(f"JSON non valido nell'array '{key}': trovato '{separator}'")
+            else:
+                stream.decode()
+            separator = stream.peek()
+            stream.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"JSON non valido: trovato '{separator}' dopo la chiave '{key}'")
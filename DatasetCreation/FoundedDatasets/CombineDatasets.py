@@ -1,9 +1,12 @@
 import os
-import shutil
-import json
-import xmltodict
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PathDatasets import PATHS  # Importa i path definiti
+from BuildEngine import block_label_texts, build, print_report
+from BuildManifest import BuildManifest, manifest_path_for
+from DatasetIO import MATERIALIZE_STRATEGIES, make_executor, peak_rss_bytes
+from SourceAdapters import CocoAdapter, CocoStreamAdapter, VocAdapter, YoloAdapter
 
 # === CONFIG ===
 OUTPUT_DIR = "combined_dataset"
@@ -66,30 +69,32 @@ CLASS_MAP = {name: idx for idx, name in enumerate(YOLO_CLASSES)}
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
-def copy_and_rename(src, dst, prefix):
-    filename = prefix + "_" + os.path.basename(src)
-    shutil.copy(src, os.path.join(dst, filename))
-    return filename
+def _coco_categories(include_person):
+    """Categorie COCO da convertire: tutte quelle di CLASS_MAP, "person" solo con include_person."""
+    return set(CLASS_MAP) if include_person else set(CLASS_MAP) - {"person"}
 
-def convert_coco(coco_json, image_dir, prefix, img_out, lbl_out, include_person=False):
-    with open(coco_json, "r") as f:
-        data = json.load(f)
+def _yolo_label_for(cat_name, include_person):
+    if cat_name == "person" and not include_person:
+        return None
+    return CLASS_MAP.get(cat_name)
 
+def coco_labels_loop(data, include_person=False):
+    """
+    Versione di riferimento (un'annotazione alla volta) della conversione COCO -> YOLO.
+    Usata dal benchmark per confrontare velocità e output con coco_labels().
+
+    Returns:
+        list: [(file_name, testo della label)] nell'ordine di prima comparsa delle immagini.
+    """
     categories = {cat["id"]: cat["name"] for cat in data["categories"]}
     images = {img["id"]: img for img in data["images"]}
     labels = {}
 
     for ann in data["annotations"]:
         img_id = ann["image_id"]
-        cat_name = categories[ann["category_id"]]
-        yolo_label = None
-        if cat_name in CLASS_MAP:
-            yolo_label = CLASS_MAP[cat_name]
-        elif include_person and cat_name == "person":
-            yolo_label = CLASS_MAP["person"]
+        yolo_label = _yolo_label_for(categories[ann["category_id"]], include_person)
 
         if yolo_label is not None:
-            img_file = images[img_id]["file_name"]
             if img_id not in labels:
                 labels[img_id] = []
             bbox = ann["bbox"]  # [x, y, width, height]
@@ -98,48 +103,86 @@ def convert_coco(coco_json, image_dir, prefix, img_out, lbl_out, include_person=
             y_center = (bbox[1] + bbox[3]/2) / h
             labels[img_id].append(f"{yolo_label} {x_center:.6f} {y_center:.6f} {bbox[2]/w:.6f} {bbox[3]/h:.6f}")
 
-    for img_id, anns in labels.items():
-        img_info = images[img_id]
-        img_file = os.path.join(image_dir, img_info["file_name"])
-        new_name = copy_and_rename(img_file, img_out, prefix)
-        label_file = os.path.splitext(new_name)[0] + ".txt"
-        with open(os.path.join(lbl_out, label_file), "w") as f:
-            f.write("\n".join(anns))
-
-def convert_voc(voc_dir, prefix, img_out, lbl_out):
-    for xml_file in Path(voc_dir).rglob("*.xml"):
-        with open(xml_file, "r") as f:
-            ann = xmltodict.parse(f.read())["annotation"]
-        img_file = os.path.join(voc_dir, ann["filename"])
-        if not os.path.exists(img_file): continue
-        w, h = int(ann["size"]["width"]), int(ann["size"]["height"])
-        objects = ann["object"] if isinstance(ann["object"], list) else [ann["object"]]
-        yolo_lines = []
-        for obj in objects:
-            label = obj["name"]
-            if label in CLASS_MAP:
-                box = obj["bndbox"]
-                x_center = (int(box["xmin"]) + int(box["xmax"])) / 2 / w
-                y_center = (int(box["ymin"]) + int(box["ymax"])) / 2 / h
-                bw = (int(box["xmax"]) - int(box["xmin"])) / w
-                bh = (int(box["ymax"]) - int(box["ymin"])) / h
-                yolo_lines.append(f"{CLASS_MAP[label]} {x_center:.6f} {y_center:.6f} {bw:.6f} {bh:.6f}")
-        if yolo_lines:
-            new_name = copy_and_rename(img_file, img_out, prefix)
-            label_file = os.path.splitext(new_name)[0] + ".txt"
-            with open(os.path.join(lbl_out, label_file), "w") as f:
-                f.write("\n".join(yolo_lines))
-
-def merge_yolo(src_img_dir, src_lbl_dir, prefix, img_out, lbl_out):
-    for img_file in Path(src_img_dir).rglob("*.[jp][pn]g"):
-        base = os.path.splitext(os.path.basename(img_file))[0]
-        lbl_file = os.path.join(src_lbl_dir, base + ".txt")
-        if not os.path.exists(lbl_file): continue
-        new_name = copy_and_rename(img_file, img_out, prefix)
-        shutil.copy(lbl_file, os.path.join(lbl_out, os.path.splitext(new_name)[0] + ".txt"))
+    return [(images[img_id]["file_name"], "\n".join(anns)) for img_id, anns in labels.items()]
+
+def coco_labels(data, include_person=False):
+    """
+    Conversione COCO -> YOLO del motore comune (CocoAdapter.blocks + BuildEngine.block_label_texts), senza
+    scrivere su disco.
+
+    Raggruppamento per immagine, rimappatura delle categorie, normalizzazione dei box e formattazione del testo
+    sono vettoriali. L'output è identico a coco_labels_loop().
+
+    Returns:
+        list: [(file_name, testo della label)] nell'ordine di prima comparsa delle immagini.
+    """
+    labels = []
+    for block in CocoAdapter(data=data, categories=_coco_categories(include_person)).blocks(max(len(data["images"]), 1)):
+        texts = block_label_texts(block, CLASS_MAP, CocoAdapter.box_format)
+        labels += [(image, text) for image, text in zip(block.images, texts) if text is not None]
+    return labels
+
+def convert_coco(coco_json, image_dir, prefix, img_out, lbl_out, include_person=False, executor=None, materialize_strategy="copy", manifest=None):
+    return build(CocoAdapter(coco_json, image_dir, categories=_coco_categories(include_person)), img_out, lbl_out, CLASS_MAP, prefix, executor, materialize_strategy, manifest)
+
+def convert_coco_stream(coco_json, image_dir, prefix, img_out, lbl_out, include_person=False, executor=None,
+                        materialize_strategy="copy", manifest=None, buffer_lines=100_000, chunk_size=1 << 20):
+    """
+    Variante di convert_coco a memoria limitata, per file COCO da diversi GB (vedi SourceAdapters.CocoStreamAdapter).
+
+    Restano in memoria il buffer di annotazioni e un blocco di record del motore, più alcune strutture con una
+    voce per immagine, che sono il costo O(immagini) rimasto: la tabella id -> (file, larghezza, altezza), gli id
+    delle immagini già uscite e l'elenco degli output prodotti (per il manifest). Il contenuto finale delle label
+    è lo stesso di convert_coco; con annotazioni ordinate per immagine (il caso tipico) ogni file viene scritto
+    una volta sola. Con un manifest, le label scritte in più parti vengono segnate e, nelle build successive,
+    accumulate in memoria e scritte (o saltate) una volta sola a fine build.
+
+    Returns:
+        dict: Statistiche come convert_coco, più "peak_rss_bytes", "flushes" e "max_buffered_lines".
+    """
+    adapter = CocoStreamAdapter(coco_json, image_dir, buffer_lines, chunk_size, categories=_coco_categories(include_person))
+    stats = build(adapter, img_out, lbl_out, CLASS_MAP, prefix, executor, materialize_strategy, manifest,
+                  batch_size=min(4096, buffer_lines))
+    stats.update(adapter.stats, peak_rss_bytes=peak_rss_bytes())
+    return stats
+
+def convert_voc(voc_dir, prefix, img_out, lbl_out, executor=None, materialize_strategy="copy", manifest=None, parse_workers=None):
+    """
+    Converte un dataset Pascal VOC. Con parse_workers > 1 il parsing degli XML è distribuito su un pool di
+    processi (a blocchi, per ammortizzare il costo di comunicazione); le label prodotte non cambiano.
+    """
+    return build(VocAdapter.from_dir(voc_dir, parse_workers=parse_workers), img_out, lbl_out, CLASS_MAP, prefix,
+                 executor, materialize_strategy, manifest)
+
+def merge_yolo(src_img_dir, src_lbl_dir, prefix, img_out, lbl_out, executor=None, materialize_strategy="copy", manifest=None):
+    return build(YoloAdapter(src_img_dir, src_lbl_dir), img_out, lbl_out, CLASS_MAP, prefix, executor, materialize_strategy, manifest)
 
 # === MAIN ===
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Costruisce il dataset YOLO combinato a partire dalle sorgenti.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker per il lavoro per-immagine; con più di 1 anche le sorgenti girano in parallelo (default: 1, seriale)")
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread",
+                        help="Tipo di pool per i worker (default: thread)")
+    parser.add_argument("--materialize", choices=MATERIALIZE_STRATEGIES, default="copy",
+                        help="Come portare le immagini nell'output: copia, hardlink, reflink, symlink o auto "
+                             "(reflink -> hardlink -> copia). Se sorgente e output sono su device diversi si ricade sulla copia.")
+    parser.add_argument("--stream-coco", action="store_true",
+                        help="Legge le annotazioni COCO in streaming: i box in memoria sono limitati dal buffer (resta una piccola voce per immagine)")
+    parser.add_argument("--coco-buffer", type=int, default=100_000,
+                        help="Righe di label tenute in memoria prima di scrivere su disco in modalità --stream-coco (default: 100000)")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Riscrive tutti i campioni ignorando il manifest (che viene comunque aggiornato); "
+                             "i campioni esclusi da Undersampling/Deduplicate restano esclusi")
+    parser.add_argument("--restore-excluded", action="store_true",
+                        help="Ricrea anche i campioni eliminati da Undersampling/Deduplicate (annulla le esclusioni del manifest)")
+    parser.add_argument("--hash", action="store_true",
+                        help="Confronta le sorgenti per hash del contenuto invece che per dimensione/mtime")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # Percorsi dei tuoi dataset definiti in Pathdatasets.py
     gtsrb_path = PATHS.get("GTSRB_PATH")
     lisa_path = PATHS.get("LISA_PATH")
@@ -173,40 +216,85 @@ def main():
     ensure_dir(img_out)
     ensure_dir(lbl_out)
 
-    print("▶ Convert GTSRB (Train) COCO...")
+    # Ogni sorgente è un job: (messaggio, funzione, argomenti) oppure None + avviso se i dati mancano
+    jobs = []
+
+    # Con --stream-coco i file COCO vengono letti in streaming a memoria limitata
+    coco_func = convert_coco_stream if args.stream_coco else convert_coco
+    coco_options = {"include_person": True}
+    if args.stream_coco:
+        coco_options["buffer_lines"] = args.coco_buffer
+
     # Dovrai identificare il vero file .json COCO all'interno della cartella "Meta"
     gtsrb_train_coco_file = next(Path(gtsrb_train_coco_json).glob("*.json"), None)
     if gtsrb_train_coco_file and gtsrb_train_images_dir.exists():
-        convert_coco(str(gtsrb_train_coco_file), str(gtsrb_train_images_dir), "gtsrb_train", img_out, lbl_out, include_person=True)
+        jobs.append(("▶ Convert GTSRB (Train) COCO...", coco_func,
+                     (str(gtsrb_train_coco_file), str(gtsrb_train_images_dir), "gtsrb_train", img_out, lbl_out), coco_options))
     else:
         print(f"   ⚠️ File COCO non trovato in Meta o directory immagini non trovata per GTSRB Train: {gtsrb_train_coco_json}, {gtsrb_train_images_dir}")
 
-    print("▶ Convert GTSRB (Test) COCO...")
     # Dovrai identificare il vero file .json COCO all'interno della cartella "Meta"
     gtsrb_test_coco_file = next(Path(gtsrb_test_coco_json).glob("*.json"), None)
     if gtsrb_test_coco_file and gtsrb_test_images_dir.exists():
-        convert_coco(str(gtsrb_test_coco_file), str(gtsrb_test_images_dir), "gtsrb_test", img_out, lbl_out, include_person=True)
+        jobs.append(("▶ Convert GTSRB (Test) COCO...", coco_func,
+                     (str(gtsrb_test_coco_file), str(gtsrb_test_images_dir), "gtsrb_test", img_out, lbl_out), coco_options))
     else:
         print(f"   ⚠️ File COCO non trovato in Meta o directory immagini non trovata per GTSRB Test: {gtsrb_test_coco_json}, {gtsrb_test_images_dir}")
 
-    print("▶ Convert LISA (VOC)...")
     if lisa_voc_dir.exists() and lisa_images_dir.exists():
-        convert_voc(str(lisa_voc_dir), "lisa", img_out, lbl_out)
+        jobs.append(("▶ Convert LISA (VOC)...", convert_voc, (str(lisa_voc_dir), "lisa", img_out, lbl_out), {"parse_workers": args.workers}))
     else:
         print(f"   ⚠️ Directory VOC o immagini non trovate per LISA: {lisa_voc_dir}, {lisa_images_dir}")
 
-    print("▶ Merge VeRi-776 (YOLO)...")
     if veri_yolo_images_dir.exists() and veri_yolo_labels_dir.exists():
-        merge_yolo(str(veri_yolo_images_dir), str(veri_yolo_labels_dir), "veri", img_out, lbl_out)
+        jobs.append(("▶ Merge VeRi-776 (YOLO)...", merge_yolo, (str(veri_yolo_images_dir), str(veri_yolo_labels_dir), "veri", img_out, lbl_out), {}))
     else:
         print(f"   ⚠️ Directory immagini o label YOLO non trovate per VeRi-776: {veri_yolo_images_dir}, {veri_yolo_labels_dir}")
 
-    print("▶ Add YOLO person...")
     if Path(person_yolo["images"]).exists() and Path(person_yolo["labels"]).exists():
-        merge_yolo(person_yolo["images"], person_yolo["labels"], "person", img_out, lbl_out)
+        jobs.append(("▶ Add YOLO person...", merge_yolo, (person_yolo["images"], person_yolo["labels"], "person", img_out, lbl_out), {}))
     else:
         print(f"   ⚠️ Directory immagini o label YOLO non trovate per 'person': {person_yolo['images']}, {person_yolo['labels']}")
 
+    # Rebuild incrementale: il manifest accanto a combined_dataset dice cosa è già aggiornato
+    manifest = BuildManifest(manifest_path_for(OUTPUT_DIR), use_hash=args.hash, force=args.full_rebuild)
+    if args.restore_excluded:
+        print(f"♻️ Esclusioni annullate: {manifest.restore_excluded()} campioni verranno ricreati")
+    build_options = {"materialize_strategy": args.materialize, "manifest": manifest}
+
+    executor = make_executor(args.workers, args.pool)
+    total_saved = 0
+    try:
+        if executor is None:
+            # Modalità seriale: una sorgente alla volta, come prima
+            for message, func, func_args, kwargs in jobs:
+                print(message)
+                stats = func(*func_args, **build_options, **kwargs)
+                total_saved += stats["bytes_saved"]
+                print_report(stats)
+        else:
+            # Le sorgenti girano in contemporanea e condividono lo stesso pool per il lavoro per-immagine
+            print(f"⚙️ Build parallela: {len(jobs)} sorgenti, {args.workers} worker ({args.pool})")
+            with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as source_pool:
+                futures = []
+                for message, func, func_args, kwargs in jobs:
+                    print(message)
+                    futures.append((message, source_pool.submit(func, *func_args, executor=executor, **build_options, **kwargs)))
+                for message, future in futures:
+                    stats = future.result()
+                    total_saved += stats["bytes_saved"]
+                    print(f"   {message.strip('▶ .')}:")
+                    print_report(stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.save()
+
+    if args.stream_coco:
+        peak = peak_rss_bytes()
+        print(f"📈 Picco RSS: {peak / (1024 * 1024):.1f} MB" if peak else "📈 Picco RSS non disponibile (installa psutil)")
+    if args.materialize != "copy":
+        print(f"💾 Byte risparmiati ({args.materialize}): {total_saved / (1024 * 1024):.2f} MB")
     print("✅ Dataset combinato in:", OUTPUT_DIR)
 
 if __name__ == "__main__":
@@ -0,0 +1,252 @@
+import errno
+import os
+import shutil
+import struct
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+def _free_temp_name(dst):
+    """Nome temporaneo non ancora esistente accanto a dst (stesso filesystem, quindi rename atomico)."""
+    return os.path.join(os.path.dirname(dst) or ".", "." + os.path.basename(dst) + "." + uuid.uuid4().hex + ".tmp")
+
+
+@contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Apre in scrittura un file temporaneo accanto a path e, se il blocco with termina senza errori, lo rinomina su
+    path; altrimenti lo rimuove. Chi legge path vede il vecchio file o quello nuovo, mai uno a metà.
+
+    Il file è creato con os.open(..., 0o666): i permessi sono quelli di un open() normale (0666 meno la umask),
+    non i 0600 di tempfile.mkstemp.
+
+    Args:
+        path (str): Percorso del file di destinazione.
+        mode (str): "w" (testo) oppure "wb" (binario).
+    """
+    tmp = _free_temp_name(path)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def atomic_write_text(path, text):
+    """
+    Scrive un file di testo in modo atomico (file temporaneo + rename).
+
+    Args:
+        path (str): Percorso del file di destinazione.
+        text (str): Contenuto da scrivere.
+    """
+    with atomic_open(path, "w") as f:
+        f.write(text)
+
+
+def atomic_write_bytes(path, data):
+    """Come atomic_write_text, per contenuti binari (immagini già codificate, ...)."""
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+
+def atomic_copy(src, dst):
+    """
+    Copia src in dst in modo atomico: chi legge dst vede il vecchio file o quello nuovo, mai uno a metà.
+    Come shutil.copy, dst riceve i permessi di src.
+
+    Args:
+        src (str): Percorso del file sorgente.
+        dst (str): Percorso del file di destinazione.
+    """
+    tmp = _free_temp_name(dst)
+    try:
+        shutil.copy(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# Strategie di materializzazione delle immagini nell'output
+MATERIALIZE_STRATEGIES = ("copy", "hardlink", "reflink", "symlink", "auto")
+
+# ioctl FICLONE di Linux (btrfs, xfs, ...): condivide i blocchi del file senza copiarli
+_FICLONE = 0x40049409
+
+
+def _same_device(src, dst):
+    try:
+        return os.stat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+    except OSError:
+        return False
+
+
+def _reflink(src, tmp):
+    """Clona src in tmp con FICLONE. Solleva OSError se il filesystem (o il sistema operativo) non lo supporta."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflink non supportato su questo sistema")
+    with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+
+
+def _try_link(strategy, src, dst):
+    """Prova a creare dst senza copiare i dati. Restituisce True se ci riesce."""
+    tmp = _free_temp_name(dst)
+    try:
+        if strategy == "hardlink":
+            os.link(src, tmp)
+        elif strategy == "reflink":
+            _reflink(src, tmp)
+        else:
+            os.symlink(os.path.abspath(src), tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        return False
+
+
+def materialize(src, dst, strategy="copy"):
+    """
+    Porta il file src in dst con la strategia scelta, in modo atomico.
+
+    - "hardlink": stesso inode del file sorgente (nessun byte copiato);
+    - "reflink": clone copy-on-write, dove il filesystem lo supporta;
+    - "symlink": link simbolico al percorso assoluto della sorgente;
+    - "copy": copia classica;
+    - "auto": reflink, poi hardlink, poi copia.
+
+    Hardlink e reflink richiedono che sorgente e destinazione siano sullo stesso device:
+    altrimenti (o se il filesystem rifiuta l'operazione) si ricade automaticamente sulla copia.
+    Nota: con hardlink e symlink i file di output condividono i dati con la cache di kagglehub,
+    quindi vanno sostituiti (come fanno le scritture atomiche) e mai modificati sul posto.
+
+    Args:
+        src (str): File sorgente.
+        dst (str): File di destinazione.
+        strategy (str): Una di MATERIALIZE_STRATEGIES.
+
+    Returns:
+        int: Byte risparmiati rispetto a una copia (0 se il file è stato copiato).
+    """
+    if strategy not in MATERIALIZE_STRATEGIES:
+        raise ValueError(f"Strategia di materializzazione sconosciuta: {strategy}")
+    candidates = {"auto": ["reflink", "hardlink"], "copy": []}.get(strategy, [strategy])
+    if strategy != "symlink" and candidates and not _same_device(src, dst):
+        candidates = []  # device diversi: né hardlink né reflink sono possibili
+    for candidate in candidates:
+        if _try_link(candidate, src, dst):
+            return os.path.getsize(src)
+    atomic_copy(src, dst)
+    return 0
+
+
+# Marker JPEG "Start Of Frame" che contengono le dimensioni (esclusi DHT 0xC4, JPG 0xC8, DAC 0xCC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # marker senza payload
+        segment_length = struct.unpack(">H", f.read(2))[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def probe_image_size(path):
+    """
+    Legge larghezza e altezza di un'immagine dal solo header, senza decodificare i pixel.
+
+    JPEG e PNG vengono letti direttamente (pochi byte); per gli altri formati si usa PIL,
+    che con Image.open legge comunque solo l'header.
+
+    Returns:
+        tuple: (width, height)
+    """
+    with open(path, "rb") as f:
+        head = f.read(24)
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head[:2] == b"\xff\xd8":
+            size = _jpeg_size(f)
+            if size:
+                return size
+    from PIL import Image
+    with Image.open(path) as img:
+        return img.width, img.height
+
+
+def transcode_image(src, dst, quality=95):
+    """
+    Decodifica un'immagine e la ricodifica, in modo atomico, nel formato dato dall'estensione di dst.
+
+    Args:
+        src (str): Immagine sorgente.
+        dst (str): Immagine di destinazione (l'estensione sceglie il formato, es. .png/.jpg).
+        quality (int): Qualità di codifica (JPEG/WebP).
+    """
+    from PIL import Image
+    image_format = Image.registered_extensions()[os.path.splitext(dst)[1].lower()]
+    with Image.open(src) as img, atomic_open(dst, "wb") as f:
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(f, format=image_format, quality=quality)
+
+
+def peak_rss_bytes():
+    """
+    Picco di memoria residente (RSS) del processo corrente, in byte.
+
+    Usa il modulo resource (Linux/macOS) oppure psutil se installato (Windows); None se nessuno dei due è disponibile.
+    BenchmarkYolo.py ne ha una copia (i due script stanno in cartelle diverse): vanno tenute allineate.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # Linux riporta KB, macOS byte
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def make_executor(workers, kind="thread"):
+    """
+    Crea il pool usato per il lavoro per-immagine.
+
+    Args:
+        workers (int): Numero di worker. Con 1 (o meno) restituisce None: esecuzione seriale.
+        kind (str): "thread" (adatto a copie e scritture su disco) oppure "process".
+    """
+    if not workers or workers <= 1:
+        return None
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
@@ -0,0 +1,439 @@
+import csv
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from operator import itemgetter
+from pathlib import Path
+
+import numpy as np
+
+from CocoStream import iter_json_sections
+
+# Un campione prodotto da un adapter.
+#   image:     immagine sorgente (None se la sorgente produce solo label, es. AddClassPerson)
+#   width/height: dimensioni dell'immagine; None = lette dall'header dal motore (DatasetIO.probe_image_size)
+#   classes:   chiave di classe di ogni box nel vocabolario della sorgente (nome COCO/VOC, ClassId GTSRB, tag LISA)
+#   boxes:     un box per classe, nel formato box_format dell'adapter
+#   label_src: file di label YOLO già pronto da copiare così com'è (classes/boxes ignorati)
+#   out_name:  nome del file di output (default: nome dell'immagine)
+#   append:    le righe vanno aggiunte alla label già scritta in questa build per lo stesso campione
+SampleRecord = namedtuple("SampleRecord", ["image", "width", "height", "classes", "boxes", "label_src", "out_name", "append"],
+                          defaults=(None, None, None, (), (), None, None, False))
+
+# Un blocco di campioni in forma colonnare, per gli adapter che leggono la sorgente già come array (COCO):
+#   images:   immagine sorgente di ogni campione (lista)
+#   widths/heights: array float64 con le dimensioni di ogni campione
+#   counts:   numero di box di ogni campione; i box sono raggruppati per campione, nello stesso ordine
+#   classes:  per ogni box l'indice della sua chiave di classe in keys
+#   boxes:    array (m, 4) nel formato box_format dell'adapter
+#   keys:     vocabolario delle chiavi di classe della sorgente
+SampleBlock = namedtuple("SampleBlock", ["images", "widths", "heights", "counts", "classes", "boxes", "keys"])
+
+
+class SourceAdapter:
+    """
+    Interfaccia comune delle sorgenti del dataset.
+
+    Un adapter sa solo leggere il formato della sua sorgente e restituire SampleRecord: normalizzazione dei box,
+    rimappatura delle classi, parallelismo e scrittura su disco sono compito di BuildEngine.build.
+    Per aggiungere un dataset basta una sottoclasse che implementa records(). Gli adapter con columnar = True
+    implementano anche blocks(), che il motore usa al posto di records() per evitare un record per immagine.
+    """
+
+    name = "source"
+    # "xyxy" (xmin, ymin, xmax, ymax) oppure "xywh" (x, y, larghezza, altezza), in pixel
+    box_format = "xyxy"
+    # True: ogni riga della label termina con "\n"; False: righe separate da "\n" (stile CombineDatasets)
+    trailing_newline = False
+    # True: l'adapter implementa blocks()
+    columnar = False
+
+    def __init__(self):
+        self.errors = []
+
+    def records(self):
+        """Restituisce (generatore) i SampleRecord della sorgente."""
+        raise NotImplementedError
+
+    def blocks(self, size):
+        """Restituisce (generatore) SampleBlock di al più size campioni, con gli stessi campioni di records()."""
+        raise NotImplementedError
+
+
+class CocoAdapter(SourceAdapter):
+    """
+    File di annotazioni COCO letto con json.load. Adapter colonnare: le annotazioni diventano array
+    (immagine, categoria, bbox), il raggruppamento per immagine è vettoriale (sort stabile) e le immagini escono
+    nell'ordine di prima comparsa nelle annotazioni, a blocchi (blocks) che il motore converte in un solo passaggio.
+    Con categories (insieme di nomi, es. le chiavi della mappa delle classi) le altre annotazioni vengono
+    scartate subito, prima del raggruppamento.
+    """
+
+    name = "coco"
+    box_format = "xywh"
+    columnar = True
+
+    def __init__(self, coco_json=None, image_dir="", data=None, categories=None):
+        super().__init__()
+        self.coco_json = coco_json
+        self.image_dir = image_dir
+        self.data = data
+        self.categories = categories
+
+    def blocks(self, size):
+        data = self.data
+        if data is None:
+            with open(self.coco_json, "r") as f:
+                data = json.load(f)
+        annotations = data["annotations"]
+        if not annotations:
+            return
+
+        cat_ids = np.array([cat["id"] for cat in data["categories"]], dtype=np.int64)
+        cat_names = [cat["name"] for cat in data["categories"]]
+        cat_order = np.argsort(cat_ids, kind="stable")
+        cat_ids = cat_ids[cat_order]
+
+        img_list = data["images"]
+        img_ids = np.array([img["id"] for img in img_list], dtype=np.int64)
+        img_order = np.argsort(img_ids, kind="stable")
+        sorted_img_ids = img_ids[img_order]
+
+        ann_img = np.fromiter(map(itemgetter("image_id"), annotations), dtype=np.int64, count=len(annotations))
+        ann_cat = np.fromiter(map(itemgetter("category_id"), annotations), dtype=np.int64, count=len(annotations))
+        bbox = np.fromiter(chain.from_iterable(map(itemgetter("bbox"), annotations)), dtype=np.float64,
+                           count=4 * len(annotations)).reshape(-1, 4)
+
+        cat_pos = np.minimum(np.searchsorted(cat_ids, ann_cat), len(cat_ids) - 1)
+        if not np.array_equal(cat_ids[cat_pos], ann_cat):
+            raise KeyError(int(ann_cat[cat_ids[cat_pos] != ann_cat][0]))
+        cat_pos = cat_order[cat_pos]  # indice in data["categories"], cioè in keys
+        if self.categories is not None:
+            wanted = np.array([name in self.categories for name in cat_names], dtype=bool)[cat_pos]
+            if not wanted.any():
+                return
+            ann_img, bbox, cat_pos = ann_img[wanted], bbox[wanted], cat_pos[wanted]
+
+        # Immagine di ogni annotazione (come dizionario id -> immagine: in caso di id duplicati vince l'ultima)
+        img_pos = np.searchsorted(sorted_img_ids, ann_img, side="right") - 1
+        if (img_pos < 0).any() or not np.array_equal(sorted_img_ids[np.maximum(img_pos, 0)], ann_img):
+            raise KeyError(int(ann_img[(img_pos < 0) | (sorted_img_ids[np.maximum(img_pos, 0)] != ann_img)][0]))
+        img_idx = img_order[img_pos]
+
+        # Raggruppamento per immagine nell'ordine di prima comparsa: rango di ogni immagine, poi sort stabile
+        group_keys, first_seen, inverse, counts = np.unique(img_idx, return_index=True, return_inverse=True,
+                                                            return_counts=True)
+        by_first = np.argsort(first_seen, kind="stable")
+        rank = np.empty(len(by_first), dtype=np.int64)
+        rank[by_first] = np.arange(len(by_first))
+        order = np.argsort(rank[inverse], kind="stable")
+        group_keys, counts = group_keys[by_first], counts[by_first]
+        classes, bbox = cat_pos[order], bbox[order]
+        widths = np.array([img["width"] for img in img_list], dtype=np.float64)[group_keys]
+        heights = np.array([img["height"] for img in img_list], dtype=np.float64)[group_keys]
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+
+        join = os.path.join if self.image_dir else lambda _, name: name
+        for start in range(0, len(group_keys), size):
+            end = min(start + size, len(group_keys))
+            first, last = bounds[start], bounds[end]
+            images = [join(self.image_dir, img_list[k]["file_name"]) for k in group_keys[start:end].tolist()]
+            yield SampleBlock(images, widths[start:end], heights[start:end], counts[start:end],
+                              classes[first:last], bbox[first:last], cat_names)
+
+    def records(self):
+        for block in self.blocks(4096):
+            bounds = np.concatenate(([0], np.cumsum(block.counts))).tolist()
+            names = [block.keys[c] for c in block.classes.tolist()]
+            for image, width, height, start, end in zip(block.images, block.widths.tolist(), block.heights.tolist(),
+                                                        bounds[:-1], bounds[1:]):
+                yield SampleRecord(image, width, height, names[start:end], block.boxes[start:end])
+
+
+class CocoStreamAdapter(SourceAdapter):
+    """
+    Variante di CocoAdapter a memoria limitata, per file COCO da diversi GB.
+
+    images, categories e annotations vengono letti in streaming (CocoStream.iter_json_sections). I box restano
+    in un buffer di al massimo buffer_lines annotazioni: quando è pieno le immagini in attesa escono come
+    record e il buffer si svuota. Se un'immagine riceve altre annotazioni dopo essere già uscita, il nuovo
+    record ha append=True e il motore estende la label: il risultato è lo stesso di CocoAdapter.
+    Se nel file le annotazioni precedono images/categories vengono parcheggiate in un file temporaneo.
+    categories filtra le annotazioni come in CocoAdapter (e quelle scartate non occupano il buffer).
+
+    Il buffer limita solo i box: la tabella id -> (file, larghezza, altezza) e l'insieme delle immagini già
+    uscite hanno una voce per immagine, quindi restano O(immagini).
+    """
+
+    name = "coco"
+    box_format = "xywh"
+
+    def __init__(self, coco_json, image_dir="", buffer_lines=100_000, chunk_size=1 << 20, categories=None):
+        super().__init__()
+        self.coco_json = coco_json
+        self.image_dir = image_dir
+        self.categories = categories
+        self.buffer_lines = buffer_lines
+        self.chunk_size = chunk_size
+        self.stats = {"flushes": 0, "max_buffered_lines": 0}
+
+    def records(self):
+        categories, images = {}, {}
+        buffer, emitted = {}, set()
+        buffered = 0
+
+        def flush(keep=None):
+            nonlocal buffered
+            out = []
+            for img_id in [i for i in buffer if i != keep]:
+                classes, boxes = buffer.pop(img_id)
+                buffered -= len(classes)
+                file_name, width, height = images[img_id]
+                out.append(SampleRecord(os.path.join(self.image_dir, file_name), width, height, classes, boxes,
+                                        append=img_id in emitted))
+                emitted.add(img_id)
+            if out:
+                self.stats["flushes"] += 1
+            return out
+
+        def add(ann):
+            nonlocal buffered
+            if self.categories is not None and categories[ann["category_id"]] not in self.categories:
+                return ()
+            classes, boxes = buffer.setdefault(ann["image_id"], ([], []))
+            classes.append(categories[ann["category_id"]])
+            boxes.append(ann["bbox"])
+            buffered += 1
+            self.stats["max_buffered_lines"] = max(self.stats["max_buffered_lines"], buffered)
+            return flush(keep=ann["image_id"]) if buffered >= self.buffer_lines else ()
+
+        with tempfile.TemporaryFile("w+") as parked:
+            parked_count = 0
+            for section, item in iter_json_sections(self.coco_json, ("images", "categories", "annotations"), self.chunk_size):
+                if section == "categories":
+                    categories[item["id"]] = item["name"]
+                elif section == "images":
+                    images[item["id"]] = (item["file_name"], item["width"], item["height"])
+                elif categories and images:
+                    yield from add(item)
+                else:
+                    parked.write(json.dumps(item) + "\n")
+                    parked_count += 1
+            if parked_count:
+                parked.seek(0)
+                for line in parked:
+                    yield from add(json.loads(line))
+        yield from flush()
+
+
+# Campi VOC che servono, come percorso a partire dalla radice <annotation>
+_VOC_FIELDS = {("filename",), ("size", "width"), ("size", "height"), ("object", "name"),
+               ("object", "bndbox", "xmin"), ("object", "bndbox", "ymin"),
+               ("object", "bndbox", "xmax"), ("object", "bndbox", "ymax")}
+
+
+def parse_voc_xml(xml_file):
+    """
+    Estrae da un'annotazione Pascal VOC solo filename, size e (name, bndbox) degli oggetti.
+
+    Usa ElementTree.iterparse seguendo il percorso degli elementi: niente albero completo né dizionari
+    intermedi, e gli elementi vengono liberati appena letti. Gli elementi annidati (es. le <part> di un
+    oggetto) vengono ignorati, come accedendo ai soli figli diretti.
+
+    Returns:
+        tuple: (filename, width, height, [(name, xmin, ymin, xmax, ymax), ...]) con i valori come testo.
+    """
+    path, fields, objects = [], {}, []
+    obj = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            path.append(elem.tag)
+            if len(path) == 2 and elem.tag == "object":
+                obj = {}
+            continue
+        key = tuple(path[1:])
+        if key in _VOC_FIELDS:
+            text = elem.text.strip() if elem.text else elem.text
+            if key[0] == "object":
+                obj[key[-1]] = text
+            else:
+                fields[key] = text
+        elif key == ("object",):
+            objects.append(obj)
+            obj = None
+        path.pop()
+        if len(path) <= 1:
+            elem.clear()
+    boxes = [(o.get("name"), o.get("xmin"), o.get("ymin"), o.get("xmax"), o.get("ymax")) for o in objects]
+    return fields.get(("filename",)), fields.get(("size", "width")), fields.get(("size", "height")), boxes
+
+
+def read_voc(xml_file):
+    """
+    Legge un file VOC e converte i valori numerici (eseguita nei worker).
+
+    Returns:
+        tuple: ((filename, width, height, nomi delle classi, box xyxy), None) oppure (None, messaggio di errore)
+    """
+    try:
+        filename, width, height, objects = parse_voc_xml(xml_file)
+        names = [o[0] for o in objects]
+        boxes = [(int(o[1]), int(o[2]), int(o[3]), int(o[4])) for o in objects]
+        return (filename, int(width), int(height), names, boxes), None
+    except FileNotFoundError:
+        return None, f"Errore: Il file XML '{xml_file}' non è stato trovato."
+    except Exception as e:
+        return None, f"Si è verificato un errore durante la conversione di '{xml_file}': {e}"
+
+
+def iter_files(root, extensions):
+    """
+    Percorre root ricorsivamente (os.walk) restituendo i file con le estensioni date, in ordine deterministico:
+    i file di ogni cartella in ordine alfabetico, poi le sottocartelle, anch'esse in ordine alfabetico.
+    L'ordine non dipende dal filesystem, quindi a parità di output vince sempre lo stesso record.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(extensions):
+                yield os.path.join(dirpath, filename)
+
+
+class VocAdapter(SourceAdapter):
+    """
+    Annotazioni Pascal VOC (un XML per immagine).
+
+    Con image_dir il record punta all'immagine image_dir/<filename> (i file senza immagine vengono saltati);
+    con image_dir=None la sorgente produce solo label, con il nome dell'XML (come AddClassPerson).
+    Con parse_workers > 1 il parsing è distribuito su un pool di processi, a blocchi per ammortizzare il costo
+    di comunicazione; l'ordine dei record non cambia.
+    """
+
+    name = "voc"
+
+    def __init__(self, xml_files, image_dir=None, parse_workers=None, trailing_newline=False, out_names=None):
+        super().__init__()
+        self.xml_files = list(xml_files)
+        # Solo label: nome di output di ogni XML (default: il nome del file)
+        self.out_names = list(out_names) if out_names is not None else [os.path.basename(f) for f in self.xml_files]
+        self.renamed = sum(name != os.path.basename(f) for name, f in zip(self.out_names, self.xml_files))
+        self.image_dir = image_dir
+        self.parse_workers = parse_workers
+        self.trailing_newline = trailing_newline
+
+    @classmethod
+    def from_dir(cls, voc_dir, **kwargs):
+        """XML cercati ricorsivamente in voc_dir, immagini nella stessa cartella (struttura usata da CombineDatasets)."""
+        return cls(iter_files(voc_dir, ".xml"), image_dir=voc_dir, **kwargs)
+
+    @classmethod
+    def from_folders(cls, xml_folders, **kwargs):
+        """
+        XML (non ricorsivi) di una o più cartelle, solo label (struttura usata da AddClassPerson).
+
+        Tutte le label finiscono nella stessa cartella: un nome presente in più cartelle riceve come prefisso
+        il nome della sua cartella (o la sua posizione nella lista, se anche i nomi delle cartelle coincidono),
+        invece di sovrascrivere in silenzio le label delle altre cartelle.
+        """
+        listing = [(folder, sorted(f for f in os.listdir(folder) if f.endswith(".xml"))) for folder in xml_folders]
+        seen = Counter(filename for _, filenames in listing for filename in filenames)
+        folder_names = [os.path.basename(os.path.normpath(folder)) for folder in xml_folders]
+        unique_folders = len(set(folder_names)) == len(folder_names)
+        xml_files, out_names = [], []
+        for i, (folder, filenames) in enumerate(listing):
+            prefix = folder_names[i] if unique_folders else f"{i}_{folder_names[i]}"
+            for filename in filenames:
+                xml_files.append(os.path.join(folder, filename))
+                out_names.append(f"{prefix}_{filename}" if seen[filename] > 1 else filename)
+        return cls(xml_files, image_dir=None, out_names=out_names, **kwargs)
+
+    def records(self):
+        if self.parse_workers and self.parse_workers > 1 and len(self.xml_files) > 1:
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                chunksize = max(1, min(512, len(self.xml_files) // (4 * self.parse_workers)))
+                yield from self._to_records(pool.map(read_voc, self.xml_files, chunksize=chunksize))
+        else:
+            yield from self._to_records(map(read_voc, self.xml_files))
+
+    def _to_records(self, results):
+        for xml_file, out_name, (parsed, error) in zip(self.xml_files, self.out_names, results):
+            if error:
+                self.errors.append(error)
+                continue
+            filename, width, height, names, boxes = parsed
+            if self.image_dir is None:
+                yield SampleRecord(None, width, height, names, boxes, out_name=out_name)
+                continue
+            img_file = os.path.join(self.image_dir, filename)
+            if os.path.exists(img_file):
+                yield SampleRecord(img_file, width, height, names, boxes)
+
+
+class YoloAdapter(SourceAdapter):
+    """Dataset già in formato YOLO: immagini e label (stesso nome, .txt) vengono portate nell'output così come sono."""
+
+    name = "yolo"
+
+    def __init__(self, src_img_dir, src_lbl_dir):
+        super().__init__()
+        self.src_img_dir = src_img_dir
+        self.src_lbl_dir = src_lbl_dir
+
+    def records(self):
+        for img_file in Path(self.src_img_dir).rglob("*.[jp][pn]g"):
+            base = os.path.splitext(os.path.basename(img_file))[0]
+            lbl_file = os.path.join(self.src_lbl_dir, base + ".txt")
+            if os.path.exists(lbl_file):
+                yield SampleRecord(str(img_file), label_src=lbl_file)
+
+
+class GtsrbCsvAdapter(SourceAdapter):
+    """CSV di GTSRB (Train.csv / Test.csv): una riga per immagine con dimensioni, ROI e ClassId."""
+
+    name = "gtsrb"
+    trailing_newline = True
+
+    def __init__(self, annotations_file, images_base_path):
+        super().__init__()
+        self.annotations_file = annotations_file
+        self.images_base_path = images_base_path
+
+    def records(self):
+        with open(self.annotations_file, "r", newline="") as csvfile:
+            for row in csv.DictReader(csvfile):
+                yield SampleRecord(os.path.join(self.images_base_path, row["Path"]), int(row["Width"]), int(row["Height"]),
+                                   (int(row["ClassId"]),),
+                                   ((int(row["Roi.X1"]), int(row["Roi.Y1"]), int(row["Roi.X2"]), int(row["Roi.Y2"])),))
+
+
+class LisaCsvAdapter(SourceAdapter):
+    """
+    CSV di LISA (frameAnnotationsBOX.csv, separato da ';'): una riga per box. Le righe vengono raggruppate per
+    frame nell'ordine del CSV; le dimensioni non sono nel CSV e le legge il motore dall'header dell'immagine.
+    """
+
+    name = "lisa"
+    trailing_newline = True
+
+    def __init__(self, annotations_file, images_base_path):
+        super().__init__()
+        self.annotations_file = annotations_file
+        self.images_base_path = images_base_path
+        self.rows = 0
+
+    def records(self):
+        frames = {}
+        with open(self.annotations_file, "r", newline="") as csvfile:
+            for row in csv.DictReader(csvfile, delimiter=";"):
+                self.rows += 1
+                filename = row["Filename"].split("/")[-1]
+                classes, boxes = frames.setdefault(filename, ([], []))
+                classes.append(row["Annotation tag"])
+                boxes.append((int(row["Upper left corner X"]), int(row["Upper left corner Y"]),
+                              int(row["Lower right corner X"]), int(row["Lower right corner Y"])))
+        for filename, (classes, boxes) in frames.items():
+            yield SampleRecord(os.path.join(self.images_base_path, filename), None, None, classes, boxes)
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from LabelStore import LabelStore, sync
+from DatasetIO import atomic_write_bytes  # raggiungibile grazie a LabelStore (cartella superiore)
+
+# Ricette: una lista di varianti, ognuna con il suffisso dei file prodotti e una catena di operazioni [nome, parametri].
+# Le due ricette predefinite riproducono gli script AugmentRareClasses.py (val) e AugmentRareclasses_2.py (train).
+RECIPES = {
+    "rare_val": [
+        {"suffix": "_bright", "ops": [["brightness", {"factor_range": [0.6, 1.4]}]]},  # più scura o più chiara
+        {"suffix": "_blur", "ops": [["blur", {"ksize": [7, 7]}]]},
+    ],
+    "rare_train": [
+        {"suffix": "_flip", "ops": [["flip", {}]]},
+        {"suffix": "_bright1", "ops": [["brightness", {"factor": 0.6}]]},  # più scura
+        {"suffix": "_bright2", "ops": [["brightness", {"factor": 1.0}]]},  # normale
+        {"suffix": "_bright3", "ops": [["brightness", {"factor": 1.4}]]},  # più chiara
+        {"suffix": "_blur1", "ops": [["blur", {"ksize": [3, 3]}]]},  # leggera
+        {"suffix": "_blur2", "ops": [["blur", {"ksize": [7, 7]}]]},  # media
+        {"suffix": "_blur3", "ops": [["blur", {"ksize": [15, 15]}]]},  # forte
+    ],
+}
+
+
+def _brightness_factor(params, rng):
+    if "factor_range" in params:
+        low, high = params["factor_range"]
+        return rng.uniform(low, high)
+    return params["factor"]
+
+
+def _op_brightness(image, params, rng, hsv_of):
+    """Scala il canale V in HSV. L'HSV dell'immagine di partenza viene calcolato una volta sola e condiviso."""
+    factor = _brightness_factor(params, rng)
+    hsv = hsv_of(image).copy()
+    # Stesso risultato di np.clip(v * factor, 0, 255) assegnato a uint8, ma con una tabella di 256 valori
+    table = np.clip(np.arange(256) * factor, 0, 255).astype(np.uint8)
+    hsv[:, :, 2] = table[hsv[:, :, 2]]
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def _op_blur(image, params, rng, hsv_of):
+    return cv2.GaussianBlur(image, tuple(params["ksize"]), params.get("sigma", 0))
+
+
+def _op_flip(image, params, rng, hsv_of):
+    return cv2.flip(image, 1)
+
+
+# Operazioni sull'immagine: (immagine, parametri, rng, hsv_of) -> immagine
+OPS = {"brightness": _op_brightness, "blur": _op_blur, "flip": _op_flip}
+# Operazioni che spostano i box: le altre lasciano la label invariata (copiata così com'è)
+GEOMETRIC_OPS = {"flip"}
+
+
+def transform_boxes(xywh, ops):
+    """Box (x, y, w, h normalizzati) dopo la catena di operazioni: solo le operazioni geometriche li spostano."""
+    boxes = [list(box) for box in xywh]
+    for name, _ in ops:
+        if name == "flip":
+            for box in boxes:
+                box[0] = 1.0 - box[0]
+    return boxes
+
+
+def _variant_label(label_bytes, cls, xywh, ops):
+    """Label della variante: il file originale se la catena non sposta i box, altrimenti le righe trasformate."""
+    if not any(name in GEOMETRIC_OPS for name, _ in ops):
+        return label_bytes
+    lines = [f"{int(c)} {x} {y} {w} {h}" for c, (x, y, w, h) in zip(cls, transform_boxes(xywh, ops))]
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+def variant_rng(seed, base_name, suffix):
+    """Generatore casuale di una variante: dipende solo da seed, immagine e suffisso, quindi è riproducibile."""
+    return random.Random(f"{seed}:{base_name}:{suffix}")
+
+
+class _Writer:
+    """
+    Thread di scrittura di un worker: codifica JPEG e scrive su disco mentre il worker calcola la variante successiva
+    (cv2.imencode rilascia il GIL). La coda è limitata, così le immagini in attesa non crescono senza limite.
+    """
+
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            image_path, image, label_path, label_bytes = self.queue.get()
+            try:
+                ok, encoded = cv2.imencode(os.path.splitext(image_path)[1], image)
+                if not ok:
+                    raise ValueError("codifica fallita")
+                atomic_write_bytes(image_path, encoded.tobytes())
+                atomic_write_bytes(label_path, label_bytes)
+                self.bytes_written += len(encoded) + len(label_bytes)
+            except Exception as e:
+                self.errors.append(f"⚠️ Errore nello scrivere {image_path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def submit(self, image_path, image, label_path, label_bytes):
+        self.queue.put((image_path, image, label_path, label_bytes))
+
+    def drain(self):
+        """Attende le scritture in coda e restituisce (errori, byte scritti) accumulati da allora, azzerandoli."""
+        self.queue.join()
+        errors, written = self.errors, self.bytes_written
+        self.errors, self.bytes_written = [], 0
+        return errors, written
+
+
+_writer = None
+
+
+def _worker_writer():
+    """Thread di scrittura del processo corrente (uno per worker, creato al primo uso)."""
+    global _writer
+    if _writer is None:
+        _writer = _Writer()
+    return _writer
+
+
+def _is_random(params):
+    return "factor_range" in params
+
+
+def run_chain(image, ops, rng, cache):
+    """
+    Applica una catena di operazioni all'immagine decodificata.
+
+    I risultati intermedi (e l'HSV di ogni immagine intermedia) restano in cache per tutta la durata dell'immagine,
+    così le varianti con un prefisso comune non rifanno lo stesso lavoro: ad esempio tutte le luminosità partono
+    dallo stesso HSV. Dopo un'operazione casuale la catena non viene più condivisa con le altre varianti.
+    """
+    key = ()
+    current = image
+    for name, params in ops:
+        if key is not None and not _is_random(params):
+            key = key + ((name, json.dumps(params, sort_keys=True)),)
+            if key in cache:
+                current = cache[key]
+                continue
+        prefix = key[:-1] if key is not None and not _is_random(params) else key
+
+        def hsv_of(img, prefix=prefix):
+            if prefix is None:
+                return cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            if ("hsv",) + prefix not in cache:
+                cache[("hsv",) + prefix] = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            return cache[("hsv",) + prefix]
+
+        current = OPS[name](current, params, rng, hsv_of)
+        if _is_random(params):
+            key = None
+        elif key is not None:
+            cache[key] = current
+    return current
+
+
+def augment_image(job):
+    """
+    Genera tutte le varianti di un'immagine (eseguita nei worker): decodifica una sola volta, catene con cache
+    condivisa, codifica e scrittura sul thread di scrittura del worker mentre si calcola la variante successiva.
+
+    Returns:
+        dict: {"variants": varianti prodotte, "bytes": byte scritti, "errors": messaggi}
+    """
+    img_path, label_path, base_name, cls, xywh, variants, img_dir, lbl_dir, seed = job
+    writer = _worker_writer()
+    image = cv2.imread(img_path)
+    if image is None:
+        return {"variants": 0, "bytes": 0, "errors": [f"⚠️ Errore nel leggere: {img_path}"]}
+    with open(label_path, "rb") as f:
+        label_bytes = f.read()
+
+    cache = {}
+    for variant in variants:
+        rng = variant_rng(seed, base_name, variant["suffix"])
+        result = run_chain(image, variant["ops"], rng, cache)
+        writer.submit(os.path.join(img_dir, base_name + variant["suffix"] + ".jpg"), result,
+                      os.path.join(lbl_dir, base_name + variant["suffix"] + ".txt"),
+                      _variant_label(label_bytes, cls, xywh, variant["ops"]))
+    del cache
+    errors, written = writer.drain()
+    return {"variants": len(variants) - len(errors), "bytes": written, "errors": errors}
+
+
+def select_images(store, classes):
+    """Indici delle immagini con almeno una delle classi date, dall'indice in memoria del label store."""
+    return store.images_with_classes(classes).tolist()
+
+
+def augment(img_dir, lbl_dir, classes, variants, workers=None, seed=0, image_ext=".jpg", images=None):
+    """
+    Aumenta le immagini che contengono le classi indicate, applicando a ognuna tutte le varianti della ricetta.
+
+    Args:
+        img_dir (str): Cartella delle immagini dello split (le varianti vengono scritte qui).
+        lbl_dir (str): Cartella delle label dello split.
+        classes (list): Classi rare: vengono aumentate le immagini che ne contengono almeno una.
+        variants (list): Ricetta, es. RECIPES["rare_train"].
+        workers (int): Processi (None = numero di CPU, 1 = seriale nel processo corrente).
+        seed (int): Seed delle operazioni casuali (ogni immagine/variante ha un generatore deterministico).
+        image_ext (str): Estensione delle immagini sorgente.
+        images (list): (opzionale) lista di (nome immagine, varianti) da eseguire al posto della selezione per classe;
+                       usata dal planner per eseguire solo le coppie scelte.
+
+    Returns:
+        dict: {"images", "variants", "bytes", "errors", "seconds"}
+    """
+    start_time = time.perf_counter()
+    store = LabelStore.open(lbl_dir)
+    if images is None:
+        images = [(store.names[i], variants) for i in select_images(store, classes)]
+
+    jobs = []
+    for name, image_variants in images:
+        cls, xywh = store.labels(name)
+        jobs.append((os.path.join(img_dir, name + image_ext), os.path.join(lbl_dir, name + ".txt"), name,
+                     cls.tolist(), xywh.tolist(), image_variants, img_dir, lbl_dir, seed))
+    store.close()
+
+    stats = {"images": len(jobs), "variants": 0, "bytes": 0, "errors": []}
+    if workers == 1 or len(jobs) < 2:
+        results = [augment_image(job) for job in jobs]
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, min(16, len(jobs) // (4 * workers)))
+            results = list(pool.map(augment_image, jobs, chunksize=chunksize))
+    for result in results:
+        stats["variants"] += result["variants"]
+        stats["bytes"] += result["bytes"]
+        stats["errors"] += result["errors"]
+
+    # Le nuove label entrano nello store, così le statistiche successive non devono rileggere tutto
+    sync(lbl_dir)
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def load_config(path):
+    """
+    Configurazione JSON dell'augmentation, es.:
+        {"classi_rare": [0], "images": "combined_dataset/images/train", "labels": "combined_dataset/labels/train",
+         "recipe": "rare_train"}
+    "recipe" può essere il nome di una ricetta predefinita oppure direttamente la lista delle varianti.
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    if isinstance(config.get("recipe"), str):
+        config["recipe"] = RECIPES[config["recipe"]]
+    return config
+
+
+def print_report(stats):
+    elapsed = max(stats["seconds"], 1e-9)
+    print(f"Aumentate {stats['images']} immagini: {stats['variants']} varianti "
+          f"({stats['bytes'] / (1024 * 1024):.1f} MB) in {stats['seconds']:.2f}s ({stats['variants'] / elapsed:.1f} varianti/s)")
+    for error in stats["errors"]:
+        print(error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Augmentation delle classi rare: decodifica una volta, varianti in parallelo.")
+    parser.add_argument("--config", default=None, help="File JSON con classi rare, cartelle e ricetta (vedi load_config)")
+    parser.add_argument("--split", default="train", help="Split del dataset combinato (default: train)")
+    parser.add_argument("--classes", type=int, nargs="*", default=None, help="Classi rare (sovrascrive la configurazione)")
+    parser.add_argument("--recipe", default=None, choices=sorted(RECIPES), help="Ricetta predefinita (default: rare_train)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi (default: numero di CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed delle operazioni casuali")
+    args = parser.parse_args()
+
+    config = load_config(args.config) if args.config else {}
+    img_dir = config.get("images", f"combined_dataset/images/{args.split}")
+    lbl_dir = config.get("labels", f"combined_dataset/labels/{args.split}")
+    classes = args.classes if args.classes is not None else config.get("classi_rare", [0])
+    recipe = RECIPES[args.recipe] if args.recipe else config.get("recipe", RECIPES["rare_train"])
+
+    print_report(augment(img_dir, lbl_dir, classes, recipe, workers=args.workers, seed=args.seed))
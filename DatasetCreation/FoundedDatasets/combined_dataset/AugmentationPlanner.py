@@ -0,0 +1,189 @@
+import argparse
+import heapq
+import json
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+from AugmentationEngine import RECIPES, augment, print_report, run_chain
+from LabelStore import LabelStore
+
+
+def class_counts(store):
+    """
+    Matrice immagini x classi con il numero di box di ogni classe in ogni immagine.
+
+    Returns:
+        tuple: (matrice int32 di forma (immagini, classi), istanze totali per classe)
+    """
+    cls = np.asarray(store.cls, dtype=np.int64)
+    num_classes = int(cls.max()) + 1 if len(cls) else 0
+    flat = np.bincount(store.box_image * num_classes + cls, minlength=len(store) * num_classes)
+    matrix = flat.reshape(len(store), num_classes).astype(np.int32)
+    return matrix, matrix.sum(axis=0)
+
+
+def plan(store, targets, variants, img_names=None, waste_weight=0.1):
+    """
+    Sceglie le coppie (immagine, variante) da generare per portare ogni classe al suo obiettivo di istanze.
+
+    È un multicover greedy: ogni variante di un'immagine aggiunge tutti i box dell'immagine (le varianti della ricetta
+    non cambiano le classi), quindi a ogni passo si sceglie l'immagine con il punteggio più alto:
+        istanze utili (fino al deficit residuo di ogni classe) - waste_weight * istanze di classi già a obiettivo.
+    Il punteggio di un'immagine può solo scendere man mano che i deficit si riducono, per cui basta una coda di
+    priorità con rivalutazione pigra (lazy greedy) invece di ricalcolare tutte le immagini a ogni passo.
+    Ogni immagine può essere usata al più una volta per variante; le varianti già presenti su disco sono saltate.
+
+    Args:
+        store (LabelStore): Label dello split.
+        targets (dict): {classe: istanze obiettivo}.
+        variants (list): Ricetta (es. RECIPES["rare_train"]): le varianti disponibili per ogni immagine.
+        img_names (set): (opzionale) nomi dei file presenti nella cartella immagini, per saltare le varianti già create.
+        waste_weight (float): Penalità per ogni istanza prodotta di una classe che ha già raggiunto l'obiettivo.
+
+    Returns:
+        dict: {"pairs": [(nome, [varianti])], "before", "after", "targets"} (conteggi per classe)
+    """
+    matrix, before = class_counts(store)
+    num_classes = max(len(before), max(targets, default=-1) + 1)
+    before = np.pad(before, (0, num_classes - len(before)))
+    matrix = np.pad(matrix, ((0, 0), (0, num_classes - matrix.shape[1])))
+    target = np.zeros(num_classes, dtype=np.int64)
+    for c, n in targets.items():
+        target[c] = n
+    deficit = np.maximum(target - before, 0)
+
+    # Le immagini già aumentate non vengono aumentate di nuovo
+    suffixes = tuple(variant["suffix"] for variant in variants)
+    names = store.names
+    candidates = np.flatnonzero(matrix[:, deficit > 0].sum(axis=1) > 0)
+    candidates = [i for i in candidates.tolist() if not names[i].endswith(suffixes)]
+
+    def available(i):
+        if img_names is None:
+            return list(variants)
+        return [v for v in variants if names[i] + v["suffix"] + ".jpg" not in img_names]
+
+    def score(i):
+        row = matrix[i]
+        useful = np.minimum(row, deficit).sum()
+        waste = row[deficit == 0].sum()
+        return useful - waste_weight * waste, useful
+
+    remaining = {}
+    heap = []
+    for i in candidates:
+        remaining[i] = available(i)
+        s, useful = score(i)
+        if remaining[i] and useful > 0:
+            heap.append((-s, i))
+    heapq.heapify(heap)
+
+    chosen = {}
+    while heap and deficit.any():
+        _, i = heapq.heappop(heap)
+        s, useful = score(i)
+        if useful <= 0:
+            continue
+        if heap and -heap[0][0] > s:
+            heapq.heappush(heap, (-s, i))  # punteggio non più aggiornato: rivaluta più tardi
+            continue
+        chosen.setdefault(i, []).append(remaining[i].pop(0))
+        deficit = np.maximum(deficit - matrix[i], 0)
+        if remaining[i]:
+            heapq.heappush(heap, (-s, i))
+
+    after = before.copy()
+    for i, image_variants in chosen.items():
+        after += matrix[i] * len(image_variants)
+    pairs = [(names[i], image_variants) for i, image_variants in sorted(chosen.items())]
+    return {"pairs": pairs, "before": before, "after": after, "targets": target}
+
+
+def estimate_cost(pairs, img_dir, workers=None, sample=8, image_ext=".jpg", seed=0):
+    """
+    Stima (dry run) del costo di un piano: esegue in memoria decodifica, operazioni e codifica su un campione
+    di coppie, senza scrivere nulla, e proietta tempo e byte su tutte le coppie.
+
+    Returns:
+        dict: {"images", "variants", "bytes", "seconds"} stimati
+    """
+    flat = [(name, variant) for name, image_variants in pairs for variant in image_variants]
+    if not flat:
+        return {"images": 0, "variants": 0, "bytes": 0, "seconds": 0.0}
+    picked = random.Random(seed).sample(flat, min(sample, len(flat)))
+
+    start_time = time.perf_counter()
+    sampled_bytes = 0
+    for name, variant in picked:
+        image = cv2.imread(os.path.join(img_dir, name + image_ext))
+        if image is None:
+            continue
+        result = run_chain(image, variant["ops"], random.Random(seed), {})
+        ok, encoded = cv2.imencode(".jpg", result)
+        sampled_bytes += len(encoded) if ok else 0
+    per_variant = (time.perf_counter() - start_time) / len(picked)
+
+    workers = workers or os.cpu_count() or 1
+    return {
+        "images": len(pairs),
+        "variants": len(flat),
+        "bytes": int(sampled_bytes / len(picked) * len(flat)),
+        # Nel piano reale ogni immagine viene decodificata una volta sola: la stima per variante è prudente
+        "seconds": per_variant * len(flat) / workers,
+    }
+
+
+def parse_targets(target=None, targets_path=None, classes=None, num_classes=0):
+    """
+    Obiettivi per classe: un valore unico (--target, per le classi indicate o per tutte) e/o un file JSON {classe: n}.
+    """
+    targets = {}
+    if target is not None:
+        for c in classes if classes is not None else range(num_classes):
+            targets[int(c)] = target
+    if targets_path:
+        with open(targets_path, "r") as f:
+            targets.update({int(c): int(n) for c, n in json.load(f).items()})
+    return targets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pianifica ed esegue l'augmentation minima per raggiungere le istanze obiettivo per classe.")
+    parser.add_argument("--split", default="train", help="Split del dataset combinato (default: train)")
+    parser.add_argument("--target", type=int, default=None, help="Istanze obiettivo per classe")
+    parser.add_argument("--targets", default=None, help="File JSON {classe: istanze obiettivo}")
+    parser.add_argument("--classes", type=int, nargs="*", default=None, help="Classi a cui applicare --target (default: tutte)")
+    parser.add_argument("--recipe", default="rare_train", choices=sorted(RECIPES), help="Varianti disponibili (default: rare_train)")
+    parser.add_argument("--waste-weight", type=float, default=0.1, help="Penalità per le istanze di classi già a obiettivo")
+    parser.add_argument("--workers", type=int, default=None, help="Processi (default: numero di CPU)")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra piano e costo stimato senza generare nulla")
+    parser.add_argument("--plan-out", default=None, help="Salva il piano in questo file JSON")
+    args = parser.parse_args()
+
+    img_dir = f"combined_dataset/images/{args.split}"
+    lbl_dir = f"combined_dataset/labels/{args.split}"
+    variants = RECIPES[args.recipe]
+
+    store = LabelStore.open(lbl_dir)
+    targets = parse_targets(args.target, args.targets, args.classes, int(np.max(store.cls, initial=-1)) + 1)
+    result = plan(store, targets, variants, set(os.listdir(img_dir)), args.waste_weight)
+    store.close()
+
+    print(f"\nPiano: {len(result['pairs'])} immagini, {sum(len(v) for _, v in result['pairs'])} varianti")
+    for c in sorted(targets):
+        status = "✅" if result["after"][c] >= result["targets"][c] else "⚠️"
+        print(f"{status} Classe {c}: {result['before'][c]} -> {result['after'][c]} istanze (obiettivo {result['targets'][c]})")
+
+    if args.plan_out:
+        with open(args.plan_out, "w") as f:
+            json.dump([[name, [v["suffix"] for v in image_variants]] for name, image_variants in result["pairs"]], f)
+
+    if args.dry_run:
+        cost = estimate_cost(result["pairs"], img_dir, args.workers)
+        print(f"\nStima: {cost['images']} immagini, {cost['variants']} varianti, "
+              f"{cost['bytes'] / (1024 * 1024):.1f} MB, circa {cost['seconds']:.1f}s")
+    else:
+        print_report(augment(img_dir, lbl_dir, None, variants, workers=args.workers, images=result["pairs"]))
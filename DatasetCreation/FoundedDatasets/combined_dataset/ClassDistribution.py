@@ -1,17 +1,153 @@
+import argparse
+import csv
+import json
 import os
-from collections import Counter
-
-label_dir = "combined_dataset/labels/train"
-class_counts = Counter()
-
-for file in os.listdir(label_dir):
-    if not file.endswith(".txt"):
-        continue
-    with open(os.path.join(label_dir, file), "r") as f:
-        for line in f:
-            cls_id = int(line.strip().split()[0])
-            class_counts[cls_id] += 1
-
-print("Distribuzione delle classi:")
-for cls, count in class_counts.items():
-    print(f"Classe {cls}: {count} istanze")
+import time
+
+import numpy as np
+from LabelStore import LabelStore, store_path_for, sync
+
+LABELS_ROOT = "combined_dataset/labels"
+STATS_VERSION = 1
+
+
+def split_statistics(store, bins=20):
+    """
+    Statistiche di uno split, calcolate in un solo passaggio vettoriale sulle colonne del label store.
+
+    Args:
+        store (LabelStore): Label dello split.
+        bins (int): Numero di intervalli (uguali, tra 0 e 1) degli istogrammi di larghezza, altezza e area dei box.
+
+    Returns:
+        dict: immagini, box, immagini senza box, e per classe: istanze, immagini che la contengono,
+              istogrammi w/h/area, medie; più la matrice di co-occorrenza (immagini con entrambe le classi).
+    """
+    cls = np.asarray(store.cls, dtype=np.int64)
+    xywh = np.asarray(store.xywh)
+    num_classes = int(cls.max()) + 1 if len(cls) else 0
+    box_image = store.box_image
+
+    instances = np.bincount(cls, minlength=num_classes)
+
+    # Coppie (immagine, classe) distinte: immagini per classe e co-occorrenza
+    pairs = np.unique(box_image * max(num_classes, 1) + cls)
+    pair_image, pair_class = pairs // max(num_classes, 1), pairs % max(num_classes, 1)
+    images_per_class = np.bincount(pair_class, minlength=num_classes)
+    presence = np.zeros((len(store), num_classes), dtype=np.float32)  # esatto fino a 16M immagini
+    presence[pair_image, pair_class] = 1.0
+    cooccurrence = (presence.T @ presence).astype(np.int64)
+
+    # Istogrammi per classe: un solo bincount su (classe, intervallo)
+    w, h = xywh[:, 2], xywh[:, 3]
+    histograms = {}
+    for name, values in (("width", w), ("height", h), ("area", w * h)):
+        bin_index = np.clip((values * bins).astype(np.int64), 0, bins - 1)
+        histograms[name] = np.bincount(cls * bins + bin_index, minlength=num_classes * bins).reshape(num_classes, bins)
+
+    def per_class_mean(values):
+        sums = np.bincount(cls, weights=values, minlength=num_classes)
+        return np.divide(sums, instances, out=np.zeros(num_classes), where=instances > 0)
+
+    means = {"width": per_class_mean(w), "height": per_class_mean(h), "area": per_class_mean(w * h)}
+    classes = {}
+    for c in np.flatnonzero(instances).tolist():
+        classes[str(c)] = {
+            "instances": int(instances[c]),
+            "images": int(images_per_class[c]),
+            "mean_width": float(means["width"][c]),
+            "mean_height": float(means["height"][c]),
+            "mean_area": float(means["area"][c]),
+            "hist_width": histograms["width"][c].tolist(),
+            "hist_height": histograms["height"][c].tolist(),
+            "hist_area": histograms["area"][c].tolist(),
+        }
+    present = np.flatnonzero(instances)
+    return {
+        "images": len(store),
+        "boxes": len(cls),
+        "empty_images": int((store.counts == 0).sum()),
+        "bins": bins,
+        "classes": classes,
+        "cooccurrence": {"classes": present.tolist(), "matrix": cooccurrence[np.ix_(present, present)].tolist()},
+    }
+
+
+def _cache_path(store_path):
+    return store_path + ".stats.json"
+
+
+def cached_split_statistics(labels_dir, bins=20, use_cache=True):
+    """
+    Statistiche di uno split con cache.
+
+    Il label store viene prima sincronizzato (vengono riletti solo i .txt con mtime/dimensione cambiati);
+    se lo store non è cambiato dall'ultimo calcolo le statistiche vengono lette dalla cache accanto allo store.
+
+    Returns:
+        tuple: (statistiche, True se lette dalla cache)
+    """
+    store_path = store_path_for(labels_dir)
+    sync(labels_dir, store_path)
+    st = os.stat(store_path)
+    key = {"version": STATS_VERSION, "store": [st.st_mtime_ns, st.st_size], "bins": bins}
+
+    cache_path = _cache_path(store_path)
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["stats"], True
+
+    store = LabelStore(store_path)
+    stats = split_statistics(store, bins)
+    store.close()
+    with open(cache_path, "w") as f:
+        json.dump({"key": key, "stats": stats}, f)
+    return stats, False
+
+
+def find_splits(labels_root):
+    """Split presenti (sottocartelle di labels_root, es. train e val)."""
+    return sorted(entry.name for entry in os.scandir(labels_root) if entry.is_dir() and not entry.name.startswith((".", "__")))
+
+
+def write_csv(all_stats, path):
+    """Una riga per (split, classe): istanze, immagini e dimensioni medie dei box."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["split", "class", "instances", "images", "mean_width", "mean_height", "mean_area"])
+        for split, stats in all_stats.items():
+            for cls, info in sorted(stats["classes"].items(), key=lambda item: int(item[0])):
+                writer.writerow([split, cls, info["instances"], info["images"],
+                                 f"{info['mean_width']:.6f}", f"{info['mean_height']:.6f}", f"{info['mean_area']:.6f}"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistiche di classi e box del dataset combinato, per ogni split.")
+    parser.add_argument("--labels-root", default=LABELS_ROOT, help=f"Cartella con gli split di label (default: {LABELS_ROOT})")
+    parser.add_argument("--splits", nargs="*", default=None, help="Split da analizzare (default: tutti quelli presenti)")
+    parser.add_argument("--bins", type=int, default=20, help="Intervalli degli istogrammi di larghezza/altezza/area (default: 20)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva tutte le statistiche in questo file JSON")
+    parser.add_argument("--csv", dest="csv_path", default=None, help="Salva la tabella per classe in questo file CSV")
+    parser.add_argument("--no-cache", action="store_true", help="Ricalcola ignorando la cache")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    all_stats = {}
+    for split in args.splits or find_splits(args.labels_root):
+        stats, from_cache = cached_split_statistics(os.path.join(args.labels_root, split), args.bins, not args.no_cache)
+        all_stats[split] = stats
+
+        print(f"\nDistribuzione delle classi ({split}: {stats['images']} immagini, {stats['boxes']} box"
+              f"{', dalla cache' if from_cache else ''}):")
+        for cls, info in sorted(stats["classes"].items(), key=lambda item: int(item[0])):
+            print(f"Classe {cls}: {info['instances']} istanze in {info['images']} immagini "
+                  f"(box medio {info['mean_width']:.3f} x {info['mean_height']:.3f})")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(all_stats, f, indent=2)
+    if args.csv_path:
+        write_csv(all_stats, args.csv_path)
+    print(f"\nCompletato in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,275 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from AugmentationEngine import RECIPES
+from LabelStore import LabelStore, sync
+from Undersampling import list_images, remove_samples
+
+HASH_VERSION = 2
+
+# Suffissi delle varianti scritte dal motore di augmentation (_flip, _bright1, _blur2, ...): una variante sfocata o
+# schiarita dista dalla sua sorgente meno della soglia e ha gli stessi box, quindi verrebbe eliminata come duplicato
+AUGMENTATION_SUFFIXES = tuple(sorted({variant["suffix"] for variants in RECIPES.values() for variant in variants}))
+
+
+def dhash(path):
+    """
+    Difference hash a 64 bit: immagine in scala di grigi ridotta a 9x8, un bit per ogni confronto tra pixel adiacenti.
+    La decodifica JPEG avviene già ridotta di 4 volte (IMREAD_REDUCED_GRAYSCALE_4), molto più veloce di quella completa.
+
+    Returns:
+        int: hash, None se l'immagine non è leggibile (0 è un hash valido, es. frame uniformi)
+    """
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits, bitorder="little").view("<u8")[0])
+
+
+def _hash_chunk(paths):
+    return [dhash(path) for path in paths]
+
+
+def _cache_path(img_dir):
+    return img_dir.rstrip("/\\") + ".dhash.npz"
+
+
+def compute_hashes(img_dir, images, workers=None, chunk_size=256):
+    """
+    dHash di tutte le immagini, con cache accanto alla cartella: vengono ricalcolate solo le immagini nuove
+    o con mtime/dimensione cambiati, in un pool di processi.
+
+    Args:
+        img_dir (str): Cartella delle immagini.
+        images (dict): {nome senza estensione: file} (da list_images).
+
+    Returns:
+        tuple: (nomi ordinati, hash uint64 nello stesso ordine, bool True per le immagini leggibili,
+                numero di hash calcolati)
+    """
+    cache = {}
+    cache_path = _cache_path(img_dir)
+    if os.path.exists(cache_path):
+        data = np.load(cache_path)
+        if int(data["version"]) == HASH_VERSION:
+            for name, mtime, size, h, ok in zip(data["names"].tolist(), data["mtime_ns"], data["size"], data["hash"],
+                                                data["valid"]):
+                cache[name] = (int(mtime), int(size), h, bool(ok))
+
+    names = sorted(images)
+    stats = [os.stat(os.path.join(img_dir, images[name])) for name in names]
+    todo = [i for i, (name, st) in enumerate(zip(names, stats))
+            if name not in cache or cache[name][:2] != (st.st_mtime_ns, st.st_size)]
+
+    hashes = np.array([cache[name][2] if name in cache else 0 for name in names], dtype=np.uint64)
+    valid = np.array([cache[name][3] if name in cache else True for name in names], dtype=bool)
+    if todo:
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        path_chunks = [[os.path.join(img_dir, images[names[i]]) for i in chunk] for chunk in chunks]
+        if workers == 1 or len(chunks) == 1:
+            results = map(_hash_chunk, path_chunks)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(_hash_chunk, path_chunks)
+        for chunk, chunk_hashes in zip(chunks, results):
+            valid[chunk] = [h is not None for h in chunk_hashes]
+            hashes[chunk] = np.array([h or 0 for h in chunk_hashes], dtype=np.uint64)
+        if pool:
+            pool.shutdown()
+
+        tmp = cache_path + ".tmp.npz"
+        np.savez(tmp, version=HASH_VERSION, names=np.array(names), hash=hashes, valid=valid,
+                 mtime_ns=np.array([st.st_mtime_ns for st in stats], dtype=np.int64),
+                 size=np.array([st.st_size for st in stats], dtype=np.int64))
+        os.replace(tmp, cache_path)
+    return names, hashes, valid, len(todo)
+
+
+def hamming(a, b):
+    """Distanza di Hamming (vettoriale) tra hash a 64 bit."""
+    return np.bitwise_count(np.bitwise_xor(a, b))
+
+
+def near_pairs(hashes, threshold, max_bucket=2000):
+    """
+    Coppie di hash a distanza di Hamming <= threshold, con un indice multiplo: l'hash viene diviso in threshold + 1
+    blocchi di bit e due hash così vicini coincidono per forza in almeno un blocco (principio dei cassetti).
+    Per ogni blocco le immagini vengono ordinate per valore del blocco, e si confrontano solo quelle con lo stesso valore.
+
+    Args:
+        hashes (np.ndarray): uint64.
+        threshold (int): Distanza massima.
+        max_bucket (int): Oltre questa dimensione un gruppo viene confrontato solo tra elementi vicini nell'ordine
+                          (evita il costo quadratico su gruppi enormi, es. immagini uniformi). Il risultato coincide
+                          con il confronto a forza bruta solo se nessun gruppo supera max_bucket; altrimenti alcune
+                          coppie possono mancare. None = nessun limite (sempre esatto).
+
+    Returns:
+        np.ndarray: coppie (i, j) con i < j, forma (n, 2)
+    """
+    n = len(hashes)
+    blocks = threshold + 1
+    bounds = np.linspace(0, 64, blocks + 1).astype(np.int64)
+    pairs = []
+    for b in range(blocks):
+        width = int(bounds[b + 1] - bounds[b])
+        keys = (hashes >> np.uint64(bounds[b])) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        rank = np.arange(n) - np.repeat(starts, sizes)  # posizione di ogni elemento nel suo gruppo
+        remaining = np.repeat(sizes, sizes) - rank  # elementi del gruppo da qui in poi (incluso)
+        # Confronto tra elementi dello stesso gruppo a distanza d nell'ordine, per d = 1, 2, ...: vettoriale per ogni d,
+        # su un insieme di posizioni attive che si restringe (solo i gruppi con più di d elementi)
+        active = np.flatnonzero(remaining > 1)
+        for d in range(1, max_bucket or n):
+            active = active[remaining[active] > d]
+            if not len(active):
+                break
+            i, j = order[active], order[active + d]
+            close = hamming(hashes[i], hashes[j]) <= threshold
+            pairs.append(np.stack([np.minimum(i, j)[close], np.maximum(i, j)[close]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def clusters(n, pairs):
+    """Componenti connesse (union-find con compressione dei cammini) del grafo delle coppie vicine."""
+    parent = list(range(n))
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for i, j in pairs.tolist():
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    return np.array([find(i) for i in range(n)], dtype=np.int64)
+
+
+def in_scope(names, only=None, skip_suffixes=AUGMENTATION_SUFFIXES):
+    """
+    Immagini su cui cercare i duplicati: non quelle con un suffisso di augmentation (sono quasi identiche alla
+    sorgente per costruzione) e, con only, solo quelle il cui nome soddisfa la regex (es. i frame dei video).
+
+    Returns:
+        np.ndarray: bool, True per le immagini da considerare
+    """
+    pattern = re.compile(only) if only else None
+    return np.array([not name.endswith(skip_suffixes) and (pattern is None or bool(pattern.search(name)))
+                     for name in names], dtype=bool)
+
+
+def select_duplicates(names, hashes, label_counts, threshold, valid=None):
+    """
+    Sceglie le immagini da eliminare. In ogni gruppo (componente connessa) le immagini vengono ordinate per numero
+    di box (poi per nome) e tenute solo se distano più di threshold da tutte quelle già tenute: una lunga sequenza
+    che cambia lentamente non collassa in un solo frame, perché frame lontani dal rappresentante restano.
+    Le immagini con valid False (non leggibili, senza hash) non vengono mai considerate duplicati.
+
+    Returns:
+        tuple: (indici da eliminare, numero di gruppi con duplicati)
+    """
+    candidates = np.arange(len(names)) if valid is None else np.flatnonzero(valid)
+    pairs = candidates[near_pairs(hashes[candidates], threshold)]
+    roots = clusters(len(names), pairs)
+    order = candidates[np.lexsort((np.array(names)[candidates], -label_counts[candidates], roots[candidates]))]
+    boundaries = np.flatnonzero(np.r_[True, roots[order][1:] != roots[order][:-1], True])
+
+    remove, groups = [], 0
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        if end - start < 2:
+            continue
+        groups += 1
+        kept = [order[start]]
+        for i in order[start + 1:end]:
+            if (hamming(hashes[kept], hashes[i]) <= threshold).any():
+                remove.append(int(i))
+            else:
+                kept.append(i)
+    return sorted(remove), groups
+
+
+def deduplicate(img_dir, lbl_dir, threshold=4, dry_run=False, workers=None, only=None,
+                skip_suffixes=AUGMENTATION_SUFFIXES):
+    """
+    Elimina i frame quasi identici di uno split (immagine e label insieme), tenendo in ogni gruppo quello con più box.
+    Le immagini fuori perimetro (vedi in_scope) non vengono né confrontate né eliminate.
+
+    Returns:
+        dict: {"images", "skipped", "hashed", "groups", "remove", "unreadable", "bytes", "excluded", "errors", "seconds"}
+    """
+    start_time = time.perf_counter()
+    images = list_images(img_dir)
+    stems = sorted(images)
+    scope = in_scope(stems, only, skip_suffixes)
+    skipped = len(stems) - int(scope.sum())
+    images = {stem: images[stem] for stem, keep in zip(stems, scope.tolist()) if keep}
+    names, hashes, valid, hashed = compute_hashes(img_dir, images, workers)
+
+    store = LabelStore.open(lbl_dir)
+    counts = np.zeros(len(names), dtype=np.int64)
+    positions = {name: i for i, name in enumerate(names)}
+    for name, count in zip(store.names, store.counts.tolist()):
+        if name in positions:
+            counts[positions[name]] = count
+    store.close()
+
+    remove, groups = select_duplicates(names, hashes, counts, threshold, valid)
+    pairs = [(os.path.join(img_dir, images[names[i]]), os.path.join(lbl_dir, names[i] + ".txt")) for i in remove]
+    pairs = [(image, label if os.path.exists(label) else None) for image, label in pairs]
+
+    stats = {"images": len(names), "skipped": skipped, "hashed": hashed, "groups": groups, "remove": [names[i] for i in remove],
+             "unreadable": [images[names[i]] for i in np.flatnonzero(~valid)], "bytes": 0, "excluded": 0, "errors": []}
+    if dry_run:
+        stats["bytes"] = sum(os.path.getsize(p) for pair in pairs for p in pair if p is not None)
+    else:
+        stats["bytes"], stats["errors"], stats["excluded"] = remove_samples(pairs, img_dir, "deduplicate")
+        sync(lbl_dir)
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rimuove i frame quasi duplicati (dHash) del dataset combinato.")
+    parser.add_argument("--split", default="train", help="Split del dataset combinato (default: train)")
+    parser.add_argument("--threshold", type=int, default=4, help="Distanza di Hamming massima tra duplicati (default: 4 su 64 bit)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi per il calcolo degli hash (default: numero di CPU)")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra cosa verrebbe eliminato senza eliminare nulla")
+    parser.add_argument("--only", default=None, help="Regex: considera solo immagini con nome corrispondente (es. '^dayClip')")
+    parser.add_argument("--include-augmented", action="store_true",
+                        help="Considera anche le varianti di augmentation (_flip, _bright*, _blur*), escluse per default")
+    args = parser.parse_args()
+
+    stats = deduplicate(f"combined_dataset/images/{args.split}", f"combined_dataset/labels/{args.split}",
+                        args.threshold, args.dry_run, args.workers, args.only,
+                        () if args.include_augmented else AUGMENTATION_SUFFIXES)
+    verb = "Da eliminare" if args.dry_run else "Eliminati"
+    print(f"{stats['images']} immagini ({stats['hashed']} hash calcolati, gli altri dalla cache), {stats['groups']} gruppi di duplicati")
+    if stats["skipped"]:
+        print(f"{stats['skipped']} immagini fuori perimetro (varianti di augmentation o escluse da --only), non confrontate")
+    print(f"{verb}: {len(stats['remove'])} frame duplicati, {stats['bytes'] / (1024 * 1024):.1f} MB")
+    if stats["unreadable"]:
+        print(f"{len(stats['unreadable'])} immagini non leggibili (escluse dal confronto, non eliminate):")
+        for name in stats["unreadable"]:
+            print(f"  {name}")
+    if stats["excluded"]:
+        print(f"Manifest di build: {stats['excluded']} campioni segnati come esclusi (CombineDatasets non li ricrea)")
+    for error in stats["errors"]:
+        print(error)
+    print(f"Completato in {stats['seconds']:.2f}s")
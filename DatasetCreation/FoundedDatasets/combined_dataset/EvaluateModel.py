@@ -0,0 +1,355 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from LabelStore import LabelStore
+from Undersampling import list_images
+
+PREDICTIONS_VERSION = 1
+RECORD_CONF = 0.001  # come il validator di ultralytics: ogni soglia più alta si ricalcola dalla cache
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+SOURCES = ("gtsrb", "lisa", "veri", "person")  # prefissi dei nomi dati da CombineDatasets
+
+
+def _model_digest(model_path):
+    h = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+def predictions_path_for(img_dir, model_path, imgsz, record_conf=RECORD_CONF):
+    """Cache delle predizioni accanto alla cartella immagini, una per (contenuto del modello, imgsz, confidenza minima)."""
+    key = hashlib.sha256(f"{_model_digest(model_path)}:{imgsz}:{record_conf}".encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return img_dir.rstrip("/\\") + f".pred_{stem}_{key}.npz"
+
+
+def _load_predictions(cache_path):
+    """{nome: (mtime_ns, size, righe (n, 6))} e nomi delle classi dalla cache, vuoti se assente o di un'altra versione."""
+    if not os.path.exists(cache_path):
+        return {}, {}
+    data = np.load(cache_path)
+    if int(data["version"]) != PREDICTIONS_VERSION:
+        return {}, {}
+    rows = np.concatenate([data["xyxy"], data["conf"][:, None], data["cls"][:, None]], axis=1)
+    offsets = data["offsets"]
+    cache = {name: (int(mtime), int(size), rows[offsets[i]:offsets[i + 1]])
+             for i, (name, mtime, size) in enumerate(zip(data["names"].tolist(), data["mtime_ns"], data["size"]))}
+    return cache, {int(k): v for k, v in json.loads(str(data["class_names"])).items()}
+
+
+def predict(model_path, img_dir, images, imgsz=640, batch=16, record_conf=RECORD_CONF):
+    """
+    Predizioni del modello su tutte le immagini, con cache: il modello viene eseguito solo sulle immagini nuove
+    o con mtime/dimensione cambiati, quindi una seconda valutazione non fa inferenza.
+
+    Args:
+        img_dir (str): Cartella delle immagini.
+        images (dict): {nome senza estensione: file} (da list_images).
+
+    Returns:
+        tuple: ({"names", "image", "xyxy", "conf", "cls", "class_names"}, numero di immagini elaborate dal modello)
+               con i box in coordinate normalizzate x1, y1, x2, y2.
+    """
+    cache_path = predictions_path_for(img_dir, model_path, imgsz, record_conf)
+    cache, class_names = _load_predictions(cache_path)
+
+    names = sorted(images)
+    stats = [os.stat(os.path.join(img_dir, images[name])) for name in names]
+    todo = [name for name, st in zip(names, stats)
+            if name not in cache or cache[name][:2] != (st.st_mtime_ns, st.st_size)]
+
+    rows = {name: cache[name][2] for name in names if name in cache}
+    if todo:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+        class_names = {int(k): v for k, v in model.names.items()}
+        for start in range(0, len(todo), batch):
+            chunk = todo[start:start + batch]
+            results = model([os.path.join(img_dir, images[name]) for name in chunk], imgsz=imgsz, conf=record_conf,
+                            verbose=False)
+            for name, result in zip(chunk, results):
+                boxes = result.boxes
+                rows[name] = np.concatenate([boxes.xyxyn.cpu().numpy(), boxes.conf.cpu().numpy()[:, None],
+                                             boxes.cls.cpu().numpy()[:, None]], axis=1).reshape(-1, 6)
+
+    ordered = [rows[name] for name in names]
+    counts = np.array([len(r) for r in ordered], dtype=np.int64)
+    table = np.concatenate(ordered).astype(np.float32) if ordered else np.zeros((0, 6), dtype=np.float32)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    if todo or len(cache) != len(names):
+        tmp = cache_path + ".tmp.npz"
+        np.savez(tmp, version=PREDICTIONS_VERSION, names=np.array(names), offsets=offsets,
+                 mtime_ns=np.array([st.st_mtime_ns for st in stats], dtype=np.int64),
+                 size=np.array([st.st_size for st in stats], dtype=np.int64),
+                 xyxy=table[:, :4], conf=table[:, 4], cls=table[:, 5].astype(np.int32),
+                 class_names=np.array(json.dumps(class_names)))
+        os.replace(tmp, cache_path)
+
+    predictions = {"names": names, "image": np.repeat(np.arange(len(names)), counts), "xyxy": table[:, :4],
+                   "conf": table[:, 4], "cls": table[:, 5].astype(np.int64), "class_names": class_names}
+    return predictions, len(todo)
+
+
+def ground_truth(store, image_names):
+    """Box delle label (dal label store) come colonne, con l'indice dell'immagine riferito a image_names."""
+    position = {name: i for i, name in enumerate(image_names)}
+    store_image = np.array([position.get(name, -1) for name in store.names], dtype=np.int64)
+    box_image = store_image[store.box_image] if len(store_image) else np.zeros(0, dtype=np.int64)
+    keep = box_image >= 0  # label senza immagine: ignorate
+    xywh = np.asarray(store.xywh)[keep]
+    xyxy = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+    return {"image": box_image[keep], "xyxy": xyxy, "cls": np.asarray(store.cls, dtype=np.int64)[keep]}
+
+
+def image_sources(image_names):
+    """Sorgente di ogni immagine dal prefisso del nome: indice in SOURCES, len(SOURCES) se sconosciuta."""
+    prefixes = {source: i for i, source in enumerate(SOURCES)}
+    return np.array([prefixes.get(name.split("_", 1)[0], len(SOURCES)) for name in image_names], dtype=np.int64)
+
+
+def candidate_pairs(pred, gt, class_aware=True):
+    """
+    Tutte le coppie (predizione, box vero) della stessa immagine (e della stessa classe se class_aware), con la loro
+    IoU, ordinate per IoU decrescente. Un solo passaggio vettoriale su tutte le immagini: i box veri vengono ordinati
+    per chiave (immagine, classe) e ogni predizione prende l'intervallo con la sua chiave (searchsorted).
+
+    Returns:
+        tuple: (indici delle predizioni, indici dei box veri, IoU)
+    """
+    num_classes = int(max(pred["cls"].max(initial=0), gt["cls"].max(initial=0))) + 1
+    pred_key = pred["image"] * num_classes + pred["cls"] if class_aware else pred["image"]
+    gt_key = gt["image"] * num_classes + gt["cls"] if class_aware else gt["image"]
+    gt_order = np.argsort(gt_key, kind="stable")
+    sorted_keys = gt_key[gt_order]
+    start = np.searchsorted(sorted_keys, pred_key, "left")
+    counts = np.searchsorted(sorted_keys, pred_key, "right") - start
+    pred_index = np.repeat(np.arange(len(pred_key)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    gt_index = gt_order[np.repeat(start, counts) + within]
+
+    a, b = pred["xyxy"][pred_index].astype(np.float64), gt["xyxy"][gt_index]
+    inter = np.prod(np.clip(np.minimum(a[:, 2:], b[:, 2:]) - np.maximum(a[:, :2], b[:, :2]), 0, None), axis=1)
+    union = np.prod(a[:, 2:] - a[:, :2], axis=1) + np.prod(b[:, 2:] - b[:, :2], axis=1) - inter
+    iou = inter / np.maximum(union, 1e-12)
+    order = np.argsort(-iou, kind="stable")
+    return pred_index[order], gt_index[order], iou[order]
+
+
+def greedy_match(pred_index, gt_index, iou, thresholds):
+    """
+    Abbinamento uno a uno per ogni soglia IoU (come ultralytics): tra le coppie sopra soglia, in ordine di IoU
+    decrescente, ogni predizione e ogni box vero vengono usati una volta sola. Le coppie devono essere già ordinate.
+
+    Returns:
+        list: per ogni soglia, (predizioni abbinate, box veri abbinati)
+    """
+    matches = []
+    for threshold in thresholds:
+        above = iou >= threshold
+        p, g = pred_index[above], gt_index[above]
+        first = np.sort(np.unique(p, return_index=True)[1])  # migliore box vero per predizione
+        p, g = p[first], g[first]
+        first = np.unique(g, return_index=True)[1]  # migliore predizione per box vero
+        matches.append((p[first], g[first]))
+    return matches
+
+
+def average_precision(tp, conf, pred_cls, gt_cls, num_classes):
+    """
+    AP per classe e per soglia IoU, con interpolazione a 101 punti di recall (come COCO).
+
+    Args:
+        tp (np.ndarray): bool (n, soglie), predizioni abbinate a ogni soglia.
+
+    Returns:
+        tuple: (ap (classi, soglie), istanze vere per classe)
+    """
+    instances = np.bincount(gt_cls, minlength=num_classes)
+    ap = np.zeros((num_classes, tp.shape[1]))
+    order = np.lexsort((-conf, pred_cls))
+    tp, pred_cls = tp[order], pred_cls[order]
+    bounds = np.searchsorted(pred_cls, np.arange(num_classes + 1))
+    recall_points = np.linspace(0, 1, 101)
+    for c in np.flatnonzero(instances):
+        class_tp = tp[bounds[c]:bounds[c + 1]]
+        if not len(class_tp):
+            continue
+        tp_cum = np.cumsum(class_tp, axis=0)
+        recall = tp_cum / instances[c]
+        precision = tp_cum / np.arange(1, len(class_tp) + 1)[:, None]
+        envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+        for k in range(tp.shape[1]):
+            index = np.searchsorted(recall[:, k], recall_points, side="left")
+            ap[c, k] = envelope[index[index < len(class_tp)], k].sum() / len(recall_points)
+    return ap, instances
+
+
+def confusion_matrix(pred, gt, pairs, keep, gt_mask, iou_threshold, num_classes):
+    """
+    Matrice di confusione (righe: classe predetta, colonne: classe vera; l'ultima riga/colonna è lo sfondo) tra le
+    predizioni in keep e i box veri in gt_mask, con abbinamento indipendente dalla classe
+    (pairs da candidate_pairs(class_aware=False)).
+    """
+    pred_index, gt_index, iou = pairs
+    selected = keep[pred_index]
+    (p, g), = greedy_match(pred_index[selected], gt_index[selected], iou[selected], [iou_threshold])
+    background = num_classes
+    size = num_classes + 1
+    matched_pred = np.zeros(len(keep), dtype=bool)
+    matched_pred[p] = True
+    matched_gt = np.zeros(len(gt["cls"]), dtype=bool)
+    matched_gt[g] = True
+    cells = np.concatenate([pred["cls"][p] * size + gt["cls"][g],
+                            pred["cls"][keep & ~matched_pred] * size + background,
+                            background * size + gt["cls"][gt_mask & ~matched_gt]])
+    return np.bincount(cells, minlength=size * size).reshape(size, size)
+
+
+def score(pred, gt, pairs, agnostic_pairs, tp, num_classes, conf=0.25, iou=0.5, pred_mask=None, gt_mask=None):
+    """
+    Metriche di un sottoinsieme (maschere su predizioni e box veri; tutto se None): AP per classe, mAP@0.5 e
+    mAP@0.5:0.95, precision/recall per classe alla confidenza conf e IoU iou, matrice di confusione.
+    Non esegue il modello né ricalcola le IoU: bastano le coppie già calcolate, quindi cambiare soglie costa poco.
+    """
+    pred_mask = np.ones(len(pred["cls"]), dtype=bool) if pred_mask is None else pred_mask
+    gt_mask = np.ones(len(gt["cls"]), dtype=bool) if gt_mask is None else gt_mask
+    ap, instances = average_precision(tp[pred_mask], pred["conf"][pred_mask], pred["cls"][pred_mask],
+                                      gt["cls"][gt_mask], num_classes)
+
+    # P/R alla soglia di confidenza: abbinamento rifatto tra le sole predizioni sopra soglia
+    keep = pred_mask & (pred["conf"] >= conf)
+    pred_index, gt_index, pair_iou = pairs
+    selected = keep[pred_index]
+    (p, _), = greedy_match(pred_index[selected], gt_index[selected], pair_iou[selected], [iou])
+    true_positives = np.bincount(pred["cls"][p], minlength=num_classes)[:num_classes]
+    predicted = np.bincount(pred["cls"][keep], minlength=num_classes)[:num_classes]
+    precision = np.divide(true_positives, predicted, out=np.zeros(num_classes), where=predicted > 0)
+    recall = np.divide(true_positives, instances, out=np.zeros(num_classes), where=instances > 0)
+
+    present = instances > 0
+    return {
+        "instances": instances,
+        "ap": ap,
+        "map50": float(ap[present, 0].mean()) if present.any() else 0.0,
+        "map": float(ap[present].mean()) if present.any() else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "mean_precision": float(precision[present].mean()) if present.any() else 0.0,
+        "mean_recall": float(recall[present].mean()) if present.any() else 0.0,
+        "confusion": confusion_matrix(pred, gt, agnostic_pairs, keep, gt_mask, iou, num_classes),
+    }
+
+
+def evaluate(model_path, img_dir, lbl_dir, imgsz=640, batch=16, conf=0.25, iou=0.5, by_source=True):
+    """
+    Valuta il modello su uno split: predizioni (dalla cache se possibile), coppie e abbinamenti calcolati una volta,
+    poi le metriche per tutto lo split e per ogni sorgente (gtsrb, lisa, veri, person).
+
+    Returns:
+        dict: {"class_names", "predicted", "seconds", "all": metriche, "sources": {sorgente: metriche}}
+    """
+    start_time = time.perf_counter()
+    images = list_images(img_dir)
+    pred, predicted = predict(model_path, img_dir, images, imgsz, batch)
+    store = LabelStore.open(lbl_dir)
+    try:
+        gt = ground_truth(store, pred["names"])
+    finally:
+        store.close()
+
+    class_names = pred["class_names"]
+    num_classes = int(max(len(class_names), pred["cls"].max(initial=-1) + 1, gt["cls"].max(initial=-1) + 1))
+    pairs = candidate_pairs(pred, gt)
+    agnostic_pairs = candidate_pairs(pred, gt, class_aware=False)
+    tp = np.zeros((len(pred["cls"]), len(IOU_THRESHOLDS)), dtype=bool)
+    for k, (p, _) in enumerate(greedy_match(*pairs, IOU_THRESHOLDS)):
+        tp[p, k] = True
+
+    report = {"class_names": class_names, "predicted": predicted, "images": len(pred["names"]),
+              "all": score(pred, gt, pairs, agnostic_pairs, tp, num_classes, conf, iou)}
+    report["all"]["images"] = len(pred["names"])
+    if by_source:
+        sources = image_sources(pred["names"])
+        report["sources"] = {}
+        for s, source in enumerate(SOURCES + ("altro",)):
+            in_source = sources == s
+            if not in_source.any():
+                continue
+            metrics = score(pred, gt, pairs, agnostic_pairs, tp, num_classes, conf, iou,
+                            in_source[pred["image"]], in_source[gt["image"]])
+            metrics["images"] = int(in_source.sum())
+            report["sources"][source] = metrics
+    report["seconds"] = time.perf_counter() - start_time
+    return report
+
+
+def _to_json(metrics, class_names):
+    present = np.flatnonzero(metrics["instances"])
+    return {
+        "images": metrics["images"],
+        "map50": metrics["map50"],
+        "map50_95": metrics["map"],
+        "precision": metrics["mean_precision"],
+        "recall": metrics["mean_recall"],
+        "classes": {class_names.get(int(c), str(c)): {
+            "instances": int(metrics["instances"][c]), "ap50": float(metrics["ap"][c, 0]),
+            "ap50_95": float(metrics["ap"][c].mean()), "precision": float(metrics["precision"][c]),
+            "recall": float(metrics["recall"][c])} for c in present},
+        "confusion": metrics["confusion"].tolist(),
+    }
+
+
+def print_report(report):
+    class_names = report["class_names"]
+    metrics = report["all"]
+    print(f"{'classe':<30} {'istanze':>8} {'P':>6} {'R':>6} {'AP50':>6} {'AP50-95':>8}")
+    for c in np.flatnonzero(metrics["instances"]):
+        print(f"{class_names.get(int(c), str(c)):<30} {metrics['instances'][c]:>8} {metrics['precision'][c]:>6.3f} "
+              f"{metrics['recall'][c]:>6.3f} {metrics['ap'][c, 0]:>6.3f} {metrics['ap'][c].mean():>8.3f}")
+    rows = [("tutte", metrics)] + list(report.get("sources", {}).items())
+    print()
+    for name, m in rows:
+        print(f"{name:<30} {m['images']:>8} immagini  P {m['mean_precision']:.3f}  R {m['mean_recall']:.3f}  "
+              f"mAP50 {m['map50']:.3f}  mAP50-95 {m['map']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valuta un modello YOLO su uno split del dataset combinato (mAP, P/R, matrice di confusione).")
+    parser.add_argument("--model", required=True, help="Modello YOLO addestrato sul dataset combinato")
+    parser.add_argument("--split", default="val", help="Split del dataset combinato (default: val)")
+    parser.add_argument("--imgsz", type=int, default=640, help="Dimensione di input del modello (default: 640)")
+    parser.add_argument("--batch", type=int, default=16, help="Immagini per chiamata al modello (default: 16)")
+    parser.add_argument("--conf", type=float, default=0.25, help="Soglia di confidenza per P/R e matrice di confusione (default: 0.25)")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU minima per P/R e matrice di confusione (default: 0.5)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il report in questo file JSON")
+    parser.add_argument("--confusion-csv", default=None, help="Salva la matrice di confusione (tutto lo split) in CSV")
+    args = parser.parse_args()
+
+    report = evaluate(args.model, f"combined_dataset/images/{args.split}", f"combined_dataset/labels/{args.split}",
+                      args.imgsz, args.batch, args.conf, args.iou)
+    print_report(report)
+    print(f"\n{report['images']} immagini ({report['predicted']} elaborate dal modello, le altre dalla cache) "
+          f"in {report['seconds']:.2f}s")
+
+    class_names = report["class_names"]
+    if args.confusion_csv:
+        matrix = report["all"]["confusion"]
+        labels = [class_names.get(c, str(c)) for c in range(len(matrix) - 1)] + ["sfondo"]
+        with open(args.confusion_csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["predetta \\ vera"] + labels)
+            for label, row in zip(labels, matrix.tolist()):
+                writer.writerow([label] + row)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"model": args.model, "split": args.split, "conf": args.conf, "iou": args.iou,
+                       "all": _to_json(report["all"], class_names),
+                       "sources": {s: _to_json(m, class_names) for s, m in report.get("sources", {}).items()}},
+                      f, indent=2)
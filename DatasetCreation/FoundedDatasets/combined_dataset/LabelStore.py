@@ -0,0 +1,364 @@
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Le scritture atomiche sono in DatasetIO, nella cartella superiore (FoundedDatasets): gli script di questa cartella
+# si lanciano da qui, quindi la si aggiunge ai percorsi di import.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DatasetIO import atomic_open, atomic_write_text  # noqa: E402
+
+# Formato del file .ylbl (uno per split, es. combined_dataset/labels/train.ylbl):
+#   8 byte di magic, 8 byte con la lunghezza dell'header, header JSON (colonne: dtype, shape, offset),
+#   poi le colonne una dopo l'altra, allineate a 64 byte, lette con np.memmap senza copie.
+# Colonne:
+#   offsets (n+1) int64   i box dell'immagine i sono le righe offsets[i]:offsets[i+1]
+#   cls     (m)   int32   classe di ogni box
+#   xywh    (m,4) float64 box YOLO normalizzati (x_center, y_center, w, h), letti con float() dal testo
+#   mtime_ns, size (n) int64  firma del file .txt da cui viene ogni immagine (per la sincronizzazione)
+#   names   blob UTF-8    nomi dei file di label senza .txt, separati da "\n", in ordine alfabetico
+MAGIC = b"YLBL\x01\x00\x00\x00"
+STORE_VERSION = 1
+_ALIGN = 64
+
+# Formato delle righe scritte da export (lo stesso delle label prodotte da CombineDatasets)
+LABEL_LINE = "%d %.6f %.6f %.6f %.6f"
+
+
+def store_path_for(labels_dir):
+    """Percorso dello store accanto alla cartella delle label (es. labels/train -> labels/train.ylbl)."""
+    return os.path.normpath(labels_dir) + ".ylbl"
+
+
+def parse_label_text(text):
+    """
+    Legge il contenuto di un file di label YOLO.
+
+    Le righe vuote vengono ignorate; di ogni riga si usano i primi 5 campi (classe, x, y, w, h),
+    così le label con poligoni di segmentazione non rompono la lettura.
+
+    Returns:
+        tuple: (cls int32 (n,), xywh float64 (n, 4))
+    """
+    tokens = text.split()
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(tokens) != 5 * len(lines):
+        tokens = [token for line in lines for token in line.split()[:5]]
+    values = np.array(tokens, dtype=np.float64).reshape(-1, 5)
+    return values[:, 0].astype(np.int32), values[:, 1:]
+
+
+def parse_label_texts(texts):
+    """
+    Come parse_label_text, per molti file insieme: i token di tutti i file vengono convertiti con un solo np.array.
+    I file con righe vuote o campi in più passano dalla lettura riga per riga.
+
+    Returns:
+        tuple: (box per file int64 (k,), cls int32 (n,), xywh float64 (n, 4))
+    """
+    counts, tokens, slow = [], [], {}
+    for i, text in enumerate(texts):
+        file_tokens = text.split()
+        lines = text.count("\n") + (bool(text) and not text.endswith("\n"))
+        if len(file_tokens) == 5 * lines:
+            counts.append(lines)
+            tokens.append(file_tokens)
+        else:
+            slow[i] = parse_label_text(text)
+            counts.append(len(slow[i][0]))
+            tokens.append(None)
+    values = np.array([t for file_tokens in tokens if file_tokens for t in file_tokens], dtype=np.float64).reshape(-1, 5)
+    cls, xywh = values[:, 0].astype(np.int32), values[:, 1:]
+    if slow:
+        parts, start = [], 0
+        for i, file_tokens in enumerate(tokens):
+            if file_tokens is None:
+                parts.append(slow[i])
+            else:
+                parts.append((cls[start:start + counts[i]], xywh[start:start + counts[i]]))
+                start += counts[i]
+        cls = np.concatenate([p[0] for p in parts]) if parts else cls
+        xywh = np.concatenate([p[1] for p in parts]).reshape(-1, 4) if parts else xywh
+    return np.array(counts, dtype=np.int64), cls, xywh
+
+
+def read_label_file(path):
+    """Legge un singolo file di label YOLO: (cls, xywh) come in parse_label_text."""
+    with open(path, "r") as f:
+        return parse_label_text(f.read())
+
+
+def _scan(labels_dir):
+    """File .txt della cartella: {nome senza .txt: (mtime_ns, size)}."""
+    entries = {}
+    with os.scandir(labels_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".txt") and entry.is_file():
+                st = entry.stat()
+                entries[entry.name[:-4]] = (st.st_mtime_ns, st.st_size)
+    return entries
+
+
+def _read_texts(paths):
+    texts = []
+    for path in paths:
+        with open(path, "r") as f:
+            texts.append(f.read())
+    return texts
+
+
+def _ranges(starts, counts):
+    """Concatenazione vettoriale di arange(start, start + count) per ogni coppia."""
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _write_store(path, columns):
+    """Scrive le colonne nel formato .ylbl, in modo atomico (file temporaneo + rename)."""
+    header = {"version": STORE_VERSION, "columns": {}}
+    offset = 0
+    for name, array in columns.items():
+        header["columns"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // _ALIGN) * _ALIGN
+
+    with atomic_open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for name, array in columns.items():
+            f.seek(data_start + header["columns"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+
+
+class LabelStore:
+    """
+    Label di uno split in un unico file colonnare mappato in memoria.
+
+    Invece di aprire un .txt per immagine, gli script leggono array NumPy: tutto lo split (cls, xywh, offsets)
+    oppure le righe di una singola immagine (labels). L'apertura non legge i dati: le pagine vengono caricate
+    dal sistema operativo solo quando servono.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} non è un label store")
+            header_len = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_len))
+        if header.get("version") != STORE_VERSION:
+            raise ValueError(f"Versione dello store non supportata: {header.get('version')}")
+        data_start = -(-(len(MAGIC) + 8 + header_len) // _ALIGN) * _ALIGN
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        for name, column in header["columns"].items():
+            dtype = np.dtype(column["dtype"])
+            start = data_start + column["offset"]
+            count = int(np.prod(column["shape"]))
+            array = self._buffer[start:start + count * dtype.itemsize].view(dtype).reshape(column["shape"])
+            setattr(self, name, array)
+        self._names = None
+        self._index = None
+        self._box_image = None
+
+    @classmethod
+    def open(cls, labels_dir, store_path=None, sync_first=True, verbose=True):
+        """
+        Apre lo store di una cartella di label, sincronizzandolo prima con i .txt (solo i file cambiati vengono riletti).
+        """
+        store_path = store_path or store_path_for(labels_dir)
+        if sync_first:
+            stats = sync(labels_dir, store_path)
+            if verbose and (stats["parsed"] or stats["removed"]):
+                print(f"Label store aggiornato: {stats['parsed']} file riletti, {stats['removed']} rimossi, "
+                      f"{stats['reused']} invariati ({stats['seconds']:.2f}s)")
+        return cls(store_path)
+
+    def close(self):
+        """Rilascia la mappatura del file (necessario su Windows prima di sostituirlo)."""
+        for name in ("offsets", "cls", "xywh", "mtime_ns", "size", "names_blob"):
+            self.__dict__.pop(name, None)
+        self._buffer = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def names(self):
+        """Nomi delle immagini (file di label senza .txt), nell'ordine dello store."""
+        if self._names is None:
+            self._names = bytes(self.names_blob).decode("utf-8").split("\n") if len(self) else []
+        return self._names
+
+    def index(self, name):
+        """Posizione dell'immagine con il nome dato (KeyError se non c'è)."""
+        if self._index is None:
+            self._index = {n: i for i, n in enumerate(self.names)}
+        return self._index[name]
+
+    @property
+    def counts(self):
+        """Numero di box per immagine."""
+        return np.diff(self.offsets)
+
+    @property
+    def box_image(self):
+        """Indice dell'immagine di ogni box."""
+        if self._box_image is None:
+            self._box_image = np.repeat(np.arange(len(self), dtype=np.int64), self.counts)
+        return self._box_image
+
+    def labels(self, image):
+        """(cls, xywh) di un'immagine, dato l'indice o il nome. Sono viste sullo store, senza copie."""
+        i = self.index(image) if isinstance(image, str) else image
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.cls[start:end], self.xywh[start:end]
+
+    def images_with_classes(self, classes):
+        """Indici (ordinati) delle immagini con almeno un box di una delle classi date."""
+        return np.unique(self.box_image[np.isin(self.cls, np.asarray(list(classes), dtype=np.int32))])
+
+
+def pack(labels_dir, store_path=None, workers=8):
+    """Ricostruisce da zero lo store di una cartella di label (vedi sync)."""
+    store_path = store_path or store_path_for(labels_dir)
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    return sync(labels_dir, store_path, workers)
+
+
+def sync(labels_dir, store_path=None, workers=8):
+    """
+    Allinea lo store ai file .txt di labels_dir (import .txt -> store).
+
+    Vengono riletti solo i file nuovi o con mtime/dimensione cambiati (su un pool di thread, trattandosi di
+    tanti file piccoli); le righe delle immagini invariate vengono riprese dallo store esistente con un'unica
+    gather vettoriale. Se non è cambiato nulla il file non viene riscritto.
+
+    Returns:
+        dict: {"images", "boxes", "parsed", "reused", "removed", "seconds"}
+    """
+    start_time = time.perf_counter()
+    store_path = store_path or store_path_for(labels_dir)
+    entries = _scan(labels_dir)
+    names = sorted(entries)
+
+    old = None
+    if os.path.exists(store_path):
+        try:
+            old = LabelStore(store_path)
+        except (ValueError, OSError, KeyError):
+            old = None  # store illeggibile o di un'altra versione: si ricostruisce
+
+    signatures = np.array([entries[n] for n in names], dtype=np.int64).reshape(-1, 2)
+    old_pos = np.full(len(names), -1, dtype=np.int64)
+    if old is not None and len(old):
+        old_index = {n: i for i, n in enumerate(old.names)}
+        old_pos = np.array([old_index.get(n, -1) for n in names], dtype=np.int64)
+        found = old_pos >= 0
+        same = np.zeros(len(names), dtype=bool)
+        same[found] = ((old.mtime_ns[old_pos[found]] == signatures[found, 0])
+                       & (old.size[old_pos[found]] == signatures[found, 1]))
+        old_pos[~same] = -1
+    reused = old_pos >= 0
+    removed = sum(1 for n in old.names if n not in entries) if old is not None else 0
+    to_parse = [names[i] for i in np.flatnonzero(~reused)]
+
+    stats = {"images": len(names), "parsed": len(to_parse), "reused": int(reused.sum()), "removed": removed}
+    if old is not None and not to_parse and not removed:
+        stats["boxes"] = len(old.cls)
+        stats["seconds"] = time.perf_counter() - start_time
+        old.close()
+        return stats
+
+    # Lettura a blocchi su un pool di thread (tanti file piccoli: conta la latenza di open/read, non la CPU)
+    paths = [os.path.join(labels_dir, n + ".txt") for n in to_parse]
+    chunks = [paths[i:i + 256] for i in range(0, len(paths), 256)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        texts = [text for chunk in pool.map(_read_texts, chunks) for text in chunk]
+    new_counts, new_cls, new_xywh = parse_label_texts(texts)
+
+    # Sorgenti delle righe: prima lo store esistente, poi i file appena letti
+    old_rows = len(old.cls) if old is not None else 0
+    counts = np.zeros(len(names), dtype=np.int64)
+    starts = np.zeros(len(names), dtype=np.int64)
+    if reused.any():
+        counts[reused] = old.offsets[old_pos[reused] + 1] - old.offsets[old_pos[reused]]
+        starts[reused] = old.offsets[old_pos[reused]]
+    counts[~reused] = new_counts
+    starts[~reused] = old_rows + np.cumsum(new_counts) - new_counts
+
+    rows = _ranges(starts, counts)
+    all_cls = np.concatenate([old.cls, new_cls]) if old is not None else new_cls
+    all_xywh = np.concatenate([old.xywh, new_xywh]) if old is not None else new_xywh
+
+    columns = {
+        "offsets": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+        "cls": all_cls[rows].astype(np.int32),
+        "xywh": all_xywh[rows].reshape(-1, 4).astype(np.float64),
+        "mtime_ns": signatures[:, 0].copy(),
+        "size": signatures[:, 1].copy(),
+        "names_blob": np.frombuffer("\n".join(names).encode("utf-8"), dtype=np.uint8),
+    }
+    if old is not None:
+        old.close()
+    _write_store(store_path, columns)
+    stats["boxes"] = len(columns["cls"])
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def export(labels_dir, store_path=None, names=None):
+    """
+    Scrive i file .txt dallo store (export store -> .txt), con righe nel formato LABEL_LINE, e riallinea lo store.
+
+    Args:
+        labels_dir (str): Cartella di destinazione.
+        store_path (str): Store da esportare (default: quello di labels_dir).
+        names (iterable): Solo queste immagini (default: tutte).
+
+    Returns:
+        int: Numero di file scritti.
+    """
+    store_path = store_path or store_path_for(labels_dir)
+    store = LabelStore(store_path)
+    os.makedirs(labels_dir, exist_ok=True)
+    indices = range(len(store)) if names is None else [store.index(n) for n in names]
+    written = 0
+    for i in indices:
+        cls, xywh = store.labels(i)
+        rows = np.column_stack((cls, xywh))
+        text = "".join(LABEL_LINE % tuple(row) + "\n" for row in rows.tolist())
+        path = os.path.join(labels_dir, store.names[i] + ".txt")
+        atomic_write_text(path, text)
+        written += 1
+    store.close()
+    if os.path.normpath(store_path) == os.path.normpath(store_path_for(labels_dir)):
+        sync(labels_dir, store_path)
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sincronizza il label store colonnare (.ylbl) con le label .txt.")
+    parser.add_argument("labels_dirs", nargs="*", default=["combined_dataset/labels/train", "combined_dataset/labels/val"],
+                        help="Cartelle di label da impacchettare (default: train e val del dataset combinato)")
+    parser.add_argument("--rebuild", action="store_true", help="Ricostruisce lo store da zero invece di aggiornarlo")
+    parser.add_argument("--export", action="store_true", help="Direzione inversa: riscrive i .txt a partire dallo store")
+    args = parser.parse_args()
+
+    for labels_dir in args.labels_dirs:
+        if args.export:
+            print(f"{labels_dir}: esportati {export(labels_dir)} file di label")
+            continue
+        if not os.path.isdir(labels_dir):
+            print(f"⚠️ Cartella non trovata: {labels_dir}")
+            continue
+        stats = (pack if args.rebuild else sync)(labels_dir)
+        print(f"{labels_dir}: {stats['images']} immagini, {stats['boxes']} box "
+              f"({stats['parsed']} file letti, {stats['reused']} invariati, {stats['removed']} rimossi) in {stats['seconds']:.2f}s")
@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from LabelStore import LabelStore, sync
+from BuildManifest import exclude_samples  # raggiungibile grazie a LabelStore (cartella superiore)
+
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg", ".bmp", ".tif")
+
+
+def list_images(img_dir):
+    """Una sola scansione della cartella immagini: {nome senza estensione: nome del file}."""
+    images = {}
+    with os.scandir(img_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                images[stem] = entry.name
+    return images
+
+
+def image_class_pairs(store):
+    """
+    Matrice sparsa immagini x classi in formato CSR: per ogni immagine le classi presenti e il numero di box.
+
+    Returns:
+        tuple: (indptr, pair_class, pair_count) con le coppie dell'immagine i in indptr[i]:indptr[i + 1]
+    """
+    cls = np.asarray(store.cls, dtype=np.int64)
+    num_classes = int(cls.max()) + 1 if len(cls) else 1
+    codes, pair_count = np.unique(store.box_image * num_classes + cls, return_counts=True)
+    pair_image, pair_class = codes // num_classes, codes % num_classes
+    indptr = np.searchsorted(pair_image, np.arange(len(store) + 1))
+    return indptr, pair_class, pair_count
+
+
+def _tie_break(name):
+    """Ordine pseudo-casuale ma riproducibile tra immagini con lo stesso punteggio (sparpaglia i frame di una sequenza)."""
+    return int.from_bytes(hashlib.md5(name.encode("utf-8")).digest()[:8], "little")
+
+
+def select_removals(store, quotas, only=None):
+    """
+    Sceglie le immagini da eliminare perché ogni classe con quota scenda al più alla sua quota di istanze.
+
+    Un'immagine è eliminabile solo se contiene esclusivamente classi con quota e se eliminarla non porta nessuna
+    di queste classi sotto la quota: le classi senza quota non perdono mai istanze. Tra le eliminabili si sceglie
+    (greedy, con rivalutazione pigra) quella che rimuove più istanze in eccesso.
+
+    Args:
+        store (LabelStore): Label dello split.
+        quotas (dict): {classe: massimo di istanze da tenere}.
+        only (str): (opzionale) regex sui nomi: solo le immagini che la soddisfano possono essere eliminate.
+
+    Returns:
+        dict: {"remove": indici delle immagini, "before", "after"} (istanze per classe)
+    """
+    indptr, pair_class, pair_count = image_class_pairs(store)
+    num_classes = max(int(pair_class.max(initial=-1)) + 1, max(quotas, default=-1) + 1)
+    before = np.bincount(pair_class, weights=pair_count, minlength=num_classes).astype(np.int64)
+    quota = np.full(num_classes, -1, dtype=np.int64)  # -1: classe protetta
+    for c, n in quotas.items():
+        quota[c] = n
+    excess = np.where(quota >= 0, np.maximum(before - quota, 0), 0)
+
+    # Candidate (vettoriale): niente classi protette, almeno una classe in eccesso, nome accettato da --only
+    pair_image = np.repeat(np.arange(len(store)), np.diff(indptr))
+    blocked = np.zeros(len(store), dtype=bool)
+    blocked[pair_image[quota[pair_class] < 0]] = True
+    useful = np.bincount(pair_image, weights=np.minimum(pair_count, excess[pair_class]), minlength=len(store))
+    candidates = np.flatnonzero(~blocked & (useful > 0) & (np.diff(indptr) > 0))
+    names = store.names
+    if only:
+        pattern = re.compile(only)
+        candidates = [i for i in candidates.tolist() if pattern.search(names[i])]
+
+    def score(i):
+        classes, counts = pair_class[indptr[i]:indptr[i + 1]], pair_count[indptr[i]:indptr[i + 1]]
+        if (counts > excess[classes]).any():
+            return 0  # andrebbe sotto la quota di qualche classe
+        return int(counts.sum())
+
+    heap = [(-int(useful[i]), _tie_break(names[i]), i) for i in candidates]
+    heapq.heapify(heap)
+    remove = []
+    while heap and excess.any():
+        _, tie, i = heapq.heappop(heap)
+        s = score(i)
+        if s <= 0:
+            continue
+        if heap and -heap[0][0] > s:
+            heapq.heappush(heap, (-s, tie, i))
+            continue
+        remove.append(i)
+        excess[pair_class[indptr[i]:indptr[i + 1]]] -= pair_count[indptr[i]:indptr[i + 1]]
+
+    after = before.copy()
+    for i in remove:
+        after[pair_class[indptr[i]:indptr[i + 1]]] -= pair_count[indptr[i]:indptr[i + 1]]
+    return {"remove": sorted(remove), "before": before, "after": after}
+
+
+def remove_sample(paths):
+    """Elimina immagine e label di un campione; restituisce (byte liberati, errore)."""
+    freed = 0
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except OSError as e:
+            return freed, f"Errore nel cancellare {path}: {e}"
+    return freed, None
+
+
+def remove_samples(pairs, img_dir, reason, workers=8):
+    """
+    Elimina i campioni (coppie immagine, label) su un pool di thread e li segna come esclusi nel manifest di build
+    del dataset, così CombineDatasets e gli script Add* non li ricreano alla rebuild successiva.
+
+    Returns:
+        tuple: (byte liberati, errori, campioni segnati nel manifest).
+    """
+    freed_total, errors, removed = 0, [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (image, _), (freed, error) in zip(pairs, pool.map(remove_sample, pairs, chunksize=256)):
+            freed_total += freed
+            if error:
+                errors.append(error)
+            elif image is not None:
+                removed.append(image)
+    excluded = 0
+    if removed:
+        # <dataset>/images/<split> -> manifest <dataset>.manifest.json
+        excluded = exclude_samples(os.path.dirname(os.path.dirname(os.path.abspath(img_dir))), removed, reason)
+    return freed_total, errors, excluded
+
+
+def undersample(img_dir, lbl_dir, quotas, only=None, dry_run=False, remove_orphans=False, workers=8):
+    """
+    Undersampling di uno split: una scansione delle immagini, label dal label store, quote per classe.
+    Immagine e label di ogni campione scelto vengono eliminate insieme (prima l'immagine, così un'interruzione
+    lascia al più una label senza immagine, che viene segnalata e rimossa da remove_orphans).
+
+    Returns:
+        dict: {"remove", "before", "after", "orphan_images", "orphan_labels", "bytes", "excluded" (campioni segnati
+               come esclusi nel manifest di build), "errors", "seconds"}
+    """
+    start_time = time.perf_counter()
+    images = list_images(img_dir)
+    store = LabelStore.open(lbl_dir)
+    names = store.names
+    selection = select_removals(store, quotas, only)
+    label_names = set(names)
+    store.close()
+
+    orphan_images = sorted(stem for stem in images if stem not in label_names)
+    orphan_labels = sorted(name for name in label_names if name not in images)
+    pairs = [(os.path.join(img_dir, images[names[i]]) if names[i] in images else None,
+              os.path.join(lbl_dir, names[i] + ".txt")) for i in selection["remove"]]
+    if remove_orphans:
+        pairs += [(os.path.join(img_dir, images[stem]), None) for stem in orphan_images]
+        pairs += [(None, os.path.join(lbl_dir, name + ".txt")) for name in orphan_labels]
+
+    stats = dict(selection, remove=[names[i] for i in selection["remove"]], orphan_images=orphan_images,
+                 orphan_labels=orphan_labels, bytes=0, excluded=0, errors=[])
+    if dry_run:
+        # Dimensioni lette solo per i file scelti, senza eliminarli
+        stats["bytes"] = sum(os.path.getsize(p) for pair in pairs for p in pair if p is not None and os.path.exists(p))
+    else:
+        stats["bytes"], stats["errors"], stats["excluded"] = remove_samples(pairs, img_dir, "undersampling", workers)
+        sync(lbl_dir)
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def parse_quotas(quotas_path=None, max_instances=None, classes=None):
+    """Quote per classe: un file JSON {classe: massimo} e/o un massimo unico (--max) per le classi indicate."""
+    quotas = {}
+    if quotas_path:
+        with open(quotas_path, "r") as f:
+            quotas.update({int(c): int(n) for c, n in json.load(f).items()})
+    if max_instances is not None:
+        for c in classes or []:
+            quotas[int(c)] = max_instances
+    return quotas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Undersampling per classe del dataset combinato (sostituisce gli script Undersampling_*).")
+    parser.add_argument("--split", default="train", help="Split del dataset combinato (default: train)")
+    parser.add_argument("--quotas", default=None, help="File JSON {classe: massimo di istanze da tenere}")
+    parser.add_argument("--max", dest="max_instances", type=int, default=None, help="Massimo di istanze per le classi di --classes")
+    parser.add_argument("--classes", type=int, nargs="*", default=None, help="Classi a cui applicare --max")
+    parser.add_argument("--only", default=None, help="Regex: elimina solo immagini con nome corrispondente (es. '^dayClip6--')")
+    parser.add_argument("--remove-orphans", action="store_true", help="Elimina anche immagini senza label e label senza immagine")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra cosa verrebbe eliminato senza eliminare nulla")
+    parser.add_argument("--workers", type=int, default=8, help="Thread per le cancellazioni (default: 8)")
+    args = parser.parse_args()
+
+    quotas = parse_quotas(args.quotas, args.max_instances, args.classes)
+    if not quotas and not args.remove_orphans:
+        parser.error("indica almeno una quota (--quotas oppure --max con --classes)")
+
+    stats = undersample(f"combined_dataset/images/{args.split}", f"combined_dataset/labels/{args.split}", quotas,
+                        args.only, args.dry_run, args.remove_orphans, args.workers)
+
+    verb = "Da eliminare" if args.dry_run else "Eliminati"
+    print(f"\n{verb}: {len(stats['remove'])} campioni (immagine + label), {stats['bytes'] / (1024 * 1024):.1f} MB")
+    for c in sorted(quotas):
+        status = "✅" if stats["after"][c] <= quotas[c] else "⚠️"
+        print(f"{status} Classe {c}: {stats['before'][c]} -> {stats['after'][c]} istanze (quota {quotas[c]})")
+    if stats["orphan_images"] or stats["orphan_labels"]:
+        print(f"Orfani: {len(stats['orphan_images'])} immagini senza label, {len(stats['orphan_labels'])} label senza immagine"
+              f"{' (eliminati)' if args.remove_orphans and not args.dry_run else ''}")
+    if stats["excluded"]:
+        print(f"Manifest di build: {stats['excluded']} campioni segnati come esclusi (CombineDatasets non li ricrea)")
+    for error in stats["errors"]:
+        print(error)
+    print(f"Completato in {stats['seconds']:.2f}s")
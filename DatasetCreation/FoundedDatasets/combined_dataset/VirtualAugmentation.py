@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from AugmentationEngine import RECIPES, augment, print_report, run_chain, select_images, transform_boxes, variant_rng
+from LabelStore import LabelStore
+from DatasetIO import atomic_write_text  # raggiungibile grazie a LabelStore (cartella superiore)
+
+
+def manifest_path_for(labels_dir):
+    """Manifest delle varianti virtuali di una cartella di label (es. labels/train -> labels/train.augment.jsonl)."""
+    return labels_dir.rstrip("/\\") + ".augment.jsonl"
+
+
+def make_entries(images, seed=0):
+    """Voci del manifest: una per (immagine sorgente, variante), con la catena di operazioni e il seed."""
+    return [{"source": name, "suffix": variant["suffix"], "ops": variant["ops"], "seed": seed}
+            for name, image_variants in images for variant in image_variants]
+
+
+def write_manifest(path, entries, append=False):
+    """Scrive (o accoda) le voci del manifest, una per riga JSON; le voci già presenti con lo stesso nome vengono sostituite."""
+    existing = read_manifest(path) if append and os.path.exists(path) else []
+    by_name = OrderedDict((entry["source"] + entry["suffix"], entry) for entry in existing + entries)
+    atomic_write_text(path, "".join(json.dumps(entry) + "\n" for entry in by_name.values()))
+    return len(by_name)
+
+
+def read_manifest(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class VirtualDataset:
+    """
+    Split del dataset con le varianti aumentate calcolate al volo invece di essere scritte su disco.
+
+    Gli elementi sono prima le immagini reali dello split, poi le voci del manifest. Una voce viene espansa
+    decodificando la sorgente e applicando la sua catena di operazioni con lo stesso generatore casuale del motore
+    di augmentation. Le label sono identiche a quelle del file che verrebbe materializzato; i pixel no, perché
+    materialize salva le varianti in JPEG (con perdita) mentre qui si restituisce l'array prima della codifica.
+    Le ultime sorgenti decodificate restano in una piccola cache: le voci della stessa immagine sono consecutive
+    nel manifest, quindi ogni sorgente viene decodificata una volta sola anche per 7 varianti.
+    """
+
+    def __init__(self, img_dir, lbl_dir, manifest_path=None, image_ext=".jpg", include_real=True, cache_size=4):
+        self.img_dir = img_dir
+        self.image_ext = image_ext
+        self.store = LabelStore.open(lbl_dir)
+        manifest_path = manifest_path or manifest_path_for(lbl_dir)
+        entries = read_manifest(manifest_path) if os.path.exists(manifest_path) else []
+        # Le varianti già materializzate sono tra le immagini reali: non vanno contate due volte
+        real_names = set(self.store.names)
+        self.entries = [entry for entry in entries if entry["source"] + entry["suffix"] not in real_names]
+        self.real = list(range(len(self.store))) if include_real else []
+        self.cache_size = cache_size
+        self._decoded = OrderedDict()
+
+    def __len__(self):
+        return len(self.real) + len(self.entries)
+
+    def _source(self, name):
+        """Decodifica (con cache LRU) dell'immagine sorgente: (immagine, cache dei risultati intermedi)."""
+        if name in self._decoded:
+            self._decoded.move_to_end(name)
+            return self._decoded[name]
+        image = cv2.imread(os.path.join(self.img_dir, name + self.image_ext))
+        if image is None:
+            raise FileNotFoundError(f"Errore nel leggere: {os.path.join(self.img_dir, name + self.image_ext)}")
+        self._decoded[name] = (image, {})
+        if len(self._decoded) > self.cache_size:
+            self._decoded.popitem(last=False)
+        return self._decoded[name]
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            dict: {"name": nome dell'immagine (con suffisso se virtuale), "image": array BGR,
+                   "cls": array int32, "xywh": array float64 (n, 4)}
+
+        L'immagine restituita è sempre una copia: sorgenti e risultati intermedi restano nella cache LRU e sono
+        condivisi tra le varianti, quindi una trasformazione in place del chiamante non deve poterli modificare.
+        """
+        if i < len(self.real):
+            name = self.store.names[self.real[i]]
+            cls, xywh = self.store.labels(self.real[i])
+            image, _ = self._source(name)
+            return {"name": name, "image": image.copy(), "cls": np.array(cls), "xywh": np.array(xywh)}
+
+        entry = self.entries[i - len(self.real)]
+        cls, xywh = self.store.labels(entry["source"])
+        image, cache = self._source(entry["source"])
+        rng = variant_rng(entry["seed"], entry["source"], entry["suffix"])
+        return {
+            "name": entry["source"] + entry["suffix"],
+            "image": run_chain(image, entry["ops"], rng, cache).copy(),
+            "cls": np.array(cls),
+            "xywh": np.array(transform_boxes(xywh.tolist(), entry["ops"]), dtype=np.float64).reshape(-1, 4),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.store.close()
+
+
+def materialize(img_dir, lbl_dir, manifest_path=None, workers=None):
+    """
+    Scrive su disco le varianti del manifest (per gli strumenti che vogliono file reali, es. il training YOLO),
+    con il motore di augmentation: stesse label del caricamento virtuale, pixel uguali a meno della codifica JPEG.
+    """
+    entries = read_manifest(manifest_path or manifest_path_for(lbl_dir))
+    existing = set(os.listdir(img_dir))
+    by_seed = OrderedDict()
+    for entry in entries:
+        if entry["source"] + entry["suffix"] + ".jpg" in existing:
+            continue
+        images = by_seed.setdefault(entry["seed"], OrderedDict())
+        images.setdefault(entry["source"], []).append({"suffix": entry["suffix"], "ops": entry["ops"]})
+
+    stats = {"images": 0, "variants": 0, "bytes": 0, "errors": [], "seconds": 0.0}
+    for seed, images in by_seed.items():
+        result = augment(img_dir, lbl_dir, None, None, workers=workers, seed=seed, images=list(images.items()))
+        for key in stats:
+            stats[key] += result[key]
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Augmentation virtuale: manifest di varianti calcolate al volo, materializzabili su richiesta.")
+    parser.add_argument("--split", default="train", help="Split del dataset combinato (default: train)")
+    parser.add_argument("--create", action="store_true", help="Aggiunge al manifest le varianti della ricetta per le classi indicate")
+    parser.add_argument("--from-plan", default=None, help="Aggiunge al manifest un piano salvato da AugmentationPlanner.py --plan-out")
+    parser.add_argument("--classes", type=int, nargs="*", default=[0], help="Classi rare per --create (default: 0)")
+    parser.add_argument("--recipe", default="rare_train", choices=sorted(RECIPES), help="Ricetta (default: rare_train)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed delle operazioni casuali")
+    parser.add_argument("--materialize", action="store_true", help="Scrive su disco le varianti del manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Processi per --materialize (default: numero di CPU)")
+    args = parser.parse_args()
+
+    img_dir = f"combined_dataset/images/{args.split}"
+    lbl_dir = f"combined_dataset/labels/{args.split}"
+    manifest_path = manifest_path_for(lbl_dir)
+    variants = RECIPES[args.recipe]
+
+    if args.create or args.from_plan:
+        store = LabelStore.open(lbl_dir)
+        if args.from_plan:
+            by_suffix = {variant["suffix"]: variant for variant in variants}
+            with open(args.from_plan, "r") as f:
+                names = [(name, [by_suffix[s] for s in suffixes]) for name, suffixes in json.load(f)]
+        else:
+            names = [(store.names[i], variants) for i in select_images(store, args.classes)]
+        store.close()
+        total = write_manifest(manifest_path, make_entries(names, args.seed), append=True)
+        print(f"Manifest {manifest_path}: {total} varianti virtuali")
+
+    if args.materialize:
+        print_report(materialize(img_dir, lbl_dir, manifest_path, args.workers))
+    elif not (args.create or args.from_plan):
+        dataset = VirtualDataset(img_dir, lbl_dir, manifest_path)
+        print(f"{len(dataset.real)} immagini reali + {len(dataset.entries)} varianti virtuali = {len(dataset)} elementi")
+        dataset.close()
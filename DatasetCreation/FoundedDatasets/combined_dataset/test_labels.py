@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from EvaluateModel import average_precision
+from LabelStore import LabelStore, export, pack
+
+
+def test_pack_export_round_trip(tmp_path):
+    labels = {
+        "a": "0 0.500000 0.500000 0.200000 0.100000\n3 0.125000 0.750000 0.050000 0.062500\n",
+        "b": "",
+        "c": "7 0.999999 0.000001 0.333333 0.666667\n",
+    }
+    src = tmp_path / "labels"
+    src.mkdir()
+    for name, text in labels.items():
+        (src / f"{name}.txt").write_text(text)
+
+    store_path = str(tmp_path / "labels.ylbl")
+    pack(str(src), store_path)
+    store = LabelStore(store_path)
+    assert store.names == sorted(labels)
+    assert store.counts.tolist() == [2, 0, 1]
+    store.close()
+
+    out = tmp_path / "exported"
+    assert export(str(out), store_path) == len(labels)
+    assert {path.stem: path.read_text() for path in out.iterdir() if path.suffix == ".txt"} == labels
+
+
+def test_average_precision_hand_computed():
+    # Classe 0: 2 box veri, 3 predizioni per confidenza decrescente: TP, FP, TP.
+    #   precisione 1, 1/2, 2/3 - recall 1/2, 1/2, 1 - inviluppo 1, 2/3, 2/3
+    #   sui 101 punti di recall: 51 punti (r <= 0.5) valgono 1, gli altri 50 valgono 2/3
+    # Classe 1: 1 box vero e una sola predizione sbagliata -> AP 0. Classe 2: nessun box vero -> AP 0.
+    # Seconda soglia IoU: nessuna predizione abbinata -> AP 0 ovunque.
+    conf = np.array([0.6, 0.9, 0.8, 0.7])
+    pred_cls = np.array([0, 0, 0, 1])
+    tp = np.array([[True, False], [True, False], [False, False], [False, False]])
+    gt_cls = np.array([0, 0, 1])
+
+    ap, instances = average_precision(tp, conf, pred_cls, gt_cls, num_classes=3)
+
+    assert instances.tolist() == [2, 1, 0]
+    assert ap[0, 0] == pytest.approx((51 + 50 * 2 / 3) / 101)
+    assert ap[0, 1] == 0
+    assert np.all(ap[1:] == 0)
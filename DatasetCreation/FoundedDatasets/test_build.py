@@ -0,0 +1,92 @@
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from BuildManifest import BuildManifest
+from CombineDatasets import convert_coco, convert_coco_stream, merge_yolo
+from DatasetIO import make_executor
+
+CATEGORIES = [{"id": 1, "name": "car_front"}, {"id": 2, "name": "stop"}, {"id": 3, "name": "zebra"}]
+
+
+def _read_dir(path):
+    """{nome file: contenuto in byte} di una cartella (vuoto se non esiste)."""
+    if not os.path.isdir(path):
+        return {}
+    result = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), "rb") as f:
+            result[name] = f.read()
+    return result
+
+
+@pytest.fixture
+def coco_source(tmp_path):
+    """Piccolo dataset COCO: 12 immagini, annotazioni mescolate (non ordinate per immagine), una classe non mappata."""
+    rng = random.Random(0)
+    src = tmp_path / "src"
+    src.mkdir()
+    images = [{"id": i, "file_name": f"{i}.jpg", "width": 64, "height": 48} for i in range(12)]
+    for image in images:
+        cv2.imwrite(str(src / image["file_name"]), np.full((48, 64, 3), image["id"] * 20, np.uint8))
+    annotations = [{"id": k, "image_id": rng.randrange(12), "category_id": rng.choice([1, 2, 3]),
+                    "bbox": [rng.randint(0, 30), rng.randint(0, 20), rng.randint(1, 30), rng.randint(1, 20)]}
+                   for k in range(60)]
+    coco_json = tmp_path / "coco.json"
+    coco_json.write_text(json.dumps({"images": images, "categories": CATEGORIES, "annotations": annotations}))
+    return str(coco_json), str(src)
+
+
+@pytest.fixture
+def yolo_source(tmp_path):
+    """Piccolo dataset YOLO con un'immagine senza label."""
+    img_dir, lbl_dir = tmp_path / "yolo_images", tmp_path / "yolo_labels"
+    img_dir.mkdir()
+    lbl_dir.mkdir()
+    for i in range(6):
+        cv2.imwrite(str(img_dir / f"f{i}.jpg"), np.full((8, 8, 3), i * 40, np.uint8))
+        if i != 5:
+            (lbl_dir / f"f{i}.txt").write_text(f"{i % 3} 0.500000 0.500000 0.200000 0.100000\n")
+    return str(img_dir), str(lbl_dir)
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_workers_match_serial(tmp_path, coco_source, yolo_source, kind):
+    outputs = []
+    for workers in (1, 4):
+        out = tmp_path / f"out_{kind}_{workers}"
+        img_out, lbl_out = str(out / "images"), str(out / "labels")
+        executor = make_executor(workers, kind)
+        try:
+            convert_coco(*coco_source, "coco", img_out, lbl_out, executor=executor)
+            merge_yolo(*yolo_source, "yolo", img_out, lbl_out, executor=executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        outputs.append((_read_dir(img_out), _read_dir(lbl_out)))
+    assert outputs[0][1]
+    assert outputs[0] == outputs[1]
+
+
+def test_stream_adapter_matches_coco_adapter(tmp_path, coco_source):
+    convert_coco(*coco_source, "coco", str(tmp_path / "ref/images"), str(tmp_path / "ref/labels"))
+    expected = _read_dir(tmp_path / "ref/labels")
+
+    # Buffer minuscolo: le label delle immagini con annotazioni sparse vengono scritte in più parti
+    manifest_path = str(tmp_path / "out.manifest.json")
+    written = []
+    for _ in range(2):
+        manifest = BuildManifest(manifest_path)
+        stats = convert_coco_stream(*coco_source, "coco", str(tmp_path / "out/images"), str(tmp_path / "out/labels"),
+                                    manifest=manifest, buffer_lines=3)
+        manifest.save()
+        assert stats["flushes"] > 1
+        assert not stats["errors"]
+        assert _read_dir(tmp_path / "out/labels") == expected
+        written.append(stats["written"])
+    # Rebuild senza modifiche: nessun file riscritto, nemmeno le label scritte in più parti
+    assert written[0] > 0 and written[1] == 0
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from DetectionMetrics import agreement
+from ModelExport import BACKENDS, detections_array, load_detector
+from VideoPipeline import open_source
+
+
+def track_boxes(prev_gray, gray, boxes, grid=4, max_fb_error=1.0, min_points=4):
+    """
+    Sposta i box dal frame precedente al corrente con il flusso ottico sparso (Lucas-Kanade piramidale).
+
+    Per ogni box si seguono grid x grid punti interni, tutti insieme in una sola chiamata; i punti che non
+    superano il controllo avanti-indietro vengono scartati. Lo spostamento del box è la mediana di quello
+    dei suoi punti, la scala il rapporto mediano delle distanze dei punti dal centro.
+
+    Args:
+        prev_gray (np.ndarray): Frame precedente in scala di grigi.
+        gray (np.ndarray): Frame corrente in scala di grigi.
+        boxes (np.ndarray): (n, 4) x1, y1, x2, y2 nelle coordinate dei frame.
+
+    Returns:
+        tuple: (box spostati (n, 4), bool (n,) True per i box seguiti, spostamento relativo per box (n,))
+    """
+    n = len(boxes)
+    if not n:
+        return boxes.reshape(0, 4), np.zeros(0, dtype=bool), np.zeros(0)
+    steps = (np.arange(grid) + 0.5) / grid * 0.8 + 0.1  # punti nell'80% centrale del box
+    fx, fy = [f.ravel() for f in np.meshgrid(steps, steps)]
+    width, height = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    points = np.stack([boxes[:, None, 0] + fx * width[:, None], boxes[:, None, 1] + fy * height[:, None]], axis=2)
+    points = points.reshape(-1, 1, 2).astype(np.float32)
+
+    lk = {"winSize": (15, 15), "maxLevel": 2}
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **lk)
+    back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, moved, None, **lk)
+    error = np.linalg.norm(back - points, axis=2).ravel()
+    valid = ((status.ravel() == 1) & (back_status.ravel() == 1) & (error < max_fb_error)).reshape(n, grid * grid)
+    tracked = valid.sum(axis=1) >= min_points
+
+    new_boxes = boxes.astype(np.float32).copy()
+    motion = np.zeros(n)
+    if not tracked.any():
+        return new_boxes, tracked, motion
+    old = np.where(valid[..., None], points.reshape(n, -1, 2), np.nan)[tracked]
+    new = np.where(valid[..., None], moved.reshape(n, -1, 2), np.nan)[tracked]
+    shift = np.nanmedian(new - old, axis=1)
+    old_spread = np.linalg.norm(old - np.nanmedian(old, axis=1, keepdims=True), axis=2)
+    new_spread = np.linalg.norm(new - np.nanmedian(new, axis=1, keepdims=True), axis=2)
+    scale = np.clip(np.nanmedian(new_spread / np.maximum(old_spread, 1e-3), axis=1), 0.8, 1.25)
+
+    selected = boxes[tracked]
+    center = (selected[:, :2] + selected[:, 2:]) / 2 + shift
+    half = (selected[:, 2:] - selected[:, :2]) / 2 * scale[:, None]
+    new_boxes[tracked] = np.concatenate([center - half, center + half], axis=1)
+    motion[tracked] = np.linalg.norm(shift, axis=1) / np.maximum(np.hypot(width[tracked], height[tracked]), 1)
+    return new_boxes, tracked, motion
+
+
+class KeyframeTracker:
+    """
+    Detection ogni N frame (keyframe) e tracking con flusso ottico nei frame intermedi.
+
+    Il detector viene chiamato anche prima della scadenza se la scena cambia bruscamente (differenza media tra
+    miniature dei frame oltre scene_threshold) o se si perde più della metà dei box. N si adatta al movimento:
+    con uno spostamento medio m (frazione della diagonale del box per frame) il prossimo intervallo è
+    motion_budget / m, tra min_interval e max_interval; con scena ferma si arriva a max_interval.
+    """
+
+    def __init__(self, detect, max_interval=10, min_interval=2, motion_budget=0.3, scene_threshold=0.12, flow_width=320):
+        self.detect = detect
+        self.max_interval = max_interval
+        self.min_interval = min(min_interval, max_interval)
+        self.motion_budget = motion_budget
+        self.scene_threshold = scene_threshold
+        self.flow_width = flow_width
+        self.interval = max_interval
+        self.prev_gray = None
+        self.prev_thumb = None
+        self.detections = np.zeros((0, 6), dtype=np.float32)
+        self.since_keyframe = 0
+        self.motions = []
+        self.frames = 0
+        self.keyframes = 0
+
+    def __call__(self, frame):
+        """
+        Returns:
+            tuple: (detection (n, 6) x1, y1, x2, y2, conf, cls, True se il frame è un keyframe)
+        """
+        scale = min(1.0, self.flow_width / frame.shape[1])
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else frame
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (32, 18), interpolation=cv2.INTER_AREA).astype(np.float32)
+        scene_change = self.prev_thumb is not None and np.abs(thumb - self.prev_thumb).mean() / 255 > self.scene_threshold
+        self.frames += 1
+
+        keyframe = self.prev_gray is None or scene_change or self.since_keyframe + 1 >= self.interval
+        if not keyframe and len(self.detections):
+            boxes, tracked, motion = track_boxes(self.prev_gray, gray, self.detections[:, :4] * scale)
+            self.motions.append(float(motion[tracked].mean()) if tracked.any() else 0.0)
+            if tracked.mean() < 0.5:
+                keyframe = True
+            else:
+                h, w = frame.shape[:2]
+                boxes = boxes[tracked] / scale
+                boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+                boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+                self.detections = np.concatenate([boxes, self.detections[tracked, 4:]], axis=1).astype(np.float32)
+
+        if keyframe:
+            if self.motions:
+                motion = float(np.mean(self.motions))
+                self.interval = self.max_interval if motion <= 0 else int(
+                    np.clip(round(self.motion_budget / motion), self.min_interval, self.max_interval))
+            self.detections = np.asarray(self.detect(frame), dtype=np.float32).reshape(-1, 6)
+            self.keyframes += 1
+            self.since_keyframe = 0
+            self.motions = []
+        else:
+            self.since_keyframe += 1
+
+        self.prev_gray = gray
+        self.prev_thumb = thumb
+        return self.detections, keyframe
+
+
+def read_labels(labels_dir, index, shape):
+    """Etichette YOLO del frame index (file {index:06d}.txt) come array (n, 6) x1, y1, x2, y2, 1, cls in pixel."""
+    path = os.path.join(labels_dir, f"{index:06d}.txt")
+    if not os.path.exists(path):
+        return np.zeros((0, 6), dtype=np.float32)
+    rows = np.loadtxt(path, ndmin=2, dtype=np.float32).reshape(-1, 5)
+    h, w = shape[:2]
+    cx, cy, bw, bh = rows[:, 1] * w, rows[:, 2] * h, rows[:, 3] * w, rows[:, 4] * h
+    return np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2, np.ones(len(rows)), rows[:, 0]], axis=1)
+
+
+def evaluate(model, video, imgsz=320, max_interval=10, min_interval=2, labels_dir=None, max_frames=None):
+    """
+    Costo in accuratezza e guadagno in FPS della modalità keyframe rispetto alla detection su ogni frame.
+
+    Un solo passaggio sul video: su ogni frame viene eseguita la detection completa (cronometrata) e il
+    tracker la riusa nei keyframe, quindi i due tempi si confrontano sugli stessi frame. Il riferimento per
+    l'accuratezza sono le etichette (labels_dir, un file YOLO per frame) oppure, senza etichette, la
+    detection completa stessa.
+
+    Returns:
+        dict: frame, keyframe, FPS delle due modalità, speedup e precision/recall/F1
+    """
+    cap, _ = open_source(video)
+    current = {}
+    tracker = KeyframeTracker(lambda frame: current["detections"], max_interval, min_interval)
+    decode_s = detect_s = keyframe_detect_s = track_s = 0.0
+    full, keyframe_preds, refs = [], [], []
+    while max_frames is None or len(full) < max_frames:
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        decoded = time.perf_counter()
+        with torch.no_grad():
+            current["detections"] = detections_array(model(frame, imgsz=imgsz, verbose=False)[0])
+        detected = time.perf_counter()
+        detections, keyframe = tracker(frame)
+        tracked = time.perf_counter()
+
+        decode_s += decoded - start
+        detect_s += detected - decoded
+        track_s += tracked - detected
+        if keyframe:
+            keyframe_detect_s += detected - decoded
+        full.append(current["detections"])
+        keyframe_preds.append(detections)
+        refs.append(read_labels(labels_dir, len(full) - 1, frame.shape) if labels_dir else current["detections"])
+    cap.release()
+
+    frames = len(full)
+    full_seconds = decode_s + detect_s
+    keyframe_seconds = decode_s + keyframe_detect_s + track_s
+    report = {
+        "video": video,
+        "frames": frames,
+        "keyframes": tracker.keyframes,
+        "reference": "labels" if labels_dir else "full_detection",
+        "fps_full": frames / full_seconds if full_seconds else 0.0,
+        "fps_keyframe": frames / keyframe_seconds if keyframe_seconds else 0.0,
+        "speedup": full_seconds / keyframe_seconds if keyframe_seconds else 0.0,
+        "track_ms": track_s / frames * 1000 if frames else 0.0,
+        "keyframe": agreement(keyframe_preds, refs),
+    }
+    if labels_dir:
+        report["full"] = agreement(full, refs)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modalità keyframe (detection ogni N frame + tracking): accuratezza e FPS rispetto alla detection completa.")
+    parser.add_argument("--model", default="../yolo11n.pt", help="Modello YOLO (default: ../yolo11n.pt)")
+    parser.add_argument("--video", default="../Video/video1.mp4", help="Video di test (default: ../Video/video1.mp4)")
+    parser.add_argument("--labels", default=None, help="Cartella con le etichette YOLO per frame (000000.txt, ...); senza, il riferimento è la detection completa")
+    parser.add_argument("--imgsz", type=int, default=320, help="Dimensione di input del modello (default: 320)")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS, help="Backend di inferenza (default: torch)")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di calcolo del backend (default: quelli del backend)")
+    parser.add_argument("--interval", type=int, nargs="+", default=[10],
+                        help="Intervalli massimi tra due detection da confrontare (default: 10)")
+    parser.add_argument("--min-interval", type=int, default=2, help="Intervallo minimo con movimento veloce (default: 2)")
+    parser.add_argument("--max-frames", type=int, default=None, help="Frame massimi da elaborare")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il report in questo file JSON")
+    args = parser.parse_args()
+
+    model = load_detector(args.model, args.backend, args.imgsz, args.threads)
+    reports = []
+    for interval in args.interval:
+        report = evaluate(model, args.video, args.imgsz, interval, args.min_interval, args.labels, args.max_frames)
+        report["max_interval"] = interval
+        reports.append(report)
+        accuracy = report["keyframe"]
+        line = (f"N max {interval:>3}: {report['keyframes']}/{report['frames']} keyframe, {report['fps_full']:.1f} -> "
+                f"{report['fps_keyframe']:.1f} FPS (x{report['speedup']:.1f}), precision {accuracy['precision']:.3f}, "
+                f"recall {accuracy['recall']:.3f}, F1 {accuracy['f1']:.3f}")
+        if "full" in report:
+            line += f" (detection completa: F1 {report['full']['f1']:.3f})"
+        print(line)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(reports, f, indent=2)
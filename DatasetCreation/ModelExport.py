@@ -0,0 +1,304 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from DetectionMetrics import agreement
+from VideoPipeline import open_source
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EXPORT_DIR = "../exports"
+CALIB_DIR = "FoundedDatasets/combined_dataset/images/val"
+
+
+def _file_digest(path, length=12):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:length]
+
+
+def _artifact_path(model_path, imgsz, kind, export_dir, extra=""):
+    """Percorso in cache di un artefatto: dipende dal contenuto del modello, da imgsz e dai parametri dell'export."""
+    key = hashlib.sha256(f"{_file_digest(model_path)}:{imgsz}:{kind}:{extra}".encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(export_dir, f"{stem}_{imgsz}_{kind}_{key}.onnx")
+
+
+def export_onnx(model_path, imgsz=320, export_dir=EXPORT_DIR):
+    """
+    Esporta il modello in ONNX (una volta sola: se l'artefatto in cache esiste viene riusato).
+    La dimensione di input è fissa (imgsz x imgsz, batch 1), che su CPU è la forma più veloce da eseguire.
+
+    Returns:
+        str: percorso del file .onnx
+    """
+    path = _artifact_path(model_path, imgsz, "fp32", export_dir)
+    if os.path.exists(path):
+        return path
+    from ultralytics import YOLO
+    os.makedirs(export_dir, exist_ok=True)
+    exported = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=False, simplify=True)
+    tmp = path + ".tmp"
+    shutil.copy(exported, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def letterbox(frame, imgsz, color=114):
+    """
+    Ridimensiona mantenendo le proporzioni e riempie fino a imgsz x imgsz (come il LetterBox di ultralytics),
+    poi converte in blob RGB float32 (1, 3, imgsz, imgsz) in [0, 1].
+
+    Returns:
+        tuple: (blob, gain, (pad_x, pad_y))
+    """
+    h, w = frame.shape[:2]
+    gain = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_x, pad_y = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR) if (new_w, new_h) != (w, h) else frame
+    left, top = int(round(pad_x - 0.1)), int(round(pad_y - 0.1))
+    right, bottom = imgsz - new_w - left, imgsz - new_h - top
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(color, color, color))
+    blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True)
+    return blob, gain, (left, top)
+
+
+class CalibrationReader:
+    """Immagini di calibrazione per la quantizzazione statica di onnxruntime (un campione deterministico della cartella)."""
+
+    def __init__(self, input_name, calib_dir, imgsz, size=200):
+        files = sorted(f for f in os.listdir(calib_dir) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+        step = max(1, len(files) // size)
+        self.paths = [os.path.join(calib_dir, f) for f in files[::step][:size]]
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.position = 0
+
+    def get_next(self):
+        while self.position < len(self.paths):
+            image = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if image is not None:
+                return {self.input_name: letterbox(image, self.imgsz)[0]}
+        return None
+
+    def rewind(self):
+        self.position = 0
+
+
+def quantize_int8(onnx_path, model_path, imgsz=320, calib_dir=CALIB_DIR, calib_size=200, export_dir=EXPORT_DIR):
+    """
+    Quantizzazione statica int8 (QDQ) del modello ONNX, calibrata su un sottoinsieme di calib_dir.
+    Anche questo artefatto è in cache, con la chiave che include cartella e dimensione della calibrazione.
+
+    Returns:
+        str: percorso del file .onnx quantizzato
+    """
+    calib_files = len(os.listdir(calib_dir)) if os.path.isdir(calib_dir) else 0
+    path = _artifact_path(model_path, imgsz, "int8", export_dir, f"{os.path.abspath(calib_dir)}:{calib_files}:{calib_size}")
+    if os.path.exists(path):
+        return path
+    if not calib_files:
+        raise FileNotFoundError(f"Cartella di calibrazione vuota o assente: {calib_dir}")
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    reader = CalibrationReader(input_name, calib_dir, imgsz, calib_size)
+    tmp = path + ".tmp.onnx"
+    quantize_static(onnx_path, tmp, reader, quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8, per_channel=True, calibrate_method=CalibrationMethod.MinMax)
+    os.replace(tmp, path)
+    return path
+
+
+def postprocess(output, gain, pad, shape, conf=0.25, iou=0.7, max_det=300):
+    """
+    Output grezzo di YOLO11 (1, 4 + classi, ancore) -> detection (n, 6) x1, y1, x2, y2, conf, cls nelle coordinate
+    del frame originale: filtro per confidenza, NMS per classe, rimozione del letterbox.
+    """
+    predictions = output[0].T
+    scores = predictions[:, 4:]
+    cls = scores.argmax(axis=1)
+    confidence = scores[np.arange(len(cls)), cls]
+    keep = confidence >= conf
+    predictions, cls, confidence = predictions[keep], cls[keep], confidence[keep]
+    if not len(predictions):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    boxes = (boxes - np.array([pad[0], pad[1], pad[0], pad[1]])) / gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+
+    xywh = np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+    indices = cv2.dnn.NMSBoxesBatched(xywh.tolist(), confidence.tolist(), cls.tolist(), conf, iou)
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1)[:max_det]
+    return np.concatenate([boxes[indices], confidence[indices, None], cls[indices, None]], axis=1).astype(np.float32)
+
+
+class OnnxDetector:
+    """
+    Detector su onnxruntime con la stessa interfaccia usata dagli script per ultralytics.YOLO:
+    detector(frame o lista di frame, imgsz=...) -> lista di Results (con plot(), boxes e speed).
+    """
+
+    def __init__(self, onnx_path, imgsz=320, threads=None, conf=0.25, iou=0.7):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+    def detect(self, frame, conf=None):
+        """Detection di un frame come array (n, 6), con i tempi di preprocess/inference/postprocess in ms."""
+        start = time.perf_counter()
+        blob, gain, pad = letterbox(frame, self.imgsz)
+        preprocessed = time.perf_counter()
+        output = self.session.run(None, {self.input_name: blob})[0]
+        inferred = time.perf_counter()
+        detections = postprocess(output, gain, pad, frame.shape, self.conf if conf is None else conf, self.iou)
+        done = time.perf_counter()
+        speed = {"preprocess": 1000 * (preprocessed - start), "inference": 1000 * (inferred - preprocessed),
+                 "postprocess": 1000 * (done - inferred)}
+        return detections, speed
+
+    def __call__(self, source, imgsz=None, verbose=False, conf=None, **kwargs):
+        import torch
+        from ultralytics.engine.results import Results
+        if imgsz is not None and imgsz != self.imgsz:
+            raise ValueError(f"Il modello ONNX è esportato a imgsz={self.imgsz}, non {imgsz}")
+        frames = source if isinstance(source, list) else [source]
+        results = []
+        for frame in frames:
+            detections, speed = self.detect(frame, conf)
+            result = Results(frame, path="", names=self.names, boxes=torch.from_numpy(detections))
+            result.speed = speed
+            results.append(result)
+        return results
+
+
+def load_detector(model_path, backend="torch", imgsz=320, threads=None, calib_dir=CALIB_DIR, calib_size=200,
+                  export_dir=EXPORT_DIR):
+    """
+    Carica il modello sul backend scelto, esportandolo (e quantizzandolo) alla prima richiesta.
+
+    Args:
+        backend (str): "torch" (ultralytics/PyTorch), "onnx" (onnxruntime fp32) o "onnx-int8" (onnxruntime int8).
+        threads (int): Thread di calcolo (torch.set_num_threads oppure intra_op_num_threads di onnxruntime).
+
+    Returns:
+        Un oggetto chiamabile come ultralytics.YOLO: detector(frame, imgsz=...) -> lista di Results.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend sconosciuto: {backend}")
+    if backend == "torch":
+        import torch
+        from ultralytics import YOLO
+        if threads:
+            torch.set_num_threads(threads)
+        return YOLO(model_path)
+    onnx_path = export_onnx(model_path, imgsz, export_dir)
+    if backend == "onnx-int8":
+        onnx_path = quantize_int8(onnx_path, model_path, imgsz, calib_dir, calib_size, export_dir)
+    return OnnxDetector(onnx_path, imgsz, threads)
+
+
+def detections_array(result):
+    """Results di ultralytics -> array (n, 6) x1, y1, x2, y2, conf, cls."""
+    boxes = result.boxes
+    return np.concatenate([boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()[:, None],
+                           boxes.cls.cpu().numpy()[:, None]], axis=1) if len(boxes) else np.zeros((0, 6))
+
+
+def compare_backends(model_path, video, backends=BACKENDS, imgsz=320, frames=200, warmup=10, threads=None,
+                     calib_dir=CALIB_DIR):
+    """
+    Confronto tra backend sugli stessi frame: latenza (media, p50, p90) e accordo delle detection con il primo
+    backend della lista (precision/recall/F1 a IoU 0.5, stessa classe).
+
+    Returns:
+        dict: {backend: {"latency_ms", "fps", "agreement"}}
+    """
+    cap, _ = open_source(video)
+    sample = []
+    while len(sample) < frames + warmup:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        sample.append(frame)
+    cap.release()
+    if len(sample) <= warmup:
+        raise RuntimeError(f"Video troppo corto o non leggibile: {video}")
+
+    report, reference = {}, None
+    for backend in backends:
+        detector = load_detector(model_path, backend, imgsz, threads, calib_dir)
+        for frame in sample[:warmup]:
+            detector(frame, imgsz=imgsz, verbose=False)
+        times, detections = [], []
+        for frame in sample[warmup:]:
+            start = time.perf_counter()
+            result = detector(frame, imgsz=imgsz, verbose=False)[0]
+            times.append(time.perf_counter() - start)
+            detections.append(detections_array(result))
+        times = np.array(times) * 1000
+        if reference is None:
+            reference = detections
+        report[backend] = {
+            "latency_ms": {"mean": float(times.mean()), "p50": float(np.percentile(times, 50)),
+                           "p90": float(np.percentile(times, 90))},
+            "fps": float(1000 / times.mean()),
+            "agreement": agreement(detections, reference),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export del modello per CPU (ONNX / int8) e confronto tra backend.")
+    parser.add_argument("--model", default="../yolo11n.pt", help="Modello YOLO (default: ../yolo11n.pt)")
+    parser.add_argument("--video", default="../Video/video1.mp4", help="Video per il confronto (default: ../Video/video1.mp4)")
+    parser.add_argument("--imgsz", type=int, default=320, help="Dimensione di input (default: 320)")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS,
+                        help="Backend da confrontare; il primo è il riferimento per l'accuratezza")
+    parser.add_argument("--frames", type=int, default=200, help="Frame misurati (default: 200)")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di calcolo")
+    parser.add_argument("--calib-dir", default=CALIB_DIR, help=f"Immagini di calibrazione int8 (default: {CALIB_DIR})")
+    parser.add_argument("--export-only", action="store_true", help="Crea solo gli artefatti in cache, senza confronto")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il report in questo file JSON")
+    args = parser.parse_args()
+
+    if args.export_only:
+        onnx_path = export_onnx(args.model, args.imgsz)
+        print(f"ONNX: {onnx_path}")
+        if "onnx-int8" in args.backends:
+            print(f"ONNX int8: {quantize_int8(onnx_path, args.model, args.imgsz, args.calib_dir)}")
+    else:
+        report = compare_backends(args.model, args.video, args.backends, args.imgsz, args.frames,
+                                  threads=args.threads, calib_dir=args.calib_dir)
+        for backend, info in report.items():
+            agree = info["agreement"]
+            print(f"{backend:>10}: {info['fps']:.1f} FPS, latenza p50 {info['latency_ms']['p50']:.1f} ms / "
+                  f"p90 {info['latency_ms']['p90']:.1f} ms | accordo con {args.backends[0]}: "
+                  f"P {agree['precision']:.3f} R {agree['recall']:.3f} F1 {agree['f1']:.3f}")
+        if args.json_path:
+            with open(args.json_path, "w") as f:
+                json.dump({"model": args.model, "video": args.video, "imgsz": args.imgsz, "backends": report}, f, indent=2)
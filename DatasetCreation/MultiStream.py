@@ -0,0 +1,197 @@
+import argparse
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from ModelExport import BACKENDS, load_detector
+from VideoPipeline import FrameQueue, open_source
+
+
+class Stream:
+    """Una sorgente (video o webcam) con il suo thread di decodifica, la sua coda e le sue statistiche."""
+
+    def __init__(self, index, source, budget_ms, queue_size=4, realtime=False):
+        self.index = index
+        self.source = source
+        self.cap, live = open_source(source)
+        # Le sorgenti live (o i video riprodotti in tempo reale) scartano i frame vecchi; i video offline aspettano
+        self.realtime = realtime and not live
+        self.queue = FrameQueue(queue_size, drop_oldest=live or realtime)
+        self.budget = budget_ms / 1000
+        self.finished = threading.Event()
+        self.processed = 0
+        self.expired = 0
+        self.latencies = []
+        self.depths = []
+        self.started_at = None
+        self.last_done = None
+        self.thread = threading.Thread(target=self._decode, daemon=True)
+
+    def _decode(self):
+        interval = 1 / (self.cap.get(cv2.CAP_PROP_FPS) or 30) if self.realtime else 0
+        next_time = time.perf_counter()
+        frame_index = 0
+        while not self.stop.is_set():
+            if not self.queue.drop_oldest:
+                # Video offline: si decodifica solo quando c'è posto, così l'istante del frame non include l'attesa
+                self.queue.wait_for_space(self.stop)
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self.queue.put((self, frame_index, frame, time.perf_counter()), self.stop)
+            frame_index += 1
+            if interval:
+                next_time += interval
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+        self.cap.release()
+        self.finished.set()
+
+    def start(self, stop):
+        self.stop = stop
+        self.started_at = time.perf_counter()
+        self.thread.start()
+
+    def deadline(self):
+        """Scadenza del frame più vecchio in coda (istante di decodifica + budget di latenza), None se la coda è vuota."""
+        head = self.queue.peek()
+        return None if head is None else head[3] + self.budget
+
+    def done(self):
+        return self.finished.is_set() and self.queue.peek() is None
+
+    def report(self):
+        # FPS sul tempo in cui lo stream è stato attivo (un video più corto non viene penalizzato)
+        seconds = (self.last_done - self.started_at) if self.last_done else 0.0
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "source": self.source,
+            "processed": self.processed,
+            "fps": self.processed / seconds if seconds else 0.0,
+            "dropped": self.queue.dropped,
+            "expired": self.expired,
+            "latency_ms": {"p50": float(np.percentile(latencies, 50)), "p90": float(np.percentile(latencies, 90))},
+            "queue_depth": {"mean": float(np.mean(self.depths)) if self.depths else 0.0,
+                            "max": int(max(self.depths)) if self.depths else 0},
+        }
+
+
+def next_batch(streams, max_batch, per_stream, expected_seconds=0.0):
+    """
+    Costruisce un batch tra più stream.
+
+    Ordine: earliest deadline first (prima lo stream il cui frame più vecchio scade prima); equità: al più
+    per_stream frame dello stesso stream per batch, così uno stream veloce non affama gli altri.
+    Negli stream che scartano frame (webcam o --realtime) i frame che sforerebbero il budget di latenza, contando
+    anche la durata prevista del batch (expected_seconds), vengono scartati (contati come "expired") invece di
+    essere elaborati. I video offline invece vengono elaborati per intero.
+    """
+    batch = []
+    now = time.perf_counter()
+    taken = {stream.index: 0 for stream in streams}
+    while len(batch) < max_batch:
+        ready = [(stream.deadline(), stream.index, stream) for stream in streams
+                 if taken[stream.index] < per_stream and stream.queue.peek() is not None]
+        if not ready:
+            break
+        deadline, _, stream = min(ready, key=lambda item: (item[0], item[1]))
+        item = stream.queue.get_nowait()
+        if item is None:
+            continue
+        if stream.queue.drop_oldest and now + expected_seconds > item[3] + stream.budget:
+            stream.expired += 1
+            continue
+        batch.append(item)
+        taken[stream.index] += 1
+    return batch
+
+
+def run_streams(model, sources, imgsz=320, max_batch=8, per_stream=2, budget_ms=500, queue_size=4,
+                realtime=False, show=False, report_every=5.0):
+    """
+    Esegue un solo modello su più sorgenti: un thread di decodifica per sorgente, un solo scheduler che
+    forma batch tra gli stream (vedi next_batch) e chiama il modello condiviso.
+
+    Returns:
+        dict: {"seconds", "batches", "mean_batch", "streams": [report per stream]}
+    """
+    stop = threading.Event()
+    streams = [Stream(i, source, budget_ms, queue_size, realtime) for i, source in enumerate(sources)]
+    for stream in streams:
+        stream.start(stop)
+
+    start_time = last_report = time.perf_counter()
+    batches, batch_frames = 0, 0
+    expected_seconds = 0.0  # durata media (esponenziale) di una chiamata al modello
+    try:
+        while not all(stream.done() for stream in streams):
+            for stream in streams:
+                stream.depths.append(stream.queue.qsize())
+            batch = next_batch(streams, max_batch, per_stream, expected_seconds)
+            if not batch:
+                time.sleep(0.001)
+                continue
+
+            started = time.perf_counter()
+            with torch.no_grad():
+                results = model([frame for _, _, frame, _ in batch], imgsz=imgsz, verbose=False)
+            done = time.perf_counter()
+            expected_seconds = done - started if not batches else 0.8 * expected_seconds + 0.2 * (done - started)
+            batches += 1
+            batch_frames += len(batch)
+            for (stream, frame_index, frame, decoded_at), result in zip(batch, results):
+                stream.processed += 1
+                stream.latencies.append(done - decoded_at)
+                stream.last_done = done
+                if show:
+                    cv2.imshow(f"Stream {stream.index}", result.plot())
+            if show and cv2.waitKey(1) == ord('q'):
+                break
+
+            if report_every and done - last_report >= report_every:
+                last_report = done
+                elapsed = done - start_time
+                print("  ".join(f"[{s.index}] {s.processed / elapsed:.1f} FPS coda {s.queue.qsize()}" for s in streams))
+    finally:
+        stop.set()
+        for stream in streams:
+            stream.thread.join(timeout=5)
+        if show:
+            cv2.destroyAllWindows()
+
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "batches": batches, "mean_batch": batch_frames / batches if batches else 0.0,
+            "streams": [stream.report() for stream in streams]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Un solo modello YOLO su più video/webcam, con batch condivisi tra gli stream.")
+    parser.add_argument("sources", nargs="+", help="Video o indici di webcam")
+    parser.add_argument("--model", default="../yolo11n.pt", help="Modello YOLO (default: ../yolo11n.pt)")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS, help="Backend di inferenza (default: torch)")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di calcolo del backend (uno solo per tutti gli stream)")
+    parser.add_argument("--imgsz", type=int, default=320, help="Dimensione di input del modello (default: 320)")
+    parser.add_argument("--max-batch", type=int, default=8, help="Frame massimi per chiamata al modello (default: 8)")
+    parser.add_argument("--per-stream", type=int, default=2, help="Frame massimi dello stesso stream per batch (default: 2)")
+    parser.add_argument("--budget-ms", type=float, default=500, help="Latenza massima di un frame per webcam e --realtime: oltre viene scartato (default: 500)")
+    parser.add_argument("--queue-size", type=int, default=4, help="Dimensione della coda di ogni stream (default: 4)")
+    parser.add_argument("--realtime", action="store_true", help="Riproduce i video alla loro velocità, come fossero telecamere")
+    parser.add_argument("--show", action="store_true", help="Mostra ogni stream in una finestra (q per uscire)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva il report in questo file JSON")
+    args = parser.parse_args()
+
+    model = load_detector(args.model, args.backend, args.imgsz, args.threads)
+    report = run_streams(model, args.sources, args.imgsz, args.max_batch, args.per_stream, args.budget_ms,
+                         args.queue_size, args.realtime, args.show)
+
+    print(f"\n{len(args.sources)} stream in {report['seconds']:.1f}s, {report['batches']} batch (media {report['mean_batch']:.1f} frame)")
+    for i, stream in enumerate(report["streams"]):
+        print(f"[{i}] {stream['source']}: {stream['fps']:.1f} FPS, latenza p50 {stream['latency_ms']['p50']:.0f} ms / "
+              f"p90 {stream['latency_ms']['p90']:.0f} ms, coda media {stream['queue_depth']['mean']:.1f}, "
+              f"{stream['dropped']} scartati, {stream['expired']} oltre il budget")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,314 @@
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+import cv2
+import numpy as np
+
+WINDOW_NAME = "Object Detection"
+
+
+def open_source(source):
+    """
+    Apre un video o una webcam. Una sorgente composta solo da cifre è l'indice di una webcam (sorgente live).
+
+    Returns:
+        tuple: (cv2.VideoCapture, True se la sorgente è live)
+    """
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(source), False
+
+
+class FrameQueue:
+    """
+    Coda limitata tra due stadi della pipeline.
+
+    Con drop_oldest (sorgenti live) il produttore non si blocca mai: se la coda è piena viene scartato l'elemento
+    più vecchio, così la visualizzazione resta vicina al tempo reale invece di accumulare ritardo.
+    Senza drop_oldest (video offline) il produttore aspetta e nessun frame va perso.
+    """
+
+    def __init__(self, maxsize=4, drop_oldest=False):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item, stop=None):
+        if item is None or not self.drop_oldest:
+            # Il segnale di fine (None) non va mai scartato; dopo uno stop nessuno legge più, quindi si rinuncia
+            while True:
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    if stop is not None and stop.is_set():
+                        return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def wait_for_space(self, stop=None):
+        """
+        Aspetta un posto libero nella coda (o lo stop). Con un solo produttore il put successivo non si blocca:
+        serve a prendere l'istante di decodifica dopo l'attesa, non prima.
+        """
+        with self.queue.not_full:
+            while len(self.queue.queue) >= self.queue.maxsize > 0:
+                if stop is not None and stop.is_set():
+                    return
+                self.queue.not_full.wait(0.1)
+
+    def get(self):
+        return self.queue.get()
+
+    def get_nowait(self):
+        """Elemento più vecchio, oppure None se la coda è vuota."""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def peek(self):
+        """Elemento più vecchio senza toglierlo dalla coda (None se vuota)."""
+        with self.queue.mutex:
+            return self.queue.queue[0] if self.queue.queue else None
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+class StageTimer:
+    """Tempi per stadio (in secondi), conservati per frame: medie per l'overlay e percentili per i report."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def mean_ms(self, stage, last=30):
+        with self.lock:
+            values = self.samples[stage][-last:]
+        return 1000 * sum(values) / len(values) if values else 0.0
+
+    def percentiles_ms(self, stage, percentiles=(50, 90, 99)):
+        """Percentili (in ms) dei tempi di uno stadio."""
+        with self.lock:
+            values = np.array(self.samples[stage], dtype=np.float64)
+        if not len(values):
+            return {f"p{p}": 0.0 for p in percentiles}
+        return {f"p{p}": float(v) for p, v in zip(percentiles, np.percentile(values * 1000, percentiles))}
+
+    def summary(self):
+        """{stadio: (frame, media in ms)}"""
+        with self.lock:
+            return {stage: (len(values), 1000 * sum(values) / len(values)) for stage, values in self.samples.items() if values}
+
+
+class FpsMeter:
+    """FPS sugli ultimi frame (finestra mobile), più stabile di 1 / (tempo dall'ultimo frame)."""
+
+    def __init__(self, window=30):
+        self.times = deque(maxlen=window)
+
+    def tick(self):
+        self.times.append(time.perf_counter())
+
+    @property
+    def fps(self):
+        if len(self.times) < 2:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+
+def handle_keys(key):
+    """Controlli da tastiera della finestra: q esce (restituisce True), f attiva/disattiva lo schermo intero."""
+    if key == ord('q'):  # Esci
+        return True
+    if key == ord('f'):  # Toggle fullscreen
+        cv2.setWindowProperty(WINDOW_NAME, cv2.WND_PROP_FULLSCREEN,
+                              not cv2.getWindowProperty(WINDOW_NAME, cv2.WND_PROP_FULLSCREEN))
+    return False
+
+
+def decode_stage(cap, out_queue, timer, stop, max_frames=None):
+    """Stadio di decodifica: legge i frame e li passa (indice, frame) allo stadio successivo."""
+    index = 0
+    while not stop.is_set() and (max_frames is None or index < max_frames):
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timer.add("decode", time.perf_counter() - start)
+        out_queue.put((index, frame), stop)
+        index += 1
+    out_queue.put(None, stop)
+
+
+def inference_stage(infer, in_queue, out_queue, timer, stop):
+    """Stadio di inferenza: infer(frame) -> risultato; i tempi interni del modello sono registrati per stadio."""
+    while True:
+        item = in_queue.get()
+        if item is None or stop.is_set():
+            break
+        index, frame = item
+        start = time.perf_counter()
+        result = infer(frame)
+        timer.add("inference_total", time.perf_counter() - start)
+        for stage, ms in getattr(result, "speed", {}).items():
+            timer.add(stage, ms / 1000)
+        out_queue.put((index, frame, result), stop)
+    out_queue.put(None, stop)
+
+
+def run_pipeline(cap, infer, render, queue_size=4, drop_oldest=False, max_frames=None):
+    """
+    Esegue decodifica, inferenza e visualizzazione in parallelo: decodifica e inferenza su due thread,
+    la visualizzazione nel thread principale (richiesto da cv2.imshow su molte piattaforme).
+    Gli stadi sono collegati da code limitate, quindi la memoria resta costante anche se uno stadio è lento.
+
+    Args:
+        cap (cv2.VideoCapture): Sorgente.
+        infer (callable): frame -> risultato (es. results[0] di ultralytics, con l'attributo speed).
+        render (callable): (indice, frame, risultato, timer, fps) -> True per terminare.
+        queue_size (int): Dimensione delle code tra gli stadi.
+        drop_oldest (bool): Scarta i frame più vecchi invece di bloccare la decodifica (sorgenti live).
+        max_frames (int): (opzionale) numero massimo di frame da elaborare.
+
+    Returns:
+        dict: {"frames", "seconds", "fps", "dropped", "stages": {stadio: (frame, media ms)}}
+    """
+    timer = StageTimer()
+    stop = threading.Event()
+    decoded = FrameQueue(queue_size, drop_oldest)
+    inferred = FrameQueue(queue_size, drop_oldest)
+    threads = [
+        threading.Thread(target=decode_stage, args=(cap, decoded, timer, stop, max_frames), daemon=True),
+        threading.Thread(target=inference_stage, args=(infer, decoded, inferred, timer, stop), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    fps_meter = FpsMeter()
+    frames = 0
+    start_time = time.perf_counter()
+    while True:
+        item = inferred.get()
+        if item is None:
+            break
+        index, frame, result = item
+        fps_meter.tick()
+        start = time.perf_counter()
+        quit_requested = render(index, frame, result, timer, fps_meter.fps)
+        timer.add("render", time.perf_counter() - start)
+        frames += 1
+        if quit_requested:
+            stop.set()
+            break
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    seconds = time.perf_counter() - start_time
+    return {"frames": frames, "seconds": seconds, "fps": frames / seconds if seconds else 0.0,
+            "dropped": decoded.dropped + inferred.dropped, "stages": timer.summary()}
+
+
+def batch_decode_stage(cap, out_queue, batch_size, timer, stop, max_frames=None):
+    """Stadio di decodifica per la modalità a batch: passa liste di (indice, frame, istante di decodifica)."""
+    batch = []
+    index = 0
+    while not stop.is_set() and (max_frames is None or index < max_frames):
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timer.add("decode", time.perf_counter() - start)
+        batch.append((index, frame, time.perf_counter()))
+        index += 1
+        if len(batch) == batch_size:
+            out_queue.put(batch, stop)
+            batch = []
+    if batch:
+        out_queue.put(batch, stop)
+    out_queue.put(None, stop)
+
+
+def run_batched(cap, infer_batch, batch_size, on_result=None, max_frames=None, queue_size=2):
+    """
+    Elaborazione offline a batch: la decodifica (su un thread) raggruppa batch_size frame, che vengono passati
+    al modello con una sola chiamata. I risultati tornano nell'ordine dei frame e vengono consegnati a on_result
+    con l'indice del frame.
+
+    Un batch più grande riduce il costo fisso per chiamata (Python, framework) e usa meglio i core della CPU,
+    ma ogni frame aspetta che il batch si riempia e che tutto il batch sia elaborato: la latenza riportata è
+    il tempo tra la decodifica del frame e la disponibilità del suo risultato.
+
+    Args:
+        cap (cv2.VideoCapture): Sorgente.
+        infer_batch (callable): lista di frame -> lista di risultati nello stesso ordine.
+        batch_size (int): Frame per chiamata al modello.
+        on_result (callable): (opzionale) (indice, frame, risultato) -> None, chiamata in ordine di frame.
+        max_frames (int): (opzionale) numero massimo di frame.
+
+    Returns:
+        dict: {"frames", "seconds", "fps", "batch_size", "latency_ms": {p50, p90, p99}, "stages"}
+    """
+    timer = StageTimer()
+    stop = threading.Event()
+    batches = FrameQueue(queue_size)
+    thread = threading.Thread(target=batch_decode_stage, args=(cap, batches, batch_size, timer, stop, max_frames), daemon=True)
+    thread.start()
+
+    frames = 0
+    start_time = time.perf_counter()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            start = time.perf_counter()
+            results = infer_batch([frame for _, frame, _ in batch])
+            done = time.perf_counter()
+            timer.add("inference_batch", done - start)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Il modello ha restituito {len(results)} risultati per {len(batch)} frame")
+            for (index, frame, decoded_at), result in zip(batch, results):
+                timer.add("latency", done - decoded_at)
+                if on_result is not None:
+                    on_result(index, frame, result)
+            frames += len(batch)
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+    seconds = time.perf_counter() - start_time
+    return {"frames": frames, "seconds": seconds, "fps": frames / seconds if seconds else 0.0, "batch_size": batch_size,
+            "latency_ms": timer.percentiles_ms("latency"), "stages": timer.summary()}
+
+
+def draw_overlay(image, fps, timer=None):
+    """Disegna FPS (e, se disponibili, i tempi medi per stadio) sul frame annotato."""
+    cv2.putText(image, f"FPS: {int(fps)}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    if timer is not None:
+        text = "  ".join(f"{stage} {timer.mean_ms(stage):.1f}ms" for stage in ("decode", "inference", "render"))
+        cv2.putText(image, text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return image
+
+
+def print_stages(stats):
+    """Riepilogo finale: FPS end-to-end, frame scartati e tempo medio di ogni stadio."""
+    dropped = f", {stats['dropped']} frame scartati" if stats.get("dropped") else ""
+    print(f"\n{stats['frames']} frame in {stats['seconds']:.2f}s: {stats['fps']:.1f} FPS end-to-end{dropped}")
+    for stage, (count, mean_ms) in stats["stages"].items():
+        print(f"  {stage}: {mean_ms:.1f} ms/frame ({count} frame)")
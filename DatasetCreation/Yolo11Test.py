@@ -1,51 +1,239 @@
+import argparse
+import glob
+import os
 import torch
-from ultralytics import YOLO
 import cv2
 import time
 
-# Carica il modello YOLO
-model = YOLO("../yolo11n.pt")
-print(model.names)
+from DetectionCache import RECORD_CONF, CachingDetector, DetectionCache, cache_path_for, draw_detections, replay
+from KeyframeTracker import KeyframeTracker
+from ModelExport import BACKENDS, detections_array, load_detector
+from VideoPipeline import (WINDOW_NAME, FpsMeter, draw_overlay, handle_keys, open_source, print_stages, run_batched,
+                           run_pipeline)
 
-cap = cv2.VideoCapture("../Video/video1.mp4")
 
-# Ottieni le dimensioni originali del video
-original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+def run_sequential(model, cap, imgsz):
+    """Modalità originale: lettura, detection e visualizzazione uno dopo l'altro nello stesso thread."""
+    prev_time = 0
 
-# Crea una finestra fullscreen o ridimensionabile
-cv2.namedWindow("Object Detection", cv2.WINDOW_NORMAL)
-cv2.resizeWindow("Object Detection", original_width, original_height)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
 
-prev_time = 0
+        # Esegui la detection
+        with torch.no_grad():
+            results = model(frame, imgsz=imgsz)
+        annotated_frame = results[0].plot()
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
+        # Calcola FPS
+        curr_time = time.time()
+        fps = 1 / (curr_time - prev_time)
+        prev_time = curr_time
+        cv2.putText(annotated_frame, f"FPS: {int(fps)}", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
-    # Esegui la detection
-    with torch.no_grad():
-        results = model(frame, imgsz=320)
-    annotated_frame = results[0].plot()
+        # Mostra il frame ridimensionato
+        cv2.imshow(WINDOW_NAME, annotated_frame)
 
-    # Calcola FPS
-    curr_time = time.time()
-    fps = 1 / (curr_time - prev_time)
-    prev_time = curr_time
-    cv2.putText(annotated_frame, f"FPS: {int(fps)}", (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        # Opzioni di controllo (q esce, f schermo intero)
+        if handle_keys(cv2.waitKey(1)):
+            break
 
-    # Mostra il frame ridimensionato
-    cv2.imshow("Object Detection", annotated_frame)
 
-    # Opzioni di controllo
-    key = cv2.waitKey(1)
-    if key == ord('q'):  # Esci
-        break
-    elif key == ord('f'):  # Toggle fullscreen
-        cv2.setWindowProperty("Object Detection", cv2.WND_PROP_FULLSCREEN,
-                              not cv2.getWindowProperty("Object Detection", cv2.WND_PROP_FULLSCREEN))
+def run_pipelined(model, cap, imgsz, queue_size, drop_oldest):
+    """
+    Modalità pipeline: decodifica, inferenza e visualizzazione si sovrappongono (vedi VideoPipeline.run_pipeline),
+    quindi gli FPS sono limitati dallo stadio più lento invece che dalla somma dei tre.
+    """
+    def infer(frame):
+        with torch.no_grad():
+            return model(frame, imgsz=imgsz, verbose=False)[0]
 
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+    def render(index, frame, result, timer, fps):
+        annotated_frame = draw_overlay(result.plot(), fps, timer)
+        cv2.imshow(WINDOW_NAME, annotated_frame)
+        return handle_keys(cv2.waitKey(1))
+
+    print_stages(run_pipeline(cap, infer, render, queue_size, drop_oldest))
+
+
+def run_keyframe(model, cap, imgsz, max_interval):
+    """
+    Modalità keyframe: detection ogni N frame (o a un cambio di scena), box propagati con il flusso ottico
+    nei frame intermedi; N si adatta al movimento (vedi KeyframeTracker).
+    """
+    def detect(frame):
+        with torch.no_grad():
+            return detections_array(model(frame, imgsz=imgsz, verbose=False)[0])
+
+    tracker = KeyframeTracker(detect, max_interval)
+    fps_meter = FpsMeter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        detections, keyframe = tracker(frame)
+        fps_meter.tick()
+        annotated_frame = draw_overlay(draw_detections(frame, detections, model.names), fps_meter.fps)
+        cv2.putText(annotated_frame, f"N {tracker.interval}" + (" KEY" if keyframe else ""), (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        cv2.imshow(WINDOW_NAME, annotated_frame)
+        if handle_keys(cv2.waitKey(1)):
+            break
+    print(f"{tracker.keyframes} keyframe su {tracker.frames} frame")
+
+
+def run_offline(model, video, imgsz, batch_size, save_dir=None, max_frames=None):
+    """
+    Modalità offline a batch (senza finestra): batch_size frame per chiamata al modello, risultati in ordine di frame.
+    Con save_dir scrive il video annotato con lo stesso nome del video sorgente.
+    """
+    cap, _ = open_source(video)
+    writer = None
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        writer = cv2.VideoWriter(os.path.join(save_dir, os.path.basename(video)), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+    detections = []
+
+    def infer_batch(frames):
+        with torch.no_grad():
+            return model(frames, imgsz=imgsz, verbose=False)
+
+    def on_result(index, frame, result):
+        detections.append(len(result.boxes))
+        if writer is not None:
+            writer.write(result.plot())
+
+    stats = run_batched(cap, infer_batch, batch_size, on_result, max_frames)
+    cap.release()
+    if writer is not None:
+        writer.release()
+    stats["detections"] = sum(detections)
+    return stats
+
+
+def replay_offline(video, cache_path, conf, save_dir=None):
+    """Modalità offline con detection già in cache: nessuna inferenza; con save_dir il video annotato viene ridisegnato."""
+    cap, _ = open_source(video)
+    writer = None
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        writer = cv2.VideoWriter(os.path.join(save_dir, os.path.basename(video)), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    cache = DetectionCache(cache_path)
+
+    def on_frame(index, frame, detections):
+        writer.write(draw_detections(frame, detections, cache.names))
+
+    stats = replay(cap, cache, conf, show=False, on_frame=on_frame if writer is not None else None)
+    cap.release()
+    if writer is not None:
+        writer.release()
+    print(f"{os.path.basename(video)} | replay dalla cache: {stats['frames']} frame, {stats['fps']:.1f} FPS, "
+          f"{stats['detections']} detection")
+
+
+def save_if_complete(model, path, video, frame_count, args):
+    """Salva la cache solo se il video è stato elaborato tutto (un'esecuzione interrotta non va riusata)."""
+    if model.frames < frame_count:
+        print(f"Cache non salvata: elaborati {model.frames} frame su {frame_count}")
+        return
+    model.save(path, {"video": video, "model": args.model, "backend": args.backend, "imgsz": args.imgsz,
+                      "record_conf": RECORD_CONF})
+    print(f"Detection salvate in cache: {path}")
+
+
+def print_offline(video, stats):
+    latency = stats["latency_ms"]
+    print(f"{os.path.basename(video)} | batch {stats['batch_size']:>3}: {stats['frames']} frame, {stats['fps']:.1f} FPS, "
+          f"latenza p50 {latency['p50']:.0f} ms / p90 {latency['p90']:.0f} ms, {stats['detections']} detection")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detection YOLO su video o webcam.")
+    parser.add_argument("--model", default="../yolo11n.pt", help="Modello YOLO (default: ../yolo11n.pt)")
+    parser.add_argument("--source", default="../Video/video1.mp4", help="Video oppure indice della webcam (default: ../Video/video1.mp4)")
+    parser.add_argument("--imgsz", type=int, default=320, help="Dimensione di input del modello (default: 320)")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS,
+                        help="torch (default), onnx oppure onnx-int8: l'export viene creato alla prima esecuzione e poi riusato")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di calcolo del backend (default: quelli del backend)")
+    parser.add_argument("--pipeline", action="store_true", help="Decodifica, inferenza e visualizzazione in thread separati")
+    parser.add_argument("--queue-size", type=int, default=4, help="Dimensione delle code tra gli stadi (default: 4)")
+    parser.add_argument("--drop-oldest", action="store_true", default=None,
+                        help="Scarta i frame più vecchi se l'inferenza è in ritardo (default: solo per la webcam)")
+    parser.add_argument("--batch", type=int, default=None,
+                        help="Modalità offline a batch (senza finestra): frame per chiamata al modello; --source accetta un glob, es. '../Video/*.mp4'")
+    parser.add_argument("--sweep", type=int, nargs="*", default=None,
+                        help="Confronta più dimensioni di batch (es. --sweep 1 2 4 8 16): throughput e latenza per ognuna")
+    parser.add_argument("--max-frames", type=int, default=None, help="Frame massimi per video in modalità offline")
+    parser.add_argument("--save-dir", default=None, help="Modalità offline: cartella dove salvare i video annotati")
+    parser.add_argument("--keyframe", type=int, default=None,
+                        help="Detection al più ogni N frame con tracking nei frame intermedi (N si riduce con il movimento)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Riusa le detection salvate per questo video e modello (replay senza inferenza), altrimenti le salva")
+    parser.add_argument("--conf", type=float, default=0.25, help="Con --cache: soglia di confidenza mostrata (default: 0.25)")
+    args = parser.parse_args()
+
+    # Carica il modello YOLO (sul backend scelto)
+    model = load_detector(args.model, args.backend, args.imgsz, args.threads)
+    print(model.names)
+
+    if args.batch or args.sweep:
+        videos = sorted(glob.glob(args.source)) or [args.source]
+        for video in videos:
+            for batch_size in args.sweep or [args.batch]:
+                save_dir = args.save_dir if not args.sweep else None
+                cache_path = cache_path_for(video, args.model, args.backend, args.imgsz) if args.cache and not args.sweep else None
+                if cache_path and os.path.exists(cache_path):
+                    replay_offline(video, cache_path, args.conf, save_dir)
+                    continue
+                if cache_path:
+                    recorder = CachingDetector(model, args.conf)
+                    stats = run_offline(recorder, video, args.imgsz, batch_size, save_dir, args.max_frames)
+                    probe = cv2.VideoCapture(video)
+                    frame_count = int(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+                    probe.release()
+                    save_if_complete(recorder, cache_path, video, frame_count, args)
+                else:
+                    stats = run_offline(model, video, args.imgsz, batch_size, save_dir, args.max_frames)
+                print_offline(video, stats)
+    else:
+        cap, live = open_source(args.source)
+        cache_path = cache_path_for(args.source, args.model, args.backend, args.imgsz) if args.cache and not live else None
+
+        # Ottieni le dimensioni originali del video
+        original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Crea una finestra fullscreen o ridimensionabile
+        cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(WINDOW_NAME, original_width, original_height)
+
+        if cache_path and os.path.exists(cache_path):
+            # Detection già in cache: nessuna inferenza, solo decodifica e disegno alla soglia scelta
+            stats = replay(cap, DetectionCache(cache_path), args.conf)
+            print(f"Replay dalla cache: {stats['frames']} frame, {stats['fps']:.1f} FPS, {stats['detections']} detection")
+        else:
+            # La modalità keyframe non esegue il detector su tutti i frame: niente da registrare in cache
+            if args.keyframe:
+                cache_path = None
+            if cache_path:
+                model = CachingDetector(model, args.conf)
+            if args.keyframe:
+                run_keyframe(model, cap, args.imgsz, args.keyframe)
+            elif args.pipeline:
+                drop_oldest = live if args.drop_oldest is None else args.drop_oldest
+                # In registrazione nessun frame può essere scartato: l'indice del frame è la posizione nel video
+                run_pipelined(model, cap, args.imgsz, args.queue_size, drop_oldest and not cache_path)
+            else:
+                run_sequential(model, cap, args.imgsz)
+            if cache_path:
+                save_if_complete(model, cache_path, args.source, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), args)
+
+        cap.release()
+        cv2.destroyAllWindows()